@@ -3,8 +3,9 @@ from .models import (
     UserProfile, TokenPackage, TokenTransaction, 
     Design, Order, Cart,
     EmailVerificationToken, PasswordResetToken,
-    Conversation, Message
+    Conversation, Message, OrderFileMetrics, OrderOutputFile, ArchivedPartition, ArchivedPurchaseTotal
 )
+from .order_files import analyse_output_uploads, delete_on_commit, save_upload_analysis
 
 @admin.register(UserProfile)
 class UserProfileAdmin(admin.ModelAdmin):
@@ -30,20 +31,56 @@ class DesignAdmin(admin.ModelAdmin):
     search_fields = ['user__username', 'name', 'prompt']
     readonly_fields = ['created_at', 'updated_at']
 
+class OrderOutputFileInline(admin.TabularInline):
+    model = OrderOutputFile
+    extra = 0
+    fields = ['format', 'file', 'size', 'sha256', 'created_at']
+    readonly_fields = ['size', 'sha256', 'created_at']
+    verbose_name_plural = 'Output files (upload completed embroidery files here after manual digitization)'
+
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
     list_display = ['order_number', 'user', 'design', 'status', 'email_sent', 'created_at']
     list_filter = ['status', 'email_sent', 'created_at']
+    # icontains on these three is served by the pg_trgm indexes (api.search_index)
     search_fields = ['order_number', 'user__username', 'design__name']
     readonly_fields = ['order_number', 'created_at', 'updated_at']
+    inlines = [OrderOutputFileInline]
+    
+    def save_formset(self, request, form, formset, change):
+        if formset.model is not OrderOutputFile:
+            return super().save_formset(request, form, formset, change)
+        
+        # Files uploaded here get the same size, digest, metrics and preview
+        # as ones uploaded through the API (admin_upload_files)
+        order = formset.instance
+        uploads = {
+            f.cleaned_data['format'].lower(): f.cleaned_data['file']
+            for f in formset.forms
+            if 'file' in f.changed_data and f.cleaned_data and not f.cleaned_data.get('DELETE')
+        }
+        analysis = analyse_output_uploads(order, uploads) if uploads else None
+        for f in formset.forms:
+            if f.instance.pk and 'file' in f.changed_data and f.initial.get('file'):
+                delete_on_commit(f.initial['file'])
+        
+        for output in formset.save(commit=False):
+            format_code = output.format.lower()
+            if format_code in uploads:
+                output.size = uploads[format_code].size
+                output.sha256 = analysis['sha256'][format_code]
+            output.save()
+        for output in formset.deleted_objects:
+            output.delete()
+        formset.save_m2m()
+        
+        if analysis:
+            save_upload_analysis(order, analysis)
+            order.save(update_fields=['stitch_preview', 'stitch_preview_thumbnail'])
     fieldsets = (
         ('Order Information', {
             'fields': ('order_number', 'user', 'design', 'status', 'tokens_used')
         }),
-        ('Output Files', {
-            'fields': ('output_dst', 'output_pes', 'output_jef', 'output_exp', 'output_vp3', 'output_xxx'),
-            'description': 'Upload completed embroidery files here after manual digitization'
-        }),
         ('Notifications', {
             'fields': ('email_sent', 'notification_sent_at')
         }),
@@ -87,3 +124,25 @@ class MessageAdmin(admin.ModelAdmin):
     list_filter = ['is_read', 'created_at']
     search_fields = ['sender__username', 'content', 'conversation__order__order_number']
     readonly_fields = ['created_at', 'read_at']
+
+
+@admin.register(OrderFileMetrics)
+class OrderFileMetricsAdmin(admin.ModelAdmin):
+    list_display = ['order', 'format', 'stitch_count', 'color_changes', 'trims', 'estimated_seconds']
+    list_filter = ['format', 'machine_brand']
+    search_fields = ['order__order_number']
+    readonly_fields = ['created_at', 'updated_at']
+
+
+@admin.register(ArchivedPartition)
+class ArchivedPartitionAdmin(admin.ModelAdmin):
+    list_display = ['table', 'month', 'row_count', 'size', 'created_at']
+    list_filter = ['table']
+    readonly_fields = ['table', 'month', 'file', 'row_count', 'size', 'created_at']
+
+
+@admin.register(ArchivedPurchaseTotal)
+class ArchivedPurchaseTotalAdmin(admin.ModelAdmin):
+    list_display = ['month', 'package', 'purchases', 'tokens']
+    list_filter = ['package']
+    readonly_fields = ['month', 'package', 'purchases', 'tokens']
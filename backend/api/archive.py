@@ -0,0 +1,176 @@
+"""
+Archival of old months of the append-only history tables.
+
+TokenTransaction and Message rows older than the retention window are
+written, one calendar month (UTC) at a time, to a gzip'd JSON Lines file in
+default storage and recorded as an ArchivedPartition (token purchases also as
+ArchivedPurchaseTotal rows, for the sales stats). The month then leaves
+the hot table: on PostgreSQL its partition is detached and dropped (see
+api.partitions), elsewhere its rows are deleted. Archived months stay
+readable one month per page through read_archive() / archive_page().
+"""
+import collections
+import datetime
+import gzip
+import json
+import tempfile
+
+from django.apps import apps
+from django.contrib.postgres.search import SearchVectorField
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+
+from .models import ArchivedPartition, ArchivedPurchaseTotal, Message, TokenPackage, TokenTransaction
+from .partitions import (
+    PARTITIONED_TABLES, add_months, drop_partition, is_partitioned, lock_partition, month_partitions,
+)
+
+ARCHIVED_MODELS = (TokenTransaction, Message)
+
+
+def _month_range(month):
+    start = datetime.datetime(month.year, month.month, 1, tzinfo=datetime.timezone.utc)
+    end_month = add_months(month, 1)
+    return start, start.replace(year=end_month.year, month=end_month.month)
+
+
+def parse_month(value):
+    """'YYYY-MM' -> first day of that month; raises ValueError"""
+    return datetime.datetime.strptime(value, '%Y-%m').date()
+
+
+def months_to_archive(model, cutoff):
+    """Months holding `model` rows created before the `cutoff` month"""
+    start, _ = _month_range(cutoff)
+    return [
+        value.date() for value in model.objects.filter(created_at__lt=start)
+        .datetimes('created_at', 'month', tzinfo=datetime.timezone.utc)
+    ]
+
+
+def _archive_lines(record):
+    if record is None or not record.file:
+        return
+    with record.file.open('rb') as raw, gzip.open(raw, 'rt') as lines:
+        yield from lines
+
+
+def archive_month(model, month):
+    """
+    Move `model`'s rows of `month` out of the hot table into its archive file.
+    A month archived before (rows written late with an old created_at) is
+    rewritten with the old and new rows together. Returns the ArchivedPartition.
+    """
+    label = model._meta.label_lower
+    start, end = _month_range(month)
+    rows = model.objects.filter(created_at__gte=start, created_at__lt=end)
+    previous = ArchivedPartition.objects.filter(table=label, month=month).first()
+    # Search vectors are derived from the row; no need to keep them
+    columns = [field.attname for field in model._meta.concrete_fields
+               if not isinstance(field, SearchVectorField)]
+
+    row_count = 0
+    archived_ids = []
+    purchases = collections.defaultdict(lambda: [0, 0])  # package_id -> [purchases, tokens]
+
+    def count_purchase(row):
+        if model is TokenTransaction and row['type'] == 'purchase':
+            totals = purchases[row['package_id']]
+            totals[0] += 1
+            totals[1] += row['amount']
+
+    table = model._meta.db_table
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            drop = (connection.vendor == 'postgresql' and table in PARTITIONED_TABLES
+                    and is_partitioned(cursor, table) and month in month_partitions(cursor, table))
+            if drop:
+                # Held until the partition is dropped: nothing lands in it unexported
+                lock_partition(cursor, table, month)
+
+        with tempfile.TemporaryFile() as spool:
+            with gzip.GzipFile(fileobj=spool, mode='wb') as archive:
+                for line in _archive_lines(previous):
+                    archive.write(line.encode())
+                    count_purchase(json.loads(line))
+                    row_count += 1
+                for row in rows.order_by('id').values(*columns).iterator(chunk_size=2000):
+                    archive.write(json.dumps(row, cls=DjangoJSONEncoder).encode() + b'\n')
+                    count_purchase(row)
+                    archived_ids.append(row['id'])
+                    row_count += 1
+            size = spool.tell()
+            spool.seek(0)
+            name = f"archives/{label}/{month:%Y-%m}.jsonl.gz"
+            # Rewritten in place, so a rerun after a failure never leaves a stray copy
+            default_storage.delete(name)
+            name = default_storage.save(name, File(spool))
+
+        record, _ = ArchivedPartition.objects.update_or_create(
+            table=label, month=month,
+            defaults={'file': name, 'row_count': row_count, 'size': size},
+        )
+        # Recounted from the whole file, so a rewritten month replaces its totals.
+        # Rows of packages deleted since they were archived count as no package.
+        existing = set(TokenPackage.objects.filter(id__in=purchases).values_list('id', flat=True))
+        ArchivedPurchaseTotal.objects.filter(month=month).delete()
+        ArchivedPurchaseTotal.objects.bulk_create(
+            ArchivedPurchaseTotal(
+                month=month, package_id=package_id if package_id in existing else None,
+                purchases=count, tokens=tokens,
+            )
+            for package_id, (count, tokens) in purchases.items()
+        )
+        if drop:
+            with connection.cursor() as cursor:
+                drop_partition(cursor, table, month)
+        else:
+            # Only the exported rows: one written meanwhile waits for the next run
+            for offset in range(0, len(archived_ids), 2000):
+                model.objects.filter(id__in=archived_ids[offset:offset + 2000]).delete()
+    return record
+
+
+def read_archive(record, **match):
+    """
+    Unsaved `record.table` instances from the archive file whose fields equal
+    `match` (by attname, e.g. user_id=...), in id order
+    """
+    model = apps.get_model(record.table)
+    fields = model._meta.concrete_fields
+    for line in _archive_lines(record):
+        row = json.loads(line)
+        if all(row.get(key) == value for key, value in match.items()):
+            yield model(**{
+                field.attname: field.to_python(row[field.attname])
+                for field in fields if field.attname in row
+            })
+
+
+def archive_page(model, month=None, **match):
+    """
+    One archived month of `model` rows matching `match`, newest first.
+
+    `month` is 'YYYY-MM'; the newest archived month at or before it is
+    served, by default the newest of all. Returns (rows, page) where page
+    carries the month served and `older_month`, the next archived month to
+    request, or None at the end of history. Raises ValueError for a
+    malformed month.
+    """
+    archives = ArchivedPartition.objects.filter(table=model._meta.label_lower).order_by('-month')
+    if month:
+        archives = archives.filter(month__lte=parse_month(month))
+    records = list(archives[:2])
+    if not records:
+        return [], {"month": None, "older_month": None}
+
+    record = records[0]
+    rows = list(read_archive(record, **match))
+    rows.reverse()
+    older = records[1].month if len(records) > 1 else None
+    return rows, {
+        "month": f"{record.month:%Y-%m}",
+        "older_month": f"{older:%Y-%m}" if older else None,
+    }
@@ -0,0 +1,103 @@
+"""
+Per-process memoization with cross-worker invalidation.
+
+Each gunicorn worker keeps its own copy of rarely-changing data (pricing
+tiers, configuration rows). A version stamp stored in the shared Django
+cache tells a worker when its copy is stale: writers bump the stamp, and
+readers reload only when the stamp differs from the one their copy was
+built under. Checking the stamp is a cache lookup, never a database query.
+"""
+import copy
+import threading
+import uuid
+
+from django.core.cache import cache
+from django.db import models, transaction
+
+_MISSING = object()
+
+
+class VersionedValue:
+    """
+    A value built by `loader()` and memoized until `invalidate()` is called
+    in any process sharing the cache.
+    """
+
+    def __init__(self, key, loader):
+        self.key = f"version:{key}"
+        self.loader = loader
+        self._lock = threading.RLock()
+        self._value = _MISSING
+        self._version = None
+
+    def version(self):
+        version = cache.get(self.key)
+        if version is None:
+            # First use, or the stamp was evicted: every copy built so far is suspect
+            cache.add(self.key, uuid.uuid4().hex, None)
+            version = cache.get(self.key)
+        return version
+
+    def get(self):
+        # Read the stamp before loading so a concurrent bump forces another reload
+        version = self.version()
+        if version is None:
+            # No shared cache (e.g. DummyCache): nothing can invalidate a copy
+            return self.loader()
+        if self._value is _MISSING or self._version != version:
+            with self._lock:
+                if self._value is _MISSING or self._version != version:
+                    self._value = self.loader()
+                    self._version = version
+        return self._value
+
+    def invalidate(self):
+        """Mark every process's copy stale, including this one"""
+        cache.set(self.key, uuid.uuid4().hex, None)
+        with self._lock:
+            self._value = _MISSING
+
+
+class CachedSingletonModel(models.Model):
+    """
+    Base for configuration models that hold a single row (pk=1).
+
+    `get_solo()` returns the row from a per-process copy, so reading the
+    configuration costs a cache lookup instead of a query. Saving or deleting
+    the row bumps its version stamp, now and again on commit, so every worker
+    reloads it on next use.
+    """
+
+    _solo_values = {}
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def _solo(cls):
+        if cls not in cls._solo_values:
+            cls._solo_values[cls] = VersionedValue(
+                f"singleton:{cls._meta.label_lower}",
+                lambda: cls.objects.get_or_create(pk=1)[0],
+            )
+        return cls._solo_values[cls]
+
+    @classmethod
+    def get_solo(cls):
+        """The configuration row, created with defaults on first use"""
+        # Copy so callers that modify the instance never touch the shared one
+        return copy.copy(cls._solo().get())
+
+    @classmethod
+    def invalidate_solo(cls):
+        cls._solo().invalidate()
+        transaction.on_commit(cls._solo().invalidate)
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self.invalidate_solo()
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        self.invalidate_solo()
+        return result
@@ -0,0 +1,55 @@
+"""
+Order submission for cart checkout and create_order.
+
+A checkout is written in one short transaction with a fixed number of
+queries however many items the cart holds: one ledger debit for the total,
+one block of order numbers, one bulk INSERT for the orders, one bulk
+UPDATE for the designs and one DELETE for the cart.
+"""
+from django.db import transaction
+from django.utils import timezone
+
+from . import ledger
+from .models import Cart, Design, Order
+from .order_numbers import allocate_order_numbers
+
+
+def submit_orders(user, order_costs, requested_formats, clear_cart=False):
+    """
+    Charge `user` and create one submitted order per item of order_costs
+    ({'design', 'size_cm', 'tokens_cost'}), marking the designs as processing.
+
+    Raises ledger.InsufficientTokens, in which case nothing is written.
+    Returns the created orders, with primary keys.
+    """
+    with transaction.atomic():
+        ledger.debit(
+            user, sum(item['tokens_cost'] for item in order_costs),
+            f"Submitted {len(order_costs)} order(s) for digitization"
+        )
+
+        order_numbers = allocate_order_numbers(len(order_costs))
+        orders = Order.objects.bulk_create(
+            Order(
+                order_number=order_number,
+                user=user,
+                design=item['design'],
+                status='submitted',
+                tokens_used=item['tokens_cost'],
+                embroidery_size_cm=item['size_cm'],
+                requested_formats=requested_formats,
+            )
+            for item, order_number in zip(order_costs, order_numbers)
+        )
+
+        # A design ordered twice in one cart is updated once
+        designs = list({item['design'].pk: item['design'] for item in order_costs}.values())
+        now = timezone.now()
+        for design in designs:
+            design.status = 'processing'
+            design.updated_at = now
+        Design.objects.bulk_update(designs, ['status', 'updated_at'])
+
+        if clear_cart:
+            Cart.objects.filter(user=user).delete()
+    return orders
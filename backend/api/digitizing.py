@@ -0,0 +1,136 @@
+"""
+Automatic digitizing of designs.
+
+The expensive part of raster-to-stitch conversion is colour segmentation and
+tracing. Its result (colour regions as polygons) is cached per design in
+DesignGeometry, so changing only the embroidery size re-stitches the cached
+geometry instead of reprocessing the image.
+"""
+import io
+import uuid
+
+import pyembroidery
+from django.conf import settings
+from django.core.files.base import ContentFile
+
+from .models import DesignGeometry
+from .utils.digitizer import EmbroideryDigitizer, pattern_to_bytes, writable_formats
+
+DEFAULT_STITCH_FORMAT = 'dst'
+
+# Embroidery sizes the studio accepts, in centimetres
+MIN_SIZE_CM = 5
+MAX_SIZE_CM = 40
+
+
+def parse_size_cm(value):
+    """A requested embroidery size as int cm; ValueError unless a whole number in range"""
+    try:
+        size_cm = int(value)
+    except (TypeError, ValueError):
+        size_cm = None
+    if size_cm is None or str(size_cm) != str(value).strip() or not MIN_SIZE_CM <= size_cm <= MAX_SIZE_CM:
+        raise ValueError(f"embroidery_size_cm must be a whole number between {MIN_SIZE_CM} and {MAX_SIZE_CM}")
+    return size_cm
+
+
+def get_digitizer(size_cm):
+    return EmbroideryDigitizer(
+        size_cm=size_cm,
+        num_colors=settings.DIGITIZER_NUM_COLORS,
+        tile_size=settings.DIGITIZER_TILE_SIZE,
+        workers=settings.DIGITIZER_WORKERS,
+        parallel_min_pixels=settings.DIGITIZER_PARALLEL_MIN_PIXELS,
+    )
+
+
+def design_source_image(design):
+    """The image a design is digitized from (embroidery preview first)"""
+    return design.embroidery_preview or design.normal_image
+
+
+def stitch_format_for(design):
+    requested = (design.requested_format or '').lower()
+    return requested if requested in writable_formats() else DEFAULT_STITCH_FORMAT
+
+
+def digitize_design(design, size_cm=None, parallel=None):
+    """
+    Produce a stitch file for a design at the given size.
+
+    Returns (geometry, reused) where reused tells whether the cached geometry
+    was rescaled instead of re-tracing the image. `parallel` forces tracing
+    on or off the process pool (None: decided by image size).
+    """
+    size_cm = parse_size_cm(size_cm or design.embroidery_size_cm)
+    source = design_source_image(design)
+    if not source:
+        raise ValueError("Design has no image to digitize")
+
+    digitizer = get_digitizer(size_cm)
+    record = DesignGeometry.objects.filter(design=design).first()
+    reused = bool(record and record.geometry_file and record.source_image == source.name)
+
+    if reused:
+        with record.geometry_file.open('rb') as fh:
+            geometry = digitizer.load_geometry(fh)
+    else:
+        with source.open('rb') as fh:
+            geometry = digitizer.vectorize(fh, parallel=parallel)
+        buffer = io.BytesIO()
+        digitizer.save_geometry(geometry, buffer)
+
+        record = record or DesignGeometry(design=design)
+        if record.geometry_file:
+            record.geometry_file.delete(save=False)
+        record.source_image = source.name
+        record.geometry_file.save(
+            f"geometry_{design.id}_{uuid.uuid4().hex[:8]}.npz",
+            ContentFile(buffer.getvalue()),
+            save=False,
+        )
+
+    save_stitches(record, digitizer, geometry, design, size_cm)
+    return record, reused
+
+
+def save_stitches(record, digitizer, geometry, design, size_cm):
+    """Stitch geometry at size_cm into record's stitch file and save the record"""
+    pattern = digitizer.stitch_geometry(geometry)
+    extension = stitch_format_for(design)
+    if record.stitch_file:
+        record.stitch_file.delete(save=False)
+    record.stitch_file.save(
+        f"stitches_{design.id}_{size_cm}cm.{extension}",
+        ContentFile(pattern_to_bytes(pattern, extension)),
+        save=False,
+    )
+    record.stitch_size_cm = size_cm
+    record.stitch_count = pattern.count_stitch_commands(pyembroidery.STITCH)
+    record.save()
+
+
+def restitch_cached(design):
+    """
+    Bring the cached stitch file in line with the design's size and format.
+
+    Only stitching runs (no tracing), so this is cheap enough for a settings
+    update. Does nothing when there is no cached geometry for the current
+    image; the next digitize traces it. Returns the record when re-stitched.
+    """
+    record = DesignGeometry.objects.filter(design=design).first()
+    source = design_source_image(design)
+    if not (record and record.geometry_file and source and record.source_image == source.name):
+        return None
+
+    size_cm = parse_size_cm(design.embroidery_size_cm)
+    extension = stitch_format_for(design)
+    if (record.stitch_file and record.stitch_size_cm == size_cm
+            and record.stitch_file.name.endswith(f".{extension}")):
+        return None
+
+    digitizer = get_digitizer(size_cm)
+    with record.geometry_file.open('rb') as fh:
+        geometry = digitizer.load_geometry(fh)
+    save_stitches(record, digitizer, geometry, design, size_cm)
+    return record
@@ -0,0 +1,80 @@
+"""
+Token ledger.
+
+Every balance change goes through debit() or credit(). The balance is
+updated by a single conditional UPDATE (tokens = tokens + delta, and for
+debits only WHERE tokens >= amount), so concurrent requests can neither
+lose an update nor overdraw. The resulting balance is written to the
+TokenTransaction in the same database transaction, so history rows carry
+a true balance_after.
+"""
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import PaymentFulfillment, TokenTransaction, UserProfile
+
+
+class InsufficientTokens(Exception):
+    def __init__(self, required, available):
+        super().__init__(f"Insufficient tokens: {required} required, {available} available")
+        self.required = required
+        self.available = available
+
+
+def _apply(user, delta, transaction_type, description, package=None):
+    with transaction.atomic():
+        profiles = UserProfile.objects.filter(user=user)
+        if delta < 0:
+            profiles = profiles.filter(tokens__gte=-delta)
+        if not profiles.update(tokens=F('tokens') + delta, updated_at=timezone.now()):
+            available = UserProfile.objects.filter(user=user).values_list('tokens', flat=True).first()
+            raise InsufficientTokens(-delta, available or 0)
+
+        # The row stays locked by the UPDATE until commit, so this is our balance
+        balance = UserProfile.objects.filter(user=user).values_list('tokens', flat=True).get()
+        entry = TokenTransaction.objects.create(
+            user=user,
+            type=transaction_type,
+            amount=delta,
+            balance_after=balance,
+            description=description,
+            package=package,
+        )
+
+    # Keep an already-loaded request.user.profile in step with the database
+    if User.profile.is_cached(user):
+        user.profile.tokens = balance
+    return entry
+
+
+def debit(user, amount, description, transaction_type='usage'):
+    """Take `amount` tokens, raising InsufficientTokens if the balance is too low"""
+    return _apply(user, -abs(amount), transaction_type, description)
+
+
+def credit(user, amount, description, transaction_type='purchase', package=None):
+    """Add `amount` tokens, linking purchases to their TokenPackage"""
+    return _apply(user, abs(amount), transaction_type, description, package)
+
+
+def fulfill_payment(session_id, user, tokens, description, package=None):
+    """
+    Credit a paid checkout session exactly once.
+
+    The session is claimed by inserting its PaymentFulfillment row; a second
+    claim (webhook and verify_payment racing, or a replayed event) hits the
+    unique session_id and is skipped. Claim and credit commit together.
+    Returns the TokenTransaction, or None when the session was already
+    fulfilled.
+    """
+    with transaction.atomic():
+        try:
+            with transaction.atomic():
+                PaymentFulfillment.objects.create(
+                    session_id=session_id, user=user, package=package, tokens=tokens
+                )
+        except IntegrityError:
+            return None
+        return credit(user, tokens, description, package=package)
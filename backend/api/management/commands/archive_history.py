@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from api.archive import ARCHIVED_MODELS, archive_month, months_to_archive
+from api.partitions import PARTITIONED_TABLES, add_months, ensure_partitions, is_partitioned, month_start
+
+
+class Command(BaseCommand):
+    help = ('Archives token transactions and chat messages older than N months to compressed '
+            'files and creates the upcoming monthly partitions (run monthly)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months', type=int, default=12,
+                            help='Months of history to keep in the hot tables, counting the current one')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='List the months that would be archived without moving anything')
+
+    def handle(self, *args, **options):
+        if options['months'] < 1:
+            raise CommandError('--months must be at least 1')
+        cutoff = add_months(month_start(timezone.now()), 1 - options['months'])
+
+        if connection.vendor == 'postgresql' and not options['dry_run']:
+            with connection.cursor() as cursor:
+                for table in PARTITIONED_TABLES:
+                    if is_partitioned(cursor, table):
+                        for name in ensure_partitions(cursor, table):
+                            self.stdout.write(f"➕ Created partition {name}")
+
+        archived = 0
+        for model in ARCHIVED_MODELS:
+            label = model._meta.label_lower
+            for month in months_to_archive(model, cutoff):
+                if options['dry_run']:
+                    self.stdout.write(f"Would archive {label} {month:%Y-%m}")
+                    continue
+                record = archive_month(model, month)
+                archived += 1
+                self.stdout.write(f"📦 Archived {label} {month:%Y-%m}: {record.row_count} rows -> {record.file.name}")
+
+        if not options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(
+                f"✅ Archived {archived} month(s) older than {cutoff:%Y-%m}"
+            ))
@@ -0,0 +1,115 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from api.models import Cart, Conversation, Design, Message, Order, TokenTransaction
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'EXPLAINs the hot list/filter queries and checks each plan uses its index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=2000,
+                            help='Rows per table to seed (rolled back afterwards); 0 uses existing data')
+        parser.add_argument('--check', action='store_true',
+                            help='Exit with an error if any plan does not use its index')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                user, conversation = self.seed(options['seed'])
+                missing = self.explain_all(user, conversation, options['verbosity'])
+                # Never keep the seeded rows
+                raise _Rollback
+        except _Rollback:
+            pass
+
+        if missing and options['check']:
+            raise CommandError(f"Plans not using their index: {', '.join(missing)}")
+        if missing:
+            self.stdout.write(self.style.WARNING(f"\n⚠️ {len(missing)} plan(s) not using their index"))
+        else:
+            self.stdout.write(self.style.SUCCESS('\n✅ Every hot query uses its index'))
+
+    def hot_queries(self, user, conversation):
+        """(name, expected index, queryset) for the queries behind the list endpoints"""
+        # A reader who is one message behind, the usual case for unread counts
+        watermark = Message.objects.filter(conversation=conversation).order_by('-id').values_list('id', flat=True)[1:2]
+        watermark = watermark[0] if watermark else 0
+        return [
+            ('list_designs', 'design_user_created_idx',
+             Design.objects.filter(user=user).order_by('-created_at')[:50]),
+            ('list_orders', 'order_user_created_idx',
+             Order.objects.filter(user=user).order_by('-created_at')[:50]),
+            ('admin_list_orders?status=', 'order_status_created_idx',
+             Order.objects.filter(status='submitted').order_by('-created_at')[:50]),
+            ('token_transactions', 'tokentx_user_created_idx',
+             TokenTransaction.objects.filter(user=user).order_by('-created_at')[:50]),
+            ('view_cart', 'cart_user_added_idx',
+             Cart.objects.filter(user=user).order_by('-added_at')[:50]),
+            ('conversation_list', 'conversation_customer_upd_idx',
+             Conversation.objects.filter(customer=user).order_by('-updated_at')[:50]),
+            ('conversation last message', 'message_conv_created_idx',
+             Message.objects.filter(conversation=conversation).order_by('-created_at')[:1]),
+            ('conversation unread count', 'message_conversation_id_idx',
+             # As counted: COUNT(*) carries no ORDER BY
+             Message.objects.filter(conversation=conversation, id__gt=watermark).exclude(sender=user).order_by()),
+        ]
+
+    def explain_all(self, user, conversation, verbosity):
+        missing = []
+        for name, index, queryset in self.hot_queries(user, conversation):
+            plan = queryset.explain()
+            if index in plan:
+                self.stdout.write(self.style.SUCCESS(f"✅ {name}: {index}"))
+            else:
+                missing.append(name)
+                self.stdout.write(self.style.ERROR(f"❌ {name}: expected {index}"))
+            if verbosity > 1 or index not in plan:
+                self.stdout.write(f"   {plan.replace(chr(10), chr(10) + '   ')}")
+        return missing
+
+    def seed(self, count):
+        """Seed `count` rows per table spread over many users, so per-user filters are selective"""
+        if count <= 0:
+            user = User.objects.order_by('id').first()
+            conversation = Conversation.objects.order_by('id').first()
+            if user is None or conversation is None:
+                raise CommandError('No data to explain against; run with --seed')
+            return user, conversation
+
+        self.stdout.write(f"Seeding {count} rows per table...")
+        users = User.objects.bulk_create(
+            User(username=f'explain_user_{i}') for i in range(max(count // 20, 2))
+        )
+        designs = Design.objects.bulk_create(
+            Design(user=users[i % len(users)], name=f'Design {i}') for i in range(count)
+        )
+        orders = Order.objects.bulk_create(
+            Order(user=design.user, design=design, order_number=f'EXPLAIN-{i}',
+                  status=('submitted', 'processing', 'completed', 'failed')[i % 4])
+            for i, design in enumerate(designs)
+        )
+        Cart.objects.bulk_create(Cart(user=design.user, design=design) for design in designs)
+        TokenTransaction.objects.bulk_create(
+            TokenTransaction(user=users[i % len(users)], type='usage', amount=-1, description='Explain')
+            for i in range(count)
+        )
+        conversations = Conversation.objects.bulk_create(
+            Conversation(order=order, customer=order.user) for order in orders
+        )
+        # Busy threads: about 50 messages each
+        threads = conversations[:max(count // 10, 1)]
+        Message.objects.bulk_create(
+            Message(conversation=threads[i % len(threads)], sender=users[i % len(users)], content='Explain')
+            for i in range(count * 5)
+        )
+
+        # Fresh statistics so the planner sees the seeded distribution
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        return users[0], conversations[0]
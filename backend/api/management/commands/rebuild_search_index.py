@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from api import search_index
+
+
+class Command(BaseCommand):
+    help = 'Recreates the staff search triggers and indexes and refills them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        search_index.install(connection)
+        self.stdout.write(self.style.SUCCESS(f"✅ Search index rebuilt ({connection.vendor})"))
@@ -0,0 +1,122 @@
+"""
+Helpers for writing migrations that are safe to run against a live database.
+"""
+import time
+
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.migrations.operations import AddIndex
+
+from .partitions import is_partitioned
+
+
+def _builds_concurrently(schema_editor, model):
+    if schema_editor.connection.vendor != 'postgresql':
+        return False
+    # Partitioned tables (api.partitions) only take a plain CREATE INDEX
+    with schema_editor.connection.cursor() as cursor:
+        return not is_partitioned(cursor, model._meta.db_table)
+
+
+class AddIndexConcurrently(AddIndex):
+    """
+    AddIndex that builds with CREATE INDEX CONCURRENTLY on PostgreSQL, so
+    writes to the table are not blocked while the index is built. Other
+    databases, and partitioned tables, get a plain CREATE INDEX.
+
+    PostgreSQL cannot build concurrently inside a transaction: migrations
+    using this operation must set `atomic = False`.
+    """
+
+    def describe(self):
+        return f"Concurrently create index {self.index.name} on {self.model_name}"
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if not _builds_concurrently(schema_editor, model):
+            return super().database_forwards(app_label, schema_editor, from_state, to_state)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            schema_editor.add_index(model, self.index, concurrently=True)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if not _builds_concurrently(schema_editor, model):
+            return super().database_backwards(app_label, schema_editor, from_state, to_state)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            schema_editor.remove_index(model, self.index, concurrently=True)
+
+
+# Progress of interrupted batched_update() runs. A plain table rather than a
+# model, so migrations of any age can use it.
+CHECKPOINT_TABLE = 'data_migration_checkpoint'
+
+
+def _checkpoint_table(cursor):
+    cursor.execute(
+        f"CREATE TABLE IF NOT EXISTS {CHECKPOINT_TABLE} ("
+        "name varchar(200) PRIMARY KEY, last_pk bigint NOT NULL, rows_done bigint NOT NULL)"
+    )
+
+
+def _load_checkpoint(cursor, name):
+    cursor.execute(f"SELECT last_pk, rows_done FROM {CHECKPOINT_TABLE} WHERE name = %s", [name])
+    return cursor.fetchone() or (None, 0)
+
+
+def _save_checkpoint(cursor, name, last_pk, rows_done):
+    cursor.execute(f"DELETE FROM {CHECKPOINT_TABLE} WHERE name = %s", [name])
+    cursor.execute(
+        f"INSERT INTO {CHECKPOINT_TABLE} (name, last_pk, rows_done) VALUES (%s, %s, %s)",
+        [name, last_pk, rows_done]
+    )
+
+
+def batched_update(model, update, fields, name, batch_size=1000, queryset=None,
+                   using=DEFAULT_DB_ALIAS, log=print):
+    """
+    Run `update(instance)` over every row of `model` in primary key order
+    and bulk_update `fields` on the rows it returns True for.
+
+    Each batch of `batch_size` rows is one SELECT ... FOR UPDATE, one bulk
+    UPDATE and one transaction, so writes made to a row while its batch runs
+    wait instead of being overwritten, and no lock outlives a batch. The last
+    committed primary key is checkpointed under `name` in the same
+    transaction: run again after an interruption, the update resumes where
+    it stopped. `queryset` narrows the rows or columns loaded (e.g. .only()).
+    Progress, in rows per second, goes to `log`.
+
+    Batches only commit separately when the calling migration sets
+    `atomic = False`; pass using=schema_editor.connection.alias. Needs an
+    integer primary key.
+    """
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        _checkpoint_table(cursor)
+        last_pk, rows_done = _load_checkpoint(cursor, name)
+    if last_pk is not None:
+        log(f"  {name}: resuming after pk {last_pk} ({rows_done} rows done)")
+
+    rows = (queryset if queryset is not None else model._base_manager.all()).using(using).order_by('pk')
+    # Lock only the updated table's rows, not those of any select_related joins
+    rows = rows.select_for_update(of=('self',) if connection.features.has_select_for_update_of else ())
+    started = time.monotonic()
+    processed = changed = 0
+    while True:
+        with transaction.atomic(using=using):
+            batch = list((rows.filter(pk__gt=last_pk) if last_pk is not None else rows)[:batch_size])
+            if not batch:
+                break
+            dirty = [instance for instance in batch if update(instance)]
+            if dirty:
+                model._base_manager.using(using).bulk_update(dirty, fields)
+            last_pk = batch[-1].pk
+            processed += len(batch)
+            changed += len(dirty)
+            with connection.cursor() as cursor:
+                _save_checkpoint(cursor, name, last_pk, rows_done + processed)
+        rate = processed / max(time.monotonic() - started, 1e-6)
+        log(f"  {name}: {rows_done + processed} rows, {changed} updated ({rate:.0f} rows/s)")
+
+    # Finished: a later run of the same name starts from scratch
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {CHECKPOINT_TABLE} WHERE name = %s", [name])
+    return changed
@@ -2,30 +2,40 @@
 
 from django.db import migrations
 
+from api.migration_utils import batched_update
+
+# Mapping of old string values to new integer values
+CONVERSION_MAP = {
+    'Low': 3,
+    'Medium': 5,
+    'High': 7,
+    'Very High': 9,
+}
+
+
 def convert_stitch_density(apps, schema_editor):
     """Convert string stitch_density values to integers"""
     Design = apps.get_model('api', 'Design')
     
-    # Mapping of old string values to new integer values
-    conversion_map = {
-        'Low': 3,
-        'Medium': 5,
-        'High': 7,
-        'Very High': 9,
-    }
+    def convert(design):
+        if not isinstance(design.stitch_density, str):
+            return False
+        # Default to 5 if not found
+        design.stitch_density = CONVERSION_MAP.get(design.stitch_density, 5)
+        return True
     
-    for design in Design.objects.all():
-        if isinstance(design.stitch_density, str):
-            # Convert string value to integer
-            new_value = conversion_map.get(design.stitch_density, 5)  # Default to 5 if not found
-            design.stitch_density = new_value
-            design.save()
+    batched_update(
+        Design, convert, ['stitch_density'], name='api.0007_convert_stitch_density',
+        queryset=Design.objects.only('stitch_density'), using=schema_editor.connection.alias,
+    )
 
 def reverse_convert_stitch_density(apps, schema_editor):
     """Reverse conversion - not needed for this case"""
     pass
 
 class Migration(migrations.Migration):
+    # Commit per batch instead of holding one transaction over the table
+    atomic = False
 
     dependencies = [
         ('api', '0006_add_design_details'),
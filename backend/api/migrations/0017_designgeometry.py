@@ -0,0 +1,28 @@
+# Generated by Django 5.0.1 on 2026-10-18 23:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_orderresource'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DesignGeometry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source_image', models.CharField(help_text='Image file the geometry was traced from', max_length=255)),
+                ('geometry_file', models.FileField(upload_to='designs/geometry/')),
+                ('stitch_file', models.FileField(blank=True, null=True, upload_to='designs/stitches/')),
+                ('stitch_size_cm', models.IntegerField(blank=True, null=True)),
+                ('stitch_count', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('design', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='geometry', to='api.design')),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.1 on 2026-10-18 23:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_designgeometry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='stitch_preview',
+            field=models.ImageField(blank=True, null=True, upload_to='orders/previews/'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='stitch_preview_thumbnail',
+            field=models.ImageField(blank=True, null=True, upload_to='orders/previews/'),
+        ),
+    ]
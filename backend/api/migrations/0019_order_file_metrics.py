@@ -0,0 +1,45 @@
+# Generated by Django 5.0.1 on 2026-10-18 23:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0018_order_stitch_preview'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderFileMetrics',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('format', models.CharField(max_length=10)),
+                ('stitch_count', models.IntegerField(default=0)),
+                ('color_changes', models.IntegerField(default=0)),
+                ('trims', models.IntegerField(default=0)),
+                ('jumps', models.IntegerField(default=0)),
+                ('min_x', models.FloatField(default=0)),
+                ('min_y', models.FloatField(default=0)),
+                ('max_x', models.FloatField(default=0)),
+                ('max_y', models.FloatField(default=0)),
+                ('width_mm', models.FloatField(default=0)),
+                ('height_mm', models.FloatField(default=0)),
+                ('machine_brand', models.CharField(blank=True, default='', max_length=100)),
+                ('stitches_per_minute', models.IntegerField(default=0)),
+                ('estimated_seconds', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='file_metrics', to='api.order')),
+            ],
+            options={
+                'ordering': ['format'],
+                'indexes': [models.Index(fields=['stitch_count'], name='api_orderfi_stitch__6b7f6b_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='orderfilemetrics',
+            constraint=models.UniqueConstraint(fields=('order', 'format'), name='unique_order_file_metrics'),
+        ),
+    ]
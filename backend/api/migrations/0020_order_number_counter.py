@@ -0,0 +1,21 @@
+# Generated by Django 5.0.1 on 2026-10-18 23:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0019_order_file_metrics'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderNumberCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.IntegerField(unique=True)),
+                ('last_number', models.IntegerField(default=0)),
+            ],
+        ),
+    ]
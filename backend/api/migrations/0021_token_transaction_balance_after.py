@@ -0,0 +1,32 @@
+# Generated by Django 5.0.1 on 2026-10-18 23:33
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F
+
+
+def sign_usage_amounts(apps, schema_editor):
+    """Amounts are signed from now on; older usage rows were stored positive"""
+    TokenTransaction = apps.get_model('api', 'TokenTransaction')
+    TokenTransaction.objects.filter(type='usage', amount__gt=0).update(amount=-F('amount'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0020_order_number_counter'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tokentransaction',
+            name='balance_after',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='tokentransaction',
+            index=models.Index(fields=['user', '-created_at'], name='tokentx_user_created_idx'),
+        ),
+        migrations.RunPython(sign_usage_amounts, migrations.RunPython.noop),
+    ]
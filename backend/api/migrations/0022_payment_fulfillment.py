@@ -0,0 +1,46 @@
+# Generated by Django 5.0.1 on 2026-10-18 23:35
+
+import re
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_fulfillments(apps, schema_editor):
+    """Sessions credited before this table existed were only recorded in descriptions"""
+    TokenTransaction = apps.get_model('api', 'TokenTransaction')
+    PaymentFulfillment = apps.get_model('api', 'PaymentFulfillment')
+    session_re = re.compile(r'\(session: ([^)]+)\)')
+    seen = set()
+    rows = []
+    purchases = TokenTransaction.objects.filter(type='purchase', description__contains='(session: ')
+    for tx in purchases.order_by('id').iterator():
+        match = session_re.search(tx.description)
+        if match and match.group(1) not in seen:
+            seen.add(match.group(1))
+            rows.append(PaymentFulfillment(session_id=match.group(1), user_id=tx.user_id, tokens=tx.amount))
+    PaymentFulfillment.objects.bulk_create(rows, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0021_token_transaction_balance_after'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentFulfillment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('session_id', models.CharField(max_length=255, unique=True)),
+                ('tokens', models.IntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('package', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='api.tokenpackage')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='payment_fulfillments', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.RunPython(backfill_fulfillments, migrations.RunPython.noop),
+    ]
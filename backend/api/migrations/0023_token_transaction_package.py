@@ -0,0 +1,31 @@
+# Generated by Django 5.0.1 on 2026-10-18 23:36
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def link_purchases_to_packages(apps, schema_editor):
+    """Purchases named their package only in the description ("Purchased <name> ...")"""
+    TokenPackage = apps.get_model('api', 'TokenPackage')
+    TokenTransaction = apps.get_model('api', 'TokenTransaction')
+    # Longest names first so "Pro Plus" is not claimed by "Pro"
+    for package in sorted(TokenPackage.objects.all(), key=lambda p: len(p.name), reverse=True):
+        TokenTransaction.objects.filter(
+            type='purchase', package__isnull=True, description__startswith=f"Purchased {package.name}"
+        ).update(package=package)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0022_payment_fulfillment'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tokentransaction',
+            name='package',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='transactions', to='api.tokenpackage'),
+        ),
+        migrations.RunPython(link_purchases_to_packages, migrations.RunPython.noop),
+    ]
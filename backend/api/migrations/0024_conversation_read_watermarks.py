@@ -0,0 +1,48 @@
+# Generated by Django 5.0.1 on 2026-10-18 23:40
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_watermarks(apps, schema_editor):
+    """Start each side's watermark at the newest message it has already read"""
+    Conversation = apps.get_model('api', 'Conversation')
+    Message = apps.get_model('api', 'Message')
+
+    def newest(messages):
+        newest_id = messages.values('conversation').annotate(newest=Max('id')).values('newest')[:1]
+        return Coalesce(Subquery(newest_id), 0)
+
+    read = Message.objects.filter(conversation=OuterRef('pk'), is_read=True)
+    Conversation.objects.update(
+        customer_last_read_message_id=newest(read.exclude(sender=OuterRef('customer'))),
+        staff_last_read_message_id=newest(read.filter(sender=OuterRef('customer'))),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0023_token_transaction_package'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='customer_last_read_message_id',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='staff_last_read_message_id',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['conversation', 'id'], name='message_conversation_id_idx'),
+        ),
+        migrations.RunPython(backfill_watermarks, migrations.RunPython.noop),
+    ]
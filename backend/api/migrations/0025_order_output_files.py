@@ -0,0 +1,153 @@
+# Generated by Django 5.0.1 on 2026-10-18 23:45
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+OUTPUT_FORMATS = [
+    'dst', 'dsb', 'dsz', 'exp', 'tbf', 'fdr', 'stx',
+    'pes', 'pec', 'jef', 'sew', 'hus', 'vip', 'vp3', 'xxx',
+    'cmd', 'tap', 'tim', 'emt', '10o', 'ds9',
+]
+
+
+def copy_output_files(apps, schema_editor):
+    """
+    One OrderOutputFile per filled output_<format> column. Files are not
+    re-read here, so size comes from storage when available and sha256 is
+    left blank for files uploaded before this table existed.
+    """
+    Order = apps.get_model('api', 'Order')
+    OrderOutputFile = apps.get_model('api', 'OrderOutputFile')
+    for format_code in OUTPUT_FORMATS:
+        column = f'output_{format_code}'
+        orders = Order.objects.exclude(**{column: ''}).exclude(**{f'{column}__isnull': True})
+        rows = []
+        for order_id, name in orders.values_list('id', column).iterator():
+            output = OrderOutputFile(order_id=order_id, format=format_code, file=name)
+            try:
+                output.size = output.file.storage.size(name)
+            except Exception:
+                output.size = None
+            rows.append(output)
+        OrderOutputFile.objects.bulk_create(rows, batch_size=500)
+
+
+def restore_output_columns(apps, schema_editor):
+    Order = apps.get_model('api', 'Order')
+    OrderOutputFile = apps.get_model('api', 'OrderOutputFile')
+    for output in OrderOutputFile.objects.filter(format__in=OUTPUT_FORMATS).iterator():
+        Order.objects.filter(pk=output.order_id).update(**{f'output_{output.format}': output.file.name})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0024_conversation_read_watermarks'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderOutputFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('format', models.CharField(max_length=10)),
+                ('file', models.FileField(upload_to='orders/output/')),
+                ('size', models.BigIntegerField(blank=True, null=True)),
+                ('sha256', models.CharField(blank=True, default='', max_length=64)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='output_files', to='api.order')),
+            ],
+            options={
+                'ordering': ['format'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='orderoutputfile',
+            constraint=models.UniqueConstraint(fields=('order', 'format'), name='unique_order_output_format'),
+        ),
+        migrations.RunPython(copy_output_files, restore_output_columns),
+        migrations.RemoveField(
+            model_name='order',
+            name='output_10o',
+        ),
+        migrations.RemoveField(
+            model_name='order',
+            name='output_cmd',
+        ),
+        migrations.RemoveField(
+            model_name='order',
+            name='output_ds9',
+        ),
+        migrations.RemoveField(
+            model_name='order',
+            name='output_dsb',
+        ),
+        migrations.RemoveField(
+            model_name='order',
+            name='output_dst',
+        ),
+        migrations.RemoveField(
+            model_name='order',
+            name='output_dsz',
+        ),
+        migrations.RemoveField(
+            model_name='order',
+            name='output_emt',
+        ),
+        migrations.RemoveField(
+            model_name='order',
+            name='output_exp',
+        ),
+        migrations.RemoveField(
+            model_name='order',
+            name='output_fdr',
+        ),
+        migrations.RemoveField(
+            model_name='order',
+            name='output_hus',
+        ),
+        migrations.RemoveField(
+            model_name='order',
+            name='output_jef',
+        ),
+        migrations.RemoveField(
+            model_name='order',
+            name='output_pec',
+        ),
+        migrations.RemoveField(
+            model_name='order',
+            name='output_pes',
+        ),
+        migrations.RemoveField(
+            model_name='order',
+            name='output_sew',
+        ),
+        migrations.RemoveField(
+            model_name='order',
+            name='output_stx',
+        ),
+        migrations.RemoveField(
+            model_name='order',
+            name='output_tap',
+        ),
+        migrations.RemoveField(
+            model_name='order',
+            name='output_tbf',
+        ),
+        migrations.RemoveField(
+            model_name='order',
+            name='output_tim',
+        ),
+        migrations.RemoveField(
+            model_name='order',
+            name='output_vip',
+        ),
+        migrations.RemoveField(
+            model_name='order',
+            name='output_vp3',
+        ),
+        migrations.RemoveField(
+            model_name='order',
+            name='output_xxx',
+        ),
+    ]
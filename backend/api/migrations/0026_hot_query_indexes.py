@@ -0,0 +1,43 @@
+# Generated by Django 5.0.1 on 2026-10-18 23:47
+
+from django.conf import settings
+from django.db import migrations, models
+
+from api.migration_utils import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('api', '0025_order_output_files'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='cart',
+            index=models.Index(fields=['user', '-added_at'], name='cart_user_added_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='conversation',
+            index=models.Index(fields=['customer', '-updated_at'], name='conversation_customer_upd_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='design',
+            index=models.Index(fields=['user', '-created_at'], name='design_user_created_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='message',
+            index=models.Index(fields=['conversation', 'created_at'], name='message_conv_created_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='order',
+            index=models.Index(fields=['user', '-created_at'], name='order_user_created_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='order',
+            index=models.Index(fields=['status', '-created_at'], name='order_status_created_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.0.1 on 2026-10-19 00:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0026_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedPartition',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('table', models.CharField(max_length=64)),
+                ('month', models.DateField()),
+                ('file', models.FileField(upload_to='archives/')),
+                ('row_count', models.IntegerField(default=0)),
+                ('size', models.BigIntegerField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['table', '-month'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='archivedpartition',
+            constraint=models.UniqueConstraint(fields=('table', 'month'), name='unique_archived_table_month'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+from django.db import migrations
+
+from api.partitions import PARTITIONED_TABLES, partition_table, unpartition_table
+
+
+def partition_history_tables(apps, schema_editor):
+    # Range partitioning is PostgreSQL-only; other databases keep plain tables
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for table in PARTITIONED_TABLES:
+            partition_table(cursor, table)
+
+
+def unpartition_history_tables(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for table in PARTITIONED_TABLES:
+            unpartition_table(cursor, table)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0027_archivedpartition'),
+    ]
+
+    operations = [
+        # Rebuilds each table once (copying its rows), so run it in a quiet window
+        migrations.RunPython(partition_history_tables, unpartition_history_tables),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.0.1 on 2026-10-19 00:13
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+from api import search_index
+
+
+def install_search_indexes(apps, schema_editor):
+    search_index.install(schema_editor.connection)
+
+
+def uninstall_search_indexes(apps, schema_editor):
+    search_index.uninstall(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+    # Backfills in batches and builds the GIN indexes CONCURRENTLY
+    atomic = False
+
+    dependencies = [
+        ('api', '0028_partition_history_tables'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='design',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(install_search_indexes, uninstall_search_indexes),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.1 on 2026-10-19 09:12
+
+from django.conf import settings
+from django.db import migrations, models
+
+from api.migration_utils import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('api', '0029_search_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='conversation',
+            index=models.Index(fields=['customer', '-created_at'], name='conversation_customer_crt_idx'),
+        ),
+    ]
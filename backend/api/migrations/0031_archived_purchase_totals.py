@@ -0,0 +1,27 @@
+# Generated by Django 5.0.1 on 2026-10-19 00:54
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0030_conversation_created_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedPurchaseTotal',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('purchases', models.IntegerField(default=0)),
+                ('tokens', models.BigIntegerField(default=0)),
+                ('package', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='archived_purchase_totals', to='api.tokenpackage')),
+            ],
+            options={
+                'ordering': ['-month'],
+            },
+        ),
+    ]
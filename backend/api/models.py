@@ -1,4 +1,6 @@
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.db.models.functions import Substr
 from django.contrib.auth.models import User
 from django.utils import timezone
 from django.core.mail import send_mail
@@ -6,6 +8,10 @@ from django.conf import settings
 import secrets
 from datetime import timedelta
 
+import numpy as np
+
+from .caching import CachedSingletonModel, VersionedValue
+
 class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
     tokens = models.IntegerField(default=0)  # Changed from 50 to 0 (will get after verification)
@@ -20,11 +26,15 @@ class UserProfile(models.Model):
         return self.tokens >= amount
 
     def deduct_tokens(self, amount):
-        if self.has_tokens(amount):
-            self.tokens -= amount
-            self.save()
-            return True
-        return False
+        """
+        Atomically take tokens without recording a transaction.
+        Balance changes that belong in the history go through api.ledger.
+        """
+        updated = UserProfile.objects.filter(pk=self.pk, tokens__gte=amount).update(
+            tokens=models.F('tokens') - amount, updated_at=timezone.now()
+        )
+        self.refresh_from_db(fields=['tokens'])
+        return bool(updated)
 
 
 class EmailVerificationToken(models.Model):
@@ -156,14 +166,44 @@ class TokenTransaction(models.Model):
 
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='transactions')
     type = models.CharField(max_length=20, choices=TRANSACTION_TYPES)
-    amount = models.IntegerField()
+    amount = models.IntegerField()  # Signed: credits positive, debits negative
+    balance_after = models.IntegerField(null=True, blank=True)
+    package = models.ForeignKey(
+        TokenPackage, on_delete=models.SET_NULL, null=True, blank=True, related_name='transactions'
+    )
     description = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-created_at'], name='tokentx_user_created_idx'),
+        ]
+
     def __str__(self):
         return f"{self.user.username} - {self.type} - {self.amount} tokens"
 
 
+class PaymentFulfillment(models.Model):
+    """
+    One row per fulfilled Stripe checkout session. The unique session_id is
+    the idempotency key shared by the webhook and verify_payment.
+    """
+    session_id = models.CharField(max_length=255, unique=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='payment_fulfillments')
+    package = models.ForeignKey(TokenPackage, on_delete=models.SET_NULL, null=True, blank=True)
+    tokens = models.IntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.session_id} - {self.user.username} - {self.tokens} tokens"
+
+
+class DesignQuerySet(models.QuerySet):
+    def for_serializer(self):
+        """Everything DesignSerializer reads, fetched in the same query"""
+        return self.select_related('user')
+
+
 class Design(models.Model):
     """Stores user designs with embroidery preview images"""
     STATUS_CHOICES = [
@@ -193,14 +233,58 @@ class Design(models.Model):
     tokens_used = models.IntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    
+    # Maintained by a database trigger on PostgreSQL (see api.search_index)
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = DesignQuerySet.as_manager()
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', '-created_at'], name='design_user_created_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.name}"
 
 
+class DesignGeometry(models.Model):
+    """Cached vector geometry of a design so size changes can skip segmentation"""
+    design = models.OneToOneField(Design, on_delete=models.CASCADE, related_name='geometry')
+    source_image = models.CharField(max_length=255, help_text="Image file the geometry was traced from")
+    geometry_file = models.FileField(upload_to='designs/geometry/')
+    stitch_file = models.FileField(upload_to='designs/stitches/', null=True, blank=True)
+    stitch_size_cm = models.IntegerField(null=True, blank=True)
+    stitch_count = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Geometry for {self.design.name}"
+
+
+# Stitch file formats an admin can deliver for an order
+OUTPUT_FORMATS = [
+    # Industrial
+    'dst', 'dsb', 'dsz', 'exp', 'tbf', 'fdr', 'stx',
+    # Domestic
+    'pes', 'pec', 'jef', 'sew', 'hus', 'vip', 'vp3', 'xxx',
+    # Commercial
+    'cmd', 'tap', 'tim', 'emt', '10o', 'ds9',
+]
+
+
+class OrderQuerySet(models.QuerySet):
+    def for_serializer(self):
+        """
+        Everything OrderSerializer reads: the customer, the design and its
+        owner (nested DesignSerializer) in one join, file metrics and output
+        files in one extra query each for the whole page.
+        """
+        return self.select_related('user', 'design', 'design__user').prefetch_related('file_metrics', 'output_files')
+
+
 class Order(models.Model):
     """Tracks digitization orders submitted for manual processing"""
     STATUS_CHOICES = [
@@ -222,33 +306,12 @@ class Order(models.Model):
     # Requested file formats (JSON list of format codes like ["dst", "pes", "jef"])
     requested_formats = models.JSONField(default=list, blank=True)
     
-    # Output files (uploaded by admin after manual digitization)
-    # Industrial formats
-    output_dst = models.FileField(upload_to='orders/output/', null=True, blank=True)
-    output_dsb = models.FileField(upload_to='orders/output/', null=True, blank=True)
-    output_dsz = models.FileField(upload_to='orders/output/', null=True, blank=True)
-    output_exp = models.FileField(upload_to='orders/output/', null=True, blank=True)
-    output_tbf = models.FileField(upload_to='orders/output/', null=True, blank=True)
-    output_fdr = models.FileField(upload_to='orders/output/', null=True, blank=True)
-    output_stx = models.FileField(upload_to='orders/output/', null=True, blank=True)
-    
-    # Domestic formats
-    output_pes = models.FileField(upload_to='orders/output/', null=True, blank=True)
-    output_pec = models.FileField(upload_to='orders/output/', null=True, blank=True)
-    output_jef = models.FileField(upload_to='orders/output/', null=True, blank=True)
-    output_sew = models.FileField(upload_to='orders/output/', null=True, blank=True)
-    output_hus = models.FileField(upload_to='orders/output/', null=True, blank=True)
-    output_vip = models.FileField(upload_to='orders/output/', null=True, blank=True)
-    output_vp3 = models.FileField(upload_to='orders/output/', null=True, blank=True)
-    output_xxx = models.FileField(upload_to='orders/output/', null=True, blank=True)
-    
-    # Commercial formats
-    output_cmd = models.FileField(upload_to='orders/output/', null=True, blank=True)
-    output_tap = models.FileField(upload_to='orders/output/', null=True, blank=True)
-    output_tim = models.FileField(upload_to='orders/output/', null=True, blank=True)
-    output_emt = models.FileField(upload_to='orders/output/', null=True, blank=True)
-    output_10o = models.FileField(upload_to='orders/output/', null=True, blank=True)
-    output_ds9 = models.FileField(upload_to='orders/output/', null=True, blank=True)
+    # Output files (uploaded by admin after manual digitization) live in
+    # OrderOutputFile, one row per format
+    
+    # Rendered preview of the uploaded stitch file
+    stitch_preview = models.ImageField(upload_to='orders/previews/', null=True, blank=True)
+    stitch_preview_thumbnail = models.ImageField(upload_to='orders/previews/', null=True, blank=True)
     
     # Email notifications
     email_sent = models.BooleanField(default=False)
@@ -262,25 +325,20 @@ class Order(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     completed_at = models.DateTimeField(null=True, blank=True)
     
+    objects = OrderQuerySet.as_manager()
+    
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', '-created_at'], name='order_user_created_idx'),
+            models.Index(fields=['status', '-created_at'], name='order_status_created_idx'),
+        ]
     
     def save(self, *args, **kwargs):
         if not self.order_number:
             # Generate order number: ORD-2024-001
-            from django.utils import timezone
-            year = timezone.now().year
-            last_order = Order.objects.filter(
-                order_number__startswith=f'ORD-{year}-'
-            ).order_by('-order_number').first()
-            
-            if last_order:
-                last_num = int(last_order.order_number.split('-')[-1])
-                new_num = last_num + 1
-            else:
-                new_num = 1
-            
-            self.order_number = f'ORD-{year}-{new_num:03d}'
+            from .order_numbers import allocate_order_numbers
+            self.order_number = allocate_order_numbers(1)[0]
         
         super().save(*args, **kwargs)
     
@@ -288,6 +346,73 @@ class Order(models.Model):
         return f"{self.order_number} - {self.user.username} - {self.status}"
 
 
+class OrderNumberCounter(models.Model):
+    """Last order number handed out per year (databases without sequences)"""
+    year = models.IntegerField(unique=True)
+    last_number = models.IntegerField(default=0)
+    
+    def __str__(self):
+        return f"{self.year}: {self.last_number}"
+
+
+class OrderOutputFile(models.Model):
+    """A delivered stitch file for an order, one row per format"""
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='output_files')
+    format = models.CharField(max_length=10)
+    file = models.FileField(upload_to='orders/output/')
+    size = models.BigIntegerField(null=True, blank=True)  # Size in bytes
+    sha256 = models.CharField(max_length=64, blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['format']
+        constraints = [
+            # Also the (order, format) index used by downloads and completion checks
+            models.UniqueConstraint(fields=['order', 'format'], name='unique_order_output_format'),
+        ]
+    
+    def __str__(self):
+        return f"{self.order.order_number} {self.format.upper()}"
+
+
+class OrderFileMetrics(models.Model):
+    """Stitch statistics of an uploaded output file, computed once on upload"""
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='file_metrics')
+    format = models.CharField(max_length=10)
+    stitch_count = models.IntegerField(default=0)
+    color_changes = models.IntegerField(default=0)
+    trims = models.IntegerField(default=0)
+    jumps = models.IntegerField(default=0)
+    
+    # Bounding box in 0.1 mm (pyembroidery units)
+    min_x = models.FloatField(default=0)
+    min_y = models.FloatField(default=0)
+    max_x = models.FloatField(default=0)
+    max_y = models.FloatField(default=0)
+    width_mm = models.FloatField(default=0)
+    height_mm = models.FloatField(default=0)
+    
+    # Machine run time estimate
+    machine_brand = models.CharField(max_length=100, blank=True, default='')
+    stitches_per_minute = models.IntegerField(default=0)
+    estimated_seconds = models.IntegerField(default=0)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['format']
+        constraints = [
+            models.UniqueConstraint(fields=['order', 'format'], name='unique_order_file_metrics'),
+        ]
+        indexes = [
+            models.Index(fields=['stitch_count']),
+        ]
+    
+    def __str__(self):
+        return f"{self.order.order_number} {self.format.upper()} - {self.stitch_count} stitches"
+
+
 class Cart(models.Model):
     """Shopping cart for designs before order submission"""
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='cart_items')
@@ -298,6 +423,9 @@ class Cart(models.Model):
     class Meta:
         unique_together = ('user', 'design')
         ordering = ['-added_at']
+        indexes = [
+            models.Index(fields=['user', '-added_at'], name='cart_user_added_idx'),
+        ]
     
     def __str__(self):
         return f"{self.user.username} - {self.design.name} ({self.embroidery_size_cm}cm)"
@@ -356,7 +484,7 @@ class DesignFeatureUsage(models.Model):
     def __str__(self):
         return f"{self.design.name} - {self.feature.name}"
 
-class TokenCostSettings(models.Model):
+class TokenCostSettings(CachedSingletonModel):
     """Global settings for token costs across the system"""
     ai_image_generation = models.IntegerField(default=2, help_text="Tokens cost for generating AI images")
     order_placement = models.IntegerField(default=1, help_text="Tokens cost for placing an order")
@@ -373,9 +501,8 @@ class TokenCostSettings(models.Model):
     
     @classmethod
     def get_costs(cls):
-        """Get or create default token costs"""
-        obj, created = cls.objects.get_or_create(pk=1)
-        return obj
+        """Get or create default token costs (cached, see CachedSingletonModel)"""
+        return cls.get_solo()
 
 
 class EmbroiderySizePricing(models.Model):
@@ -393,6 +520,29 @@ class EmbroiderySizePricing(models.Model):
     def __str__(self):
         return f"{self.size_cm}cm - {self.price_in_tokens} tokens"
     
+    @classmethod
+    def load_table(cls):
+        """All tiers as (sizes, prices) float arrays ordered by size"""
+        rows = list(cls.objects.order_by('size_cm').values_list('size_cm', 'price_in_tokens'))
+        table = np.array(rows, dtype=np.float64).reshape(-1, 2)
+        return table[:, 0].copy(), table[:, 1].copy()
+    
+    @classmethod
+    def get_prices_for_sizes(cls, sizes):
+        """
+        Token prices for many sizes at once, linearly interpolated between
+        tiers and clamped to the smallest and largest tier.
+        
+        The tier table is memoized per process and reloaded only after a
+        tier is saved or deleted anywhere (see api.signals).
+        """
+        tier_sizes, tier_prices = size_pricing_table.get()
+        if not len(tier_sizes):
+            # Default fallback if no tiers configured
+            return [10] * len(sizes)
+        prices = np.interp(np.asarray(sizes, dtype=np.float64), tier_sizes, tier_prices)
+        return np.rint(prices).astype(int).tolist()
+    
     @classmethod
     def get_price_for_size(cls, size_cm):
         """
@@ -403,41 +553,10 @@ class EmbroiderySizePricing(models.Model):
         - 40cm = 30 tokens
         - 20cm = ~19 tokens (interpolated)
         """
-        # Get all pricing tiers
-        tiers = cls.objects.all().order_by('size_cm')
-        
-        if not tiers.exists():
-            # Default fallback if no tiers configured
-            return 10
-        
-        # If size is below minimum, use minimum price
-        min_tier = tiers.first()
-        if size_cm <= min_tier.size_cm:
-            return min_tier.price_in_tokens
-        
-        # If size is above maximum, use maximum price
-        max_tier = tiers.last()
-        if size_cm >= max_tier.size_cm:
-            return max_tier.price_in_tokens
-        
-        # Find the two tiers to interpolate between
-        for i, tier in enumerate(tiers):
-            if tier.size_cm >= size_cm:
-                if tier.size_cm == size_cm:
-                    return tier.price_in_tokens
-                
-                # Interpolate between this tier and the previous one
-                prev_tier = tiers[i - 1]
-                size_range = tier.size_cm - prev_tier.size_cm
-                price_range = tier.price_in_tokens - prev_tier.price_in_tokens
-                
-                # Linear interpolation formula
-                ratio = (size_cm - prev_tier.size_cm) / size_range
-                interpolated_price = prev_tier.price_in_tokens + (price_range * ratio)
-                
-                return int(round(interpolated_price))
-        
-        return max_tier.price_in_tokens
+        return cls.get_prices_for_sizes([size_cm])[0]
+
+
+size_pricing_table = VersionedValue('embroidery_size_pricing', EmbroiderySizePricing.load_table)
 
 
 # ============================================================================
@@ -465,20 +584,92 @@ class OrderResource(models.Model):
 # CHAT/MESSAGING
 # ============================================================================
 
+class ConversationQuerySet(models.QuerySet):
+    def for_list(self, user):
+        """
+        Everything ConversationListSerializer reads, in one query: the
+        participants and order joined, the latest message's fields as
+        subqueries and the unread count for `user` as a filtered COUNT.
+        """
+        latest = Message.objects.filter(conversation=models.OuterRef('pk')).order_by('-created_at', '-id')
+        return self.select_related('customer', 'admin', 'order').annotate(
+            last_message_id=models.Subquery(latest.values('id')[:1]),
+            last_message_sender=models.Subquery(latest.values('sender__username')[:1]),
+            last_message_content=models.Subquery(
+                latest.annotate(preview=Substr('content', 1, 100)).values('preview')[:1]
+            ),
+            last_message_attachment=models.Subquery(latest.values('attachment')[:1]),
+            last_message_attachment_name=models.Subquery(latest.values('attachment_name')[:1]),
+            last_message_created_at=models.Subquery(latest.values('created_at')[:1]),
+            unread_count=models.Count(
+                'messages',
+                filter=models.Q(messages__id__gt=self.read_watermark(user)) & ~models.Q(messages__sender=user),
+            ),
+        )
+
+    @staticmethod
+    def read_watermark(user):
+        """The row's last-read message id for `user`: their own side if they are the customer, else staff's"""
+        return models.Case(
+            models.When(customer=user, then=models.F('customer_last_read_message_id')),
+            default=models.F('staff_last_read_message_id'),
+        )
+
+
 class Conversation(models.Model):
     """Represents a chat conversation between a customer and admin about an order"""
     order = models.OneToOneField(Order, on_delete=models.CASCADE, related_name='conversation')
     customer = models.ForeignKey(User, on_delete=models.CASCADE, related_name='customer_conversations')
     admin = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='admin_conversations')
     
+    # Read watermarks: id of the newest message each side has seen.
+    # Anything above it from the other side is unread.
+    customer_last_read_message_id = models.BigIntegerField(default=0)
+    staff_last_read_message_id = models.BigIntegerField(default=0)
+    
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = ConversationQuerySet.as_manager()
+    
     class Meta:
         ordering = ['-updated_at']
+        indexes = [
+            models.Index(fields=['customer', '-updated_at'], name='conversation_customer_upd_idx'),
+            models.Index(fields=['customer', '-created_at'], name='conversation_customer_crt_idx'),
+        ]
     
     def __str__(self):
         return f"Chat - Order {self.order.order_number} ({self.customer.username})"
+    
+    def watermark_field(self, user):
+        if user.pk == self.customer_id:
+            return 'customer_last_read_message_id'
+        return 'staff_last_read_message_id'
+    
+    def unread_count_for(self, user):
+        watermark = getattr(self, self.watermark_field(user))
+        return self.messages.filter(id__gt=watermark).exclude(sender=user).count()
+    
+    def mark_read(self, user):
+        """
+        Mark everything up to the newest message as read by `user`.
+        
+        One UPDATE stamps the read receipts and one moves the watermark
+        forward (never back, if a newer read already moved it further).
+        Returns the number of messages newly marked read.
+        """
+        latest_id = self.messages.order_by('-id').values_list('id', flat=True).first()
+        field = self.watermark_field(user)
+        if latest_id is None or latest_id <= getattr(self, field):
+            return 0
+        
+        marked = self.messages.filter(
+            id__gt=getattr(self, field), id__lte=latest_id, is_read=False
+        ).exclude(sender=user).update(is_read=True, read_at=timezone.now())
+        Conversation.objects.filter(pk=self.pk, **{f'{field}__lt': latest_id}).update(**{field: latest_id})
+        setattr(self, field, latest_id)
+        return marked
 
 
 class Message(models.Model):
@@ -497,8 +688,17 @@ class Message(models.Model):
     is_read = models.BooleanField(default=False)
     read_at = models.DateTimeField(null=True, blank=True)
     
+    # Maintained by a database trigger on PostgreSQL (see api.search_index)
+    search_vector = SearchVectorField(null=True, editable=False)
+    
     class Meta:
         ordering = ['created_at']
+        indexes = [
+            # Unread counts are a range scan above the conversation's watermark
+            models.Index(fields=['conversation', 'id'], name='message_conversation_id_idx'),
+            # Latest message per conversation for the conversation list
+            models.Index(fields=['conversation', 'created_at'], name='message_conv_created_idx'),
+        ]
     
     def __str__(self):
         return f"Message from {self.sender.username} at {self.created_at}"
@@ -511,4 +711,44 @@ class Message(models.Model):
     
     @property
     def has_attachment(self):
-        return bool(self.attachment)
\ No newline at end of file
+        return bool(self.attachment)
+
+class ArchivedPartition(models.Model):
+    """
+    One archived month of an append-only history table (TokenTransaction or
+    Message), moved out of the hot table into a gzip'd JSON Lines file
+    """
+    table = models.CharField(max_length=64)  # Model label, e.g. api.tokentransaction
+    month = models.DateField()  # First day of the archived month
+    file = models.FileField(upload_to='archives/')
+    row_count = models.IntegerField(default=0)
+    size = models.BigIntegerField(null=True, blank=True)  # Compressed size in bytes
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['table', '-month']
+        constraints = [
+            models.UniqueConstraint(fields=['table', 'month'], name='unique_archived_table_month'),
+        ]
+    
+    def __str__(self):
+        return f"{self.table} {self.month:%Y-%m} ({self.row_count} rows)"
+
+
+class ArchivedPurchaseTotal(models.Model):
+    """
+    Token purchases of one archived month, per package. archive_month moves
+    the TokenTransaction rows out; sales stats add these totals back.
+    """
+    month = models.DateField()  # First day of the archived month
+    package = models.ForeignKey(
+        TokenPackage, on_delete=models.SET_NULL, null=True, blank=True, related_name='archived_purchase_totals'
+    )
+    purchases = models.IntegerField(default=0)
+    tokens = models.BigIntegerField(default=0)
+    
+    class Meta:
+        ordering = ['-month']
+    
+    def __str__(self):
+        return f"{self.month:%Y-%m} {self.package or 'no package'}: {self.purchases} purchases"
@@ -0,0 +1,137 @@
+"""
+Processing of embroidery files an admin uploads for an order.
+
+Each uploaded file is parsed with pyembroidery exactly once and the parsed
+pattern is shared by everything that needs it. The slow part (hashing,
+parsing, metrics, preview rendering) runs in analyse_output_uploads()
+before the order row is locked; only storing the results happens under
+the lock.
+"""
+import hashlib
+import logging
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+
+from .models import OrderFileMetrics, OrderOutputFile
+from .utils.stitch_renderer import StitchRenderer, load_pattern
+from .utils.stitch_stats import compute_stitch_stats
+
+logger = logging.getLogger(__name__)
+
+
+def delete_on_commit(field):
+    """Remove a file being replaced from storage once the new row commits"""
+    name, storage = field.name, field.storage
+    transaction.on_commit(lambda: storage.delete(name))
+
+
+def parse_uploaded_file(uploaded_file, format_code):
+    """Parse an uploaded stitch file, returning None if pyembroidery cannot read it"""
+    try:
+        uploaded_file.seek(0)
+        pattern = load_pattern(uploaded_file, format_code)
+    except Exception as e:
+        logger.warning(f"Could not parse uploaded {format_code} file {uploaded_file.name}: {str(e)}")
+        return None
+    finally:
+        uploaded_file.seek(0)
+    if pattern is None or not pattern.stitches:
+        return None
+    return pattern
+
+
+def save_stitch_preview(order, png, webp):
+    """Store a rendered PNG preview + WebP thumbnail on the order"""
+    for field in (order.stitch_preview, order.stitch_preview_thumbnail):
+        if field:
+            delete_on_commit(field)
+    order.stitch_preview.save(f"{order.order_number}_preview.png", ContentFile(png), save=False)
+    order.stitch_preview_thumbnail.save(f"{order.order_number}_thumb.webp", ContentFile(webp), save=False)
+
+
+def stitches_per_minute(machine_brand):
+    """Configured machine speed for a brand name, e.g. "Brother PE800" -> brother"""
+    brand = (machine_brand or '').lower()
+    for key, spm in settings.MACHINE_BRAND_SPM.items():
+        if key in brand:
+            return spm
+    return settings.MACHINE_DEFAULT_SPM
+
+
+def file_sha256(uploaded_file):
+    digest = hashlib.sha256()
+    uploaded_file.seek(0)
+    for chunk in uploaded_file.chunks():
+        digest.update(chunk)
+    uploaded_file.seek(0)
+    return digest.hexdigest()
+
+
+def save_output_files(order, uploads, sha256=None):
+    """
+    Store uploaded output files ({format_code: UploadedFile}) as
+    OrderOutputFile rows, replacing any earlier file for the same format.
+    `sha256` holds digests already computed by analyse_output_uploads().
+    """
+    sha256 = sha256 or {}
+    existing = {f.format: f for f in order.output_files.filter(format__in=list(uploads))}
+    saved = []
+    for format_code, uploaded_file in uploads.items():
+        output = existing.get(format_code) or OrderOutputFile(order=order, format=format_code)
+        if output.file:
+            delete_on_commit(output.file)
+        output.sha256 = sha256.get(format_code) or file_sha256(uploaded_file)
+        output.size = uploaded_file.size
+        output.file = uploaded_file
+        output.save()
+        saved.append(output)
+    return saved
+
+
+def analyse_output_uploads(order, uploads):
+    """
+    Hash, parse and measure newly uploaded output files ({format_code:
+    UploadedFile}) without writing anything.
+
+    Stitch metrics are computed per readable file. The preview is rendered
+    from the first readable file, following the customer's requested format
+    order. Returns {'sha256': {format: digest}, 'metrics': {format: fields},
+    'preview': (png, webp) or None} for save_upload_analysis().
+    """
+    preferred = [f for f in (order.requested_formats or []) if f in uploads]
+    preferred += [f for f in uploads if f not in preferred]
+    machine_brand = (order.design.machine_brand or '') if order.design_id else ''
+    spm = stitches_per_minute(machine_brand)
+
+    analysis = {'sha256': {}, 'metrics': {}, 'preview': None}
+    first_pattern = None
+    for format_code in preferred:
+        analysis['sha256'][format_code] = file_sha256(uploads[format_code])
+        pattern = parse_uploaded_file(uploads[format_code], format_code)
+        if pattern is None:
+            continue
+        if first_pattern is None:
+            first_pattern = pattern
+        try:
+            stats = compute_stitch_stats(pattern, spm)
+        except Exception as e:
+            logger.warning(f"Stitch metrics failed for order {order.order_number} ({format_code}): {str(e)}")
+            continue
+        analysis['metrics'][format_code] = {**stats, 'machine_brand': machine_brand, 'stitches_per_minute': spm}
+
+    if first_pattern is not None:
+        try:
+            analysis['preview'] = StitchRenderer().render_previews(first_pattern)
+        except Exception as e:
+            logger.warning(f"Stitch preview rendering failed for order {order.order_number}: {str(e)}")
+    return analysis
+
+
+def save_upload_analysis(order, analysis):
+    """Store the metrics rows and preview from analyse_output_uploads(); the caller saves the order"""
+    for format_code, fields in analysis['metrics'].items():
+        OrderFileMetrics.objects.update_or_create(order=order, format=format_code, defaults=fields)
+    if analysis['preview'] is not None:
+        save_stitch_preview(order, *analysis['preview'])
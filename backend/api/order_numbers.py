@@ -0,0 +1,89 @@
+"""
+Order number allocation.
+
+Order numbers look like ORD-2024-001 and restart every year. Numbers are
+reserved in blocks so a checkout of N items costs one round trip, and
+concurrent checkouts never pick the same number.
+
+On PostgreSQL each year has its own sequence. nextval() is not
+transactional, so allocating never waits on another checkout's open
+transaction (a rolled-back checkout just leaves a gap). Other databases
+use a per-year OrderNumberCounter row locked with SELECT ... FOR UPDATE.
+Either way the counter is seeded from the highest number already issued
+that year the first time the year is used.
+"""
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+
+from .models import Order, OrderNumberCounter
+
+# Sequences known to exist and be committed, so the lookup is skipped
+_known_sequences = set()
+
+
+def format_order_number(year, number):
+    return f'ORD-{year}-{number:03d}'
+
+
+def highest_issued_number(year):
+    """Highest ORD-<year>-N already in use (compared numerically, not as text)"""
+    prefix = f'ORD-{year}-'
+    suffixes = Order.objects.filter(order_number__startswith=prefix).values_list('order_number', flat=True)
+    return max((int(n[len(prefix):]) for n in suffixes if n[len(prefix):].isdigit()), default=0)
+
+
+def _sequence_name(year):
+    return f'api_order_number_{int(year)}'
+
+
+def _ensure_sequence(cursor, year):
+    name = _sequence_name(year)
+    if name in _known_sequences:
+        return name
+    cursor.execute("SELECT to_regclass(%s)", [name])
+    if cursor.fetchone()[0] is not None:
+        _known_sequences.add(name)
+        return name
+    start = highest_issued_number(year) + 1
+    try:
+        with transaction.atomic():
+            cursor.execute(f"CREATE SEQUENCE IF NOT EXISTS {name} START WITH {start}")
+    except IntegrityError:
+        # Another checkout created it first
+        _known_sequences.add(name)
+        return name
+    # Creation rolls back with the surrounding transaction, so only remember it once committed
+    transaction.on_commit(lambda: _known_sequences.add(name))
+    return name
+
+
+def _allocate_from_sequence(year, count):
+    with connection.cursor() as cursor:
+        name = _ensure_sequence(cursor, year)
+        cursor.execute(f"SELECT nextval('{name}') FROM generate_series(1, %s)", [count])
+        return sorted(row[0] for row in cursor.fetchall())
+
+
+def _allocate_from_counter(year, count):
+    with transaction.atomic():
+        counter = OrderNumberCounter.objects.select_for_update().filter(year=year).first()
+        if counter is None:
+            try:
+                with transaction.atomic():
+                    counter = OrderNumberCounter.objects.create(year=year, last_number=highest_issued_number(year))
+            except IntegrityError:
+                counter = OrderNumberCounter.objects.select_for_update().get(year=year)
+        start = counter.last_number + 1
+        counter.last_number += count
+        counter.save(update_fields=['last_number'])
+    return list(range(start, start + count))
+
+
+def allocate_order_numbers(count, year=None):
+    """Reserve `count` order numbers for the year (default: current year)"""
+    year = year or timezone.now().year
+    if connection.vendor == 'postgresql':
+        numbers = _allocate_from_sequence(year, count)
+    else:
+        numbers = _allocate_from_counter(year, count)
+    return [format_order_number(year, n) for n in numbers]
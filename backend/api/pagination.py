@@ -0,0 +1,123 @@
+"""
+Keyset (cursor) pagination for list endpoints.
+
+Pages are read with a WHERE on the sort key instead of OFFSET, so fetching
+page 500 costs the same as page 1. The cursor is the (timestamp, id) of the
+last row served, base64-encoded so clients treat it as opaque.
+
+Clients opt in with ?paginate=1 and follow `next_cursor` (?cursor=...).
+Without the flag the endpoints return the full list as before.
+
+Chat messages are append-only, so they page on id alone with explicit
+?before=<id> / ?after=<id> cursors (paginate_by_id).
+"""
+import base64
+import json
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ParseError
+
+
+class InvalidCursor(ParseError):
+    default_detail = "Invalid pagination cursor"
+
+
+def encode_cursor(value, pk):
+    raw = json.dumps([value.isoformat(), pk], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        value, pk = json.loads(raw)
+        value = parse_datetime(value)
+        if value is None:
+            raise ValueError(cursor)
+        return value, int(pk)
+    except (ValueError, TypeError):
+        raise InvalidCursor({"error": "Invalid pagination cursor"})
+
+
+def wants_pagination(request):
+    return request.query_params.get('paginate', '').lower() in ('1', 'true', 'yes')
+
+
+def page_size_for(request):
+    try:
+        size = int(request.query_params.get('page_size', settings.API_PAGE_SIZE))
+    except ValueError:
+        size = settings.API_PAGE_SIZE
+    return max(1, min(size, settings.API_MAX_PAGE_SIZE))
+
+
+def paginate(request, queryset, field='created_at'):
+    """
+    Return (rows, pagination) for a list endpoint, newest first by (field, id).
+
+    Without ?paginate=1 the queryset is returned unchanged with an empty
+    pagination dict. Otherwise rows is one page and pagination holds
+    `next_cursor` and `has_more`, ready to merge into the response body.
+    """
+    if not wants_pagination(request):
+        return queryset, {}
+
+    queryset = queryset.order_by(f'-{field}', '-id')
+    cursor = request.query_params.get('cursor')
+    if cursor:
+        value, pk = decode_cursor(cursor)
+        queryset = queryset.filter(Q(**{f'{field}__lt': value}) | Q(**{field: value, 'id__lt': pk}))
+
+    size = page_size_for(request)
+    rows = list(queryset[:size + 1])
+    has_more = len(rows) > size
+    rows = rows[:size]
+    next_cursor = encode_cursor(getattr(rows[-1], field), rows[-1].pk) if has_more else None
+    return rows, {"next_cursor": next_cursor, "has_more": has_more, "page_size": size}
+
+
+def _message_id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise InvalidCursor({"error": "Invalid message cursor"})
+
+
+def page_by_id(queryset, size, before=None, after=None):
+    """
+    One page of rows keyed on their (monotonic) id, newest first.
+
+    `before` pages back through older rows; `after` fetches the rows that
+    arrived since the newest one a client holds. Returns (rows, page) where
+    page carries the `before`/`after` cursors for the next request.
+    """
+    if after is not None:
+        rows = list(queryset.filter(id__gt=after).order_by('id')[:size + 1])
+        has_more = len(rows) > size
+        rows = rows[:size][::-1]
+    else:
+        if before is not None:
+            queryset = queryset.filter(id__lt=before)
+        rows = list(queryset.order_by('-id')[:size + 1])
+        has_more = len(rows) > size
+        rows = rows[:size]
+    return rows, {
+        "before": rows[-1].id if rows else before,
+        "after": rows[0].id if rows else after,
+        "has_more": has_more,
+        "page_size": size,
+    }
+
+
+def paginate_by_id(request, queryset):
+    """page_by_id() driven by ?before=, ?after= and ?page_size="""
+    before = request.query_params.get('before')
+    after = request.query_params.get('after')
+    return page_by_id(
+        queryset,
+        page_size_for(request),
+        before=_message_id(before) if before else None,
+        after=_message_id(after) if after else None,
+    )
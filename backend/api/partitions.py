@@ -0,0 +1,198 @@
+"""
+Monthly range partitioning of the append-only history tables (PostgreSQL).
+
+api_tokentransaction and api_message are partitioned BY RANGE (created_at),
+one partition per calendar month named <table>_pYYYYMM, plus a DEFAULT
+partition that catches anything outside the months created so far. The ORM
+is unaware of it: the parent keeps its name, columns, indexes and foreign
+keys, and only the primary key widens to (id, created_at) because a
+partitioned table's unique keys must include the partition key.
+
+Old months then leave the hot table by DETACH + DROP of one partition
+(see api.archive) instead of a large DELETE. Other databases keep plain
+tables and archive by deleting the month's rows.
+"""
+import datetime
+
+from django.db import transaction
+from django.utils import timezone
+
+PARTITIONED_TABLES = ('api_tokentransaction', 'api_message')
+PARTITION_KEY = 'created_at'
+
+# Months to keep created ahead of time, so new rows never land in DEFAULT
+MONTHS_AHEAD = 3
+
+
+def month_start(value):
+    """First day of the month containing `value` (a date or datetime)"""
+    return datetime.date(value.year, value.month, 1)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table, month):
+    return f"{table}_p{month:%Y%m}"
+
+
+def _bound(month):
+    return f"'{month.isoformat()} 00:00:00+00'"
+
+
+def is_partitioned(cursor, table):
+    cursor.execute(
+        "SELECT 1 FROM pg_partitioned_table pt JOIN pg_class c ON c.oid = pt.partrelid "
+        "WHERE c.relname = %s AND pg_table_is_visible(c.oid)",
+        [table]
+    )
+    return cursor.fetchone() is not None
+
+
+def month_partitions(cursor, table):
+    """{month: partition name} for the monthly partitions of `table`"""
+    cursor.execute(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = %s::regclass",
+        [table]
+    )
+    prefix = f"{table}_p"
+    partitions = {}
+    for (name,) in cursor.fetchall():
+        suffix = name[len(prefix):]
+        if name.startswith(prefix) and len(suffix) == 6 and suffix.isdigit():
+            partitions[datetime.date(int(suffix[:4]), int(suffix[4:]), 1)] = name
+    return partitions
+
+
+def _in_month(month):
+    return f'"{PARTITION_KEY}" >= {_bound(month)} AND "{PARTITION_KEY}" < {_bound(add_months(month, 1))}'
+
+
+def _default_has_rows(cursor, table, month):
+    cursor.execute("SELECT to_regclass(%s)", [f'"{table}_pdefault"'])
+    if cursor.fetchone()[0] is None:
+        return False
+    cursor.execute(f'SELECT 1 FROM "{table}_pdefault" WHERE {_in_month(month)} LIMIT 1')
+    return cursor.fetchone() is not None
+
+
+def _create_partition(cursor, table, month):
+    """
+    Create the partition for `month`. PostgreSQL refuses while DEFAULT holds
+    rows of that month, so DEFAULT is then detached, its rows for the month
+    moved into the new partition and DEFAULT attached again, in one
+    transaction.
+    """
+    name = partition_name(table, month)
+    create = (
+        f'CREATE TABLE "{name}" PARTITION OF "{table}" '
+        f'FOR VALUES FROM ({_bound(month)}) TO ({_bound(add_months(month, 1))})'
+    )
+    if not _default_has_rows(cursor, table, month):
+        cursor.execute(create)
+        return name
+
+    default = f"{table}_pdefault"
+    with transaction.atomic(using=cursor.db.alias):
+        cursor.execute(f'ALTER TABLE "{table}" DETACH PARTITION "{default}"')
+        cursor.execute(create)
+        cursor.execute(f'INSERT INTO "{name}" SELECT * FROM "{default}" WHERE {_in_month(month)}')
+        cursor.execute(f'DELETE FROM "{default}" WHERE {_in_month(month)}')
+        cursor.execute(f'ALTER TABLE "{table}" ATTACH PARTITION "{default}" DEFAULT')
+    return name
+
+
+def ensure_partitions(cursor, table, first_month=None, months_ahead=MONTHS_AHEAD):
+    """
+    Create the monthly partitions from `first_month` (default: this month)
+    through `months_ahead` months from now, and the DEFAULT partition.
+    Existing partitions are left alone; rows DEFAULT caught for a new month
+    move into its partition. Returns the names created.
+    """
+    current = month_start(timezone.now())
+    month = min(first_month or current, current)
+    existing = month_partitions(cursor, table)
+    created = []
+    while month <= add_months(current, months_ahead):
+        if month not in existing:
+            created.append(_create_partition(cursor, table, month))
+        month = add_months(month, 1)
+    cursor.execute(f'CREATE TABLE IF NOT EXISTS "{table}_pdefault" PARTITION OF "{table}" DEFAULT')
+    return created
+
+
+def lock_partition(cursor, table, month):
+    """
+    Block writes to the partition holding `month` (reads go on) until the
+    transaction ends, so it can be exported and dropped without losing rows
+    """
+    cursor.execute(f'LOCK TABLE "{partition_name(table, month)}" IN SHARE ROW EXCLUSIVE MODE')
+
+
+def drop_partition(cursor, table, month):
+    """Detach and drop the partition holding `month`; its rows go with it"""
+    name = partition_name(table, month)
+    cursor.execute(f'ALTER TABLE "{table}" DETACH PARTITION "{name}"')
+    cursor.execute(f'DROP TABLE "{name}"')
+
+
+def _rebuild(cursor, table, partitioned):
+    """
+    Copy `table` into a new table of the same name, partitioned by month or
+    plain, then replay its indexes and foreign keys under their own names so
+    later Django migrations still find them.
+    """
+    cursor.execute(
+        "SELECT indexdef FROM pg_indexes WHERE schemaname = current_schema() AND tablename = %s "
+        "AND indexname NOT IN (SELECT conname FROM pg_constraint "
+        "WHERE conrelid = %s::regclass AND contype IN ('p', 'u'))",
+        [table, table]
+    )
+    indexes = [row[0] for row in cursor.fetchall()]
+    cursor.execute(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+        "WHERE conrelid = %s::regclass AND contype = 'f'",
+        [table]
+    )
+    foreign_keys = cursor.fetchall()
+    cursor.execute(f'SELECT min("{PARTITION_KEY}") FROM "{table}"')
+    oldest = cursor.fetchone()[0]
+
+    old = f"{table}_old"
+    cursor.execute(f'ALTER TABLE "{table}" RENAME TO "{old}"')
+    partition_by = f' PARTITION BY RANGE ("{PARTITION_KEY}")' if partitioned else ''
+    cursor.execute(f'CREATE TABLE "{table}" (LIKE "{old}" INCLUDING DEFAULTS){partition_by}')
+    # A serial default still points at the old table's sequence
+    cursor.execute(f'ALTER TABLE "{table}" ALTER COLUMN "id" DROP DEFAULT')
+    if partitioned:
+        # Monthly partitions must exist before DEFAULT takes any rows
+        ensure_partitions(cursor, table, month_start(oldest) if oldest else None)
+    cursor.execute(f'INSERT INTO "{table}" SELECT * FROM "{old}"')
+    # Drops the old id sequence, indexes and constraints, freeing their names
+    cursor.execute(f'DROP TABLE "{old}"')
+
+    sequence = f"{table}_id_seq"
+    cursor.execute(f'CREATE SEQUENCE "{sequence}" OWNED BY "{table}"."id"')
+    cursor.execute(f'ALTER TABLE "{table}" ALTER COLUMN "id" SET DEFAULT nextval(\'"{sequence}"\')')
+    cursor.execute(
+        f'SELECT setval(\'"{sequence}"\', COALESCE((SELECT max("id") FROM "{table}"), 0) + 1, false)'
+    )
+    key = f'"id", "{PARTITION_KEY}"' if partitioned else '"id"'
+    cursor.execute(f'ALTER TABLE "{table}" ADD CONSTRAINT "{table}_pkey" PRIMARY KEY ({key})')
+    for indexdef in indexes:
+        cursor.execute(indexdef)
+    for name, definition in foreign_keys:
+        cursor.execute(f'ALTER TABLE "{table}" ADD CONSTRAINT "{name}" {definition}')
+
+
+def partition_table(cursor, table):
+    if not is_partitioned(cursor, table):
+        _rebuild(cursor, table, partitioned=True)
+
+
+def unpartition_table(cursor, table):
+    if is_partitioned(cursor, table):
+        _rebuild(cursor, table, partitioned=False)
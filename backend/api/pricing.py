@@ -0,0 +1,69 @@
+"""
+Token pricing for digitizing orders.
+
+The base price comes from EmbroiderySizePricing. When DENSITY_PRICING_ENABLED
+is set, it is scaled by the density tier of the design's pre-order stitch
+estimate, so a solid fill costs more than an outline of the same size.
+"""
+import logging
+
+from django.conf import settings
+
+from .digitizing import design_source_image
+from .models import EmbroiderySizePricing
+from .utils.stitch_estimator import StitchEstimator
+
+logger = logging.getLogger(__name__)
+
+_estimator = StitchEstimator()
+
+
+def estimate_design_stitches(design, size_cm=None):
+    """Stitch estimate for a design at a size, None when it has no readable image"""
+    source = design_source_image(design)
+    if not source:
+        return None
+    try:
+        with source.open('rb') as fh:
+            return _estimator.estimate(fh, size_cm or design.embroidery_size_cm)
+    except Exception as e:
+        logger.warning(f"Stitch estimate failed for design {design.id}: {str(e)}")
+        return None
+
+
+def density_multiplier(estimate):
+    if not estimate:
+        return 1.0
+    for max_coverage, multiplier in settings.DENSITY_PRICE_TIERS:
+        if estimate['coverage'] <= max_coverage:
+            return multiplier
+    return settings.DENSITY_PRICE_TIERS[-1][1]
+
+
+def price_for_design(design, size_cm, estimate=None):
+    """
+    Token price of digitizing a design at size_cm.
+
+    Pass an estimate already computed for the same size to avoid reading the
+    image twice.
+    """
+    return prices_for_designs([(design, size_cm)], [estimate])[0]
+
+
+def prices_for_designs(items, estimates=None):
+    """
+    Token prices for a list of (design, size_cm) pairs.
+
+    Size prices come from a single lookup in the cached tier table, so
+    quoting a cart costs no queries once the table is warm.
+    """
+    prices = EmbroiderySizePricing.get_prices_for_sizes([size_cm for _, size_cm in items])
+    if not settings.DENSITY_PRICING_ENABLED:
+        return prices
+    estimates = estimates or [None] * len(items)
+    quoted = []
+    for (design, size_cm), price, estimate in zip(items, prices, estimates):
+        if estimate is None:
+            estimate = estimate_design_stitches(design, size_cm)
+        quoted.append(int(round(price * density_multiplier(estimate))))
+    return quoted
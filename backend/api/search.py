@@ -0,0 +1,140 @@
+"""
+Ranked staff search over designs, orders and chat messages.
+
+PostgreSQL matches the trigger-maintained search vectors (websearch syntax:
+quoted phrases, -exclusions) ranked by ts_rank, and ranks order lookups by
+trigram similarity. SQLite matches the FTS5 tables ranked by bm25, with
+every word treated as a prefix. The indexes are described in
+api.search_index. Every function takes the database alias to read from.
+"""
+import re
+
+from django.contrib.auth.models import User
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramSimilarity
+from django.db import connections
+from django.db.models import Case, F, FloatField, Q, Value, When
+from django.db.models.functions import Greatest
+
+from .models import Design, Message, Order
+from .search_index import SEARCH_CONFIG
+
+
+def _fts5_query(term):
+    """Words of `term` as FTS5 prefix terms, quoted so user input is never syntax"""
+    words = re.findall(r'\w+', term)
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def _fts5_ranked_ids(using, table, term, limit):
+    """[(id, rank)] best first; bm25 is lower-is-better, so the rank is negated"""
+    query = _fts5_query(term)
+    if not query:
+        return []
+    fts = f"{table}_fts"
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            f"SELECT rowid, -bm25({fts}) FROM {fts} WHERE {fts} MATCH %s ORDER BY bm25({fts}) LIMIT %s",
+            [query, limit]
+        )
+        return cursor.fetchall()
+
+
+def _in_rank_order(queryset, ranked):
+    """Instances for [(id, rank)], in that order, each with .rank set"""
+    instances = queryset.in_bulk([pk for pk, _ in ranked])
+    results = []
+    for pk, rank in ranked:
+        if pk in instances:
+            instances[pk].rank = rank
+            results.append(instances[pk])
+    return results
+
+
+def search_designs(term, limit=20, using='default'):
+    designs = Design.objects.using(using).select_related('user')
+    vendor = connections[using].vendor
+    if vendor == 'postgresql':
+        query = SearchQuery(term, config=SEARCH_CONFIG, search_type='websearch')
+        return list(
+            designs.filter(search_vector=query)
+            .annotate(rank=SearchRank(F('search_vector'), query))
+            .order_by('-rank', '-id')[:limit]
+        )
+    if vendor == 'sqlite':
+        return _in_rank_order(designs, _fts5_ranked_ids(using, 'api_design', term, limit))
+    return list(
+        designs.filter(Q(name__icontains=term) | Q(prompt__icontains=term))
+        .annotate(rank=Value(1.0, output_field=FloatField()))[:limit]
+    )
+
+
+def search_messages(term, limit=20, using='default'):
+    messages = Message.objects.using(using).select_related('sender', 'conversation__order')
+    vendor = connections[using].vendor
+    if vendor == 'postgresql':
+        query = SearchQuery(term, config=SEARCH_CONFIG, search_type='websearch')
+        return list(
+            messages.filter(search_vector=query)
+            .annotate(rank=SearchRank(F('search_vector'), query))
+            .order_by('-rank', '-id')[:limit]
+        )
+    if vendor == 'sqlite':
+        return _in_rank_order(messages, _fts5_ranked_ids(using, 'api_message', term, limit))
+    return list(
+        messages.filter(content__icontains=term)
+        .annotate(rank=Value(1.0, output_field=FloatField()))
+        .order_by('-id')[:limit]
+    )
+
+
+def matching_order_ids(term, using='default'):
+    """
+    Ids of orders matching `term`, as one UNION of per-table lookups.
+
+    A single OR across the joined order, user and design columns makes the
+    planner scan orders; looking each table up on its own lets every branch
+    use that table's (trigram or full-text) index, and the user and design
+    branches then reach orders through their foreign key indexes.
+    """
+    orders = Order.objects.using(using).order_by()
+    users = User.objects.using(using).filter(username__icontains=term)
+    designs = Design.objects.using(using).filter(name__icontains=term)
+    branches = [
+        orders.filter(order_number__icontains=term),
+        orders.filter(user__in=users),
+        orders.filter(design__in=designs),
+    ]
+    vendor = connections[using].vendor
+    if vendor == 'postgresql':
+        query = SearchQuery(term, config=SEARCH_CONFIG, search_type='websearch')
+        branches.append(orders.filter(design__in=Design.objects.using(using).filter(search_vector=query)))
+    elif vendor == 'sqlite':
+        design_ids = [pk for pk, _ in _fts5_ranked_ids(using, 'api_design', term, 1000)]
+        branches.append(orders.filter(design_id__in=design_ids))
+    first, *rest = [branch.values('id') for branch in branches]
+    return first.union(*rest)
+
+
+def search_orders(term, limit=20, using='default'):
+    """
+    Orders by order number, customer username or design name (substring,
+    trigram-indexed on PostgreSQL) or by a full-text match on their design
+    """
+    orders = Order.objects.using(using).select_related('user', 'design').filter(
+        id__in=matching_order_ids(term, using)
+    )
+    if connections[using].vendor == 'postgresql':
+        rank = Greatest(
+            TrigramSimilarity('order_number', term),
+            TrigramSimilarity('user__username', term),
+            TrigramSimilarity('design__name', term),
+        )
+    else:
+        rank = Case(
+            When(order_number__iexact=term, then=Value(1.0)),
+            When(order_number__istartswith=term, then=Value(0.8)),
+            When(user__username__iexact=term, then=Value(0.6)),
+            default=Value(0.4),
+            output_field=FloatField(),
+        )
+    return list(orders.annotate(rank=rank).order_by('-rank', '-created_at')[:limit])
@@ -0,0 +1,164 @@
+"""
+Database-side search indexes for staff search (see api.search).
+
+PostgreSQL: Design and Message carry a `search_vector` tsvector that a
+BEFORE INSERT/UPDATE trigger keeps current, so bulk_create, bulk_update
+and raw writes are covered as well as save(). Both vectors have GIN
+indexes. pg_trgm GIN indexes on UPPER(order_number), UPPER(username) and
+UPPER(design name) serve the icontains lookups Django compiles to
+UPPER(col) LIKE UPPER('%term%'), including the admin's search_fields.
+
+SQLite (local development): FTS5 tables api_design_fts and api_message_fts
+index the same columns as external-content tables synced by triggers.
+SQLite drops a table's triggers when a migration rebuilds the table; a
+post_migrate handler (api.signals) puts them back through repair().
+
+Only raw SQL here, so migrations can use it.
+"""
+from .partitions import is_partitioned
+
+SEARCH_CONFIG = 'english'
+
+# table -> tsvector expression over the row being written
+VECTORS = {
+    'api_design': (
+        f"setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(NEW.name, '')), 'A') || "
+        f"setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(NEW.prompt, '')), 'B')"
+    ),
+    'api_message': f"to_tsvector('{SEARCH_CONFIG}', coalesce(NEW.content, ''))",
+}
+VECTOR_COLUMNS = {
+    'api_design': ('name', 'prompt'),
+    'api_message': ('content',),
+}
+# name -> (table, column) for trigram substring lookups
+TRIGRAM_INDEXES = {
+    'api_order_number_trgm_idx': ('api_order', 'order_number'),
+    'api_design_name_trgm_idx': ('api_design', 'name'),
+    'api_user_username_trgm_idx': ('auth_user', 'username'),
+}
+
+BACKFILL_BATCH = 5000
+
+
+def _create_index(cursor, name, table, definition):
+    # Partitioned tables cannot build concurrently
+    concurrently = '' if is_partitioned(cursor, table) else 'CONCURRENTLY '
+    cursor.execute(f'CREATE INDEX {concurrently}IF NOT EXISTS "{name}" ON "{table}" USING gin ({definition})')
+
+
+def _install_postgresql(cursor):
+    cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for table, vector in VECTORS.items():
+        columns = ', '.join(f'"{column}"' for column in VECTOR_COLUMNS[table])
+        cursor.execute(
+            f'CREATE OR REPLACE FUNCTION "{table}_search_vector_update"() RETURNS trigger AS $$ '
+            f'BEGIN NEW.search_vector := {vector}; RETURN NEW; END $$ LANGUAGE plpgsql'
+        )
+        cursor.execute(f'DROP TRIGGER IF EXISTS "{table}_search_vector_trigger" ON "{table}"')
+        cursor.execute(
+            f'CREATE TRIGGER "{table}_search_vector_trigger" BEFORE INSERT OR UPDATE OF {columns} '
+            f'ON "{table}" FOR EACH ROW EXECUTE FUNCTION "{table}_search_vector_update"()'
+        )
+        _backfill_postgresql(cursor, table)
+        _create_index(cursor, f"{table}_search_idx", table, 'search_vector')
+    for name, (table, column) in TRIGRAM_INDEXES.items():
+        _create_index(cursor, name, table, f'UPPER("{column}") gin_trgm_ops')
+
+
+def _backfill_postgresql(cursor, table):
+    """Fill search_vector in id ranges, so no statement holds the whole table"""
+    vector = VECTORS[table].replace('NEW.', '')
+    cursor.execute(f'SELECT COALESCE(max("id"), 0) FROM "{table}"')
+    last_id = cursor.fetchone()[0]
+    for start in range(0, last_id, BACKFILL_BATCH):
+        cursor.execute(
+            f'UPDATE "{table}" SET search_vector = {vector} WHERE "id" > %s AND "id" <= %s',
+            [start, start + BACKFILL_BATCH]
+        )
+
+
+def _uninstall_postgresql(cursor):
+    for name in TRIGRAM_INDEXES:
+        cursor.execute(f'DROP INDEX IF EXISTS "{name}"')
+    for table in VECTORS:
+        cursor.execute(f'DROP INDEX IF EXISTS "{table}_search_idx"')
+        cursor.execute(f'DROP TRIGGER IF EXISTS "{table}_search_vector_trigger" ON "{table}"')
+        cursor.execute(f'DROP FUNCTION IF EXISTS "{table}_search_vector_update"()')
+
+
+def _install_sqlite(cursor):
+    for table, columns in VECTOR_COLUMNS.items():
+        fts = f"{table}_fts"
+        names = ', '.join(columns)
+        new = ', '.join(f'new.{column}' for column in columns)
+        old = ', '.join(f'old.{column}' for column in columns)
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({names}, content='{table}', content_rowid='id')"
+        )
+        cursor.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {table} BEGIN "
+            f"INSERT INTO {fts}(rowid, {names}) VALUES (new.id, {new}); END"
+        )
+        cursor.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {table} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, {names}) VALUES ('delete', old.id, {old}); END"
+        )
+        cursor.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE OF {names} ON {table} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, {names}) VALUES ('delete', old.id, {old}); "
+            f"INSERT INTO {fts}(rowid, {names}) VALUES (new.id, {new}); END"
+        )
+        cursor.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
+def _sqlite_triggers(table):
+    return [f"{table}_fts_{event}" for event in ('insert', 'delete', 'update')]
+
+
+def _repair_sqlite(cursor):
+    cursor.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'trigger')")
+    names = {row[0] for row in cursor.fetchall()}
+    tables = [table for table in VECTOR_COLUMNS if f"{table}_fts" in names]
+    if not tables or all(trigger in names for table in tables for trigger in _sqlite_triggers(table)):
+        return False
+    # The FTS tables also missed every write made while the triggers were gone
+    _install_sqlite(cursor)
+    return True
+
+
+def _uninstall_sqlite(cursor):
+    for table in VECTOR_COLUMNS:
+        fts = f"{table}_fts"
+        for trigger in _sqlite_triggers(table):
+            cursor.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        cursor.execute(f"DROP TABLE IF EXISTS {fts}")
+
+
+def install(connection):
+    """Create (or repair) the search indexes and refill them; idempotent"""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            _install_postgresql(cursor)
+        elif connection.vendor == 'sqlite':
+            _install_sqlite(cursor)
+
+
+def repair(connection):
+    """
+    Reinstall SQLite sync triggers lost to a table rebuild, refilling the FTS
+    tables. Returns whether anything was missing; nothing to do on PostgreSQL
+    (ALTER TABLE keeps triggers) or before the search indexes are installed.
+    """
+    if connection.vendor != 'sqlite':
+        return False
+    with connection.cursor() as cursor:
+        return _repair_sqlite(cursor)
+
+
+def uninstall(connection):
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            _uninstall_postgresql(cursor)
+        elif connection.vendor == 'sqlite':
+            _uninstall_sqlite(cursor)
@@ -1,11 +1,14 @@
 from rest_framework import serializers
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.db import transaction
 from .models import (
     UserProfile, TokenPackage, TokenTransaction, 
     Design, Order, Cart, DesignFeature, DesignFeatureUsage,
     EmailVerificationToken, PasswordResetToken, Conversation, Message,
-    OrderResource
+    OrderResource, OrderFileMetrics, OrderOutputFile
 )
+from .pagination import page_by_id
 
 class UserSerializer(serializers.ModelSerializer):
     tokens = serializers.IntegerField(source='profile.tokens', read_only=True)
@@ -37,25 +40,27 @@ class RegisterSerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
         full_name = validated_data.pop('full_name', '')
-        user = User.objects.create_user(
-            username=validated_data['username'],
-            email=validated_data['email'],
-            password=validated_data['password']
-        )
+        with transaction.atomic():
+            user = User.objects.create_user(
+                username=validated_data['username'],
+                email=validated_data['email'],
+                password=validated_data['password']
+            )
+            
+            # Set first_name and last_name if full_name provided
+            if full_name:
+                name_parts = full_name.split(' ', 1)
+                user.first_name = name_parts[0]
+                if len(name_parts) > 1:
+                    user.last_name = name_parts[1]
+                user.save()
+            
+            # Create profile with 0 tokens (will get 50 after email verification)
+            UserProfile.objects.create(user=user, tokens=0, email_verified=False)
+            
+            verification_token = EmailVerificationToken.objects.create(user=user)
         
-        # Set first_name and last_name if full_name provided
-        if full_name:
-            name_parts = full_name.split(' ', 1)
-            user.first_name = name_parts[0]
-            if len(name_parts) > 1:
-                user.last_name = name_parts[1]
-            user.save()
-        
-        # Create profile with 0 tokens (will get 50 after email verification)
-        UserProfile.objects.create(user=user, tokens=0, email_verified=False)
-        
-        # Create and send verification token
-        verification_token = EmailVerificationToken.objects.create(user=user)
+        # Send the verification email once the account is committed
         verification_token.send_verification_email()
         
         return user
@@ -70,7 +75,7 @@ class TokenPackageSerializer(serializers.ModelSerializer):
 class TokenTransactionSerializer(serializers.ModelSerializer):
     class Meta:
         model = TokenTransaction
-        fields = ['id', 'type', 'amount', 'description', 'created_at']
+        fields = ['id', 'type', 'amount', 'balance_after', 'description', 'created_at']
 
 
 class DesignSerializer(serializers.ModelSerializer):
@@ -119,6 +124,23 @@ class DesignSerializer(serializers.ModelSerializer):
         return None
 
 
+class OrderFileMetricsSerializer(serializers.ModelSerializer):
+    """Stitch statistics for one uploaded output file"""
+    class Meta:
+        model = OrderFileMetrics
+        fields = [
+            'format', 'stitch_count', 'color_changes', 'trims', 'jumps',
+            'min_x', 'min_y', 'max_x', 'max_y', 'width_mm', 'height_mm',
+            'machine_brand', 'stitches_per_minute', 'estimated_seconds', 'updated_at'
+        ]
+
+
+class OrderOutputFileSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = OrderOutputFile
+        fields = ['format', 'file', 'size', 'sha256', 'created_at']
+
+
 class OrderSerializer(serializers.ModelSerializer):
     user_username = serializers.CharField(source='user.username', read_only=True)
     user_email = serializers.CharField(source='user.email', read_only=True)
@@ -127,19 +149,18 @@ class OrderSerializer(serializers.ModelSerializer):
     design_name = serializers.SerializerMethodField()
     design_preview = serializers.SerializerMethodField()
     design_details = serializers.SerializerMethodField()
+    stitch_preview = serializers.SerializerMethodField()
+    stitch_preview_thumbnail = serializers.SerializerMethodField()
+    file_metrics = OrderFileMetricsSerializer(many=True, read_only=True)
+    output_files = OrderOutputFileSerializer(many=True, read_only=True)
     
     class Meta:
         model = Order
         fields = [
             'id', 'order_number', 'user', 'user_username', 'user_email', 'user_first_name', 'user_last_name',
             'design', 'design_name', 'design_preview', 'design_details',
-            'status', 'tokens_used', 'embroidery_size_cm', 'requested_formats',
-            # Industrial formats
-            'output_dst', 'output_dsb', 'output_dsz', 'output_exp', 'output_tbf', 'output_fdr', 'output_stx',
-            # Domestic formats
-            'output_pes', 'output_pec', 'output_jef', 'output_sew', 'output_hus', 'output_vip', 'output_vp3', 'output_xxx',
-            # Commercial formats
-            'output_cmd', 'output_tap', 'output_tim', 'output_emt', 'output_10o', 'output_ds9',
+            'status', 'tokens_used', 'embroidery_size_cm', 'requested_formats', 'output_files',
+            'stitch_preview', 'stitch_preview_thumbnail', 'file_metrics',
             'email_sent', 'notification_sent_at',
             'created_at', 'updated_at', 'completed_at'
         ]
@@ -168,6 +189,27 @@ class OrderSerializer(serializers.ModelSerializer):
             request = self.context.get('request')
             return DesignSerializer(obj.design, context={'request': request}).data
         return None
+    
+    def _file_url(self, field):
+        if not field:
+            return None
+        request = self.context.get('request')
+        if request:
+            return request.build_absolute_uri(field.url)
+        return field.url
+    
+    def get_stitch_preview(self, obj):
+        return self._file_url(obj.stitch_preview)
+    
+    def get_stitch_preview_thumbnail(self, obj):
+        return self._file_url(obj.stitch_preview_thumbnail)
+    
+    def to_representation(self, obj):
+        data = super().to_representation(obj)
+        # Compatibility: clients still read output_<format> URLs, now only for formats delivered
+        for output in data['output_files']:
+            data[f"output_{output['format']}"] = output['file']
+        return data
 
 
 class CartSerializer(serializers.ModelSerializer):
@@ -281,17 +323,30 @@ class ConversationSerializer(serializers.ModelSerializer):
     customer_username = serializers.CharField(source='customer.username', read_only=True)
     admin_username = serializers.CharField(source='admin.username', read_only=True, allow_null=True)
     order_number = serializers.CharField(source='order.order_number', read_only=True)
-    messages = MessageSerializer(many=True, read_only=True)
     unread_count = serializers.SerializerMethodField()
     
     class Meta:
         model = Conversation
-        fields = ['id', 'order', 'order_number', 'customer', 'customer_username', 'admin', 'admin_username', 'messages', 'unread_count', 'created_at', 'updated_at']
+        fields = ['id', 'order', 'order_number', 'customer', 'customer_username', 'admin', 'admin_username', 'unread_count', 'created_at', 'updated_at']
         read_only_fields = ['id', 'order', 'customer', 'created_at', 'updated_at']
     
+    def to_representation(self, obj):
+        """
+        Only the latest page of messages, oldest first for display.
+        `messages_page.before` fetches earlier ones from the messages endpoint.
+        """
+        data = super().to_representation(obj)
+        rows, page = page_by_id(obj.messages.select_related('sender'), settings.API_PAGE_SIZE)
+        data['messages'] = MessageSerializer(rows[::-1], many=True, context=self.context).data
+        data['messages_page'] = page
+        return data
+    
     def get_unread_count(self, obj):
-        """Count unread messages"""
-        return obj.messages.filter(is_read=False).count()
+        """Count messages above the requesting user's read watermark"""
+        request = self.context.get('request')
+        if request is None:
+            return obj.messages.filter(is_read=False).count()
+        return obj.unread_count_for(request.user)
 
 
 class ConversationListSerializer(serializers.ModelSerializer):
@@ -309,22 +364,18 @@ class ConversationListSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'order', 'customer', 'updated_at']
     
     def get_last_message(self, obj):
-        """Get the last message in the conversation"""
-        last_msg = obj.messages.last()
-        if last_msg:
-            return {
-                'id': last_msg.id,
-                'sender_username': last_msg.sender.username,
-                'content': last_msg.content[:100] if last_msg.content else '',
-                'has_attachment': last_msg.has_attachment,
-                'attachment_name': last_msg.attachment_name or '',
-                'created_at': last_msg.created_at
-            }
-        return None
+        """Last message, from the annotations added by Conversation.objects.for_list()"""
+        if obj.last_message_id is None:
+            return None
+        return {
+            'id': obj.last_message_id,
+            'sender_username': obj.last_message_sender,
+            'content': obj.last_message_content or '',
+            'has_attachment': bool(obj.last_message_attachment),
+            'attachment_name': obj.last_message_attachment_name or '',
+            'created_at': obj.last_message_created_at
+        }
     
     def get_unread_count(self, obj):
-        """Count unread messages for current user"""
-        request = self.context.get('request')
-        if request and request.user:
-            return obj.messages.filter(is_read=False).exclude(sender=request.user).count()
-        return 0
\ No newline at end of file
+        """Unread messages for the requesting user (annotated by for_list())"""
+        return obj.unread_count
\ No newline at end of file
@@ -0,0 +1,22 @@
+from django.db import connections, transaction
+from django.db.models.signals import post_delete, post_migrate, post_save
+from django.dispatch import receiver
+
+from . import search_index
+from .models import EmbroiderySizePricing, size_pricing_table
+
+
+@receiver([post_save, post_delete], sender=EmbroiderySizePricing)
+def invalidate_size_pricing(sender, **kwargs):
+    # Bump now for this process, and again on commit for workers that
+    # reloaded the old tiers while the transaction was still open
+    size_pricing_table.invalidate()
+    transaction.on_commit(size_pricing_table.invalidate)
+
+
+@receiver(post_migrate)
+def repair_search_triggers(sender, using, verbosity=1, **kwargs):
+    # A later migration that rebuilt api_design or api_message on SQLite
+    # took the FTS sync triggers with it
+    if sender.name == 'api' and search_index.repair(connections[using]) and verbosity:
+        print("✅ Search index triggers reinstalled")
@@ -1,3 +1,1282 @@
-from django.test import TestCase
+import contextlib
+import datetime
+import hashlib
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import numpy as np
+import pyembroidery
+from PIL import Image
+
+from django.contrib import admin as django_admin
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.management.sql import emit_post_migrate_signal
+from django.db import connection, router, transaction
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from .models import (
+    ArchivedPartition, Cart, Conversation, Design, DesignGeometry, EmbroiderySizePricing, Message, Order, OrderFileMetrics, OrderOutputFile, PaymentFulfillment,
+    TokenCostSettings, TokenPackage, TokenTransaction, UserProfile, size_pricing_table
+)
+from . import ledger, pricing, search_index, views
+from .archive import archive_month
+from .migration_utils import batched_update
+from .order_numbers import allocate_order_numbers
+from .partitions import MONTHS_AHEAD, add_months, ensure_partitions, month_partitions, month_start
+from .search import matching_order_ids
+from .search_index import TRIGRAM_INDEXES
+from .utils.digitizer import EmbroideryDigitizer, pattern_to_bytes
+from .utils.stitch_estimator import StitchEstimator
+from .utils.stitch_renderer import StitchRenderer
+from .utils.stitch_stats import compute_stitch_stats
+from studio.routers import ReplicaPinMiddleware, ReplicaRouter, is_pinned, pin_to_primary, read_replica
+
+
+# Version stamps of api.caching live in the cache; keep tests off the shared one
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'api-tests'}}
+
+
+def create_orders(user, count, prefix='T'):
+    """Bulk-create `count` orders, each with its own design and file metrics"""
+    designs = Design.objects.bulk_create(
+        Design(user=user, name=f"Design {i}", status='processing') for i in range(count)
+    )
+    orders = Order.objects.bulk_create(
+        Order(user=user, design=design, order_number=f"ORD-{prefix}-{user.id}-{i:05d}",
+              requested_formats=['dst', 'pes'])
+        for i, design in enumerate(designs)
+    )
+    OrderFileMetrics.objects.bulk_create(
+        OrderFileMetrics(order=order, format='dst', stitch_count=1000) for order in orders
+    )
+    return orders
+
+
+def shapes(height=200, width=160):
+    """White background, a red square with a blue square inside it"""
+    rgb = np.full((height, width, 3), 255, dtype=np.uint8)
+    rgb[20:180, 20:140] = (200, 0, 0)
+    rgb[60:120, 50:110] = (0, 0, 200)
+    return rgb
+
+
+def sample_pattern():
+    """11 stitches along x, a trim and colour change, then 6 stitches along y"""
+    pattern = pyembroidery.EmbPattern()
+    for x in range(0, 110, 10):
+        pattern.add_stitch_absolute(pyembroidery.STITCH, x, 0)
+    pattern.add_command(pyembroidery.TRIM)
+    pattern.add_command(pyembroidery.COLOR_CHANGE)
+    for y in range(0, 60, 10):
+        pattern.add_stitch_absolute(pyembroidery.STITCH, 100, y)
+    pattern.add_command(pyembroidery.END)
+    return pattern
+
+
+class OrderListQueryCountTests(TestCase):
+    """List endpoints must not issue per-row queries"""
+
+    SIZES = (1, 10, 1000)
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def query_count(self, url, user):
+        self.client.force_authenticate(user)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries), response.json()
+
+    def test_list_orders_query_count_is_constant(self):
+        counts = []
+        for size in self.SIZES:
+            user = User.objects.create_user(username=f"customer{size}", password='x')
+            create_orders(user, size)
+            count, data = self.query_count('/api/orders/', user)
+            self.assertEqual(len(data['orders']), size)
+            counts.append(count)
+        self.assertEqual(len(set(counts)), 1, f"Query count grew with orders: {counts}")
+
+    def test_admin_list_orders_query_count_is_constant(self):
+        admin = User.objects.create_user(username='admin', password='x', is_staff=True)
+        customer = User.objects.create_user(username='customer', password='x')
+        counts = []
+        created = 0
+        for size in self.SIZES:
+            create_orders(customer, size - created, prefix=f"A{size}")
+            created = size
+            count, data = self.query_count('/api/admin/orders/', admin)
+            self.assertEqual(data['count'], size)
+            counts.append(count)
+        self.assertEqual(len(set(counts)), 1, f"Query count grew with orders: {counts}")
+
+    def test_list_designs_query_count_is_constant(self):
+        counts = []
+        for size in self.SIZES:
+            user = User.objects.create_user(username=f"designer{size}", password='x')
+            Design.objects.bulk_create(Design(user=user, name=f"Design {i}") for i in range(size))
+            count, data = self.query_count('/api/designs/', user)
+            self.assertEqual(len(data['designs']), size)
+            counts.append(count)
+        self.assertEqual(len(set(counts)), 1, f"Query count grew with designs: {counts}")
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='customer', password='x')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_unpaginated_response_is_unchanged(self):
+        create_orders(self.user, 3)
+        data = self.client.get('/api/orders/').json()
+        self.assertEqual(len(data['orders']), 3)
+        self.assertNotIn('next_cursor', data)
+
+    def test_cursor_walks_every_order_once(self):
+        create_orders(self.user, 25)
+        expected = list(Order.objects.filter(user=self.user).order_by('-created_at', '-id').values_list('id', flat=True))
+
+        seen, cursor = [], None
+        while True:
+            params = {'paginate': 1, 'page_size': 10}
+            if cursor:
+                params['cursor'] = cursor
+            data = self.client.get('/api/orders/', params).json()
+            seen.extend(order['id'] for order in data['orders'])
+            cursor = data['next_cursor']
+            if not data['has_more']:
+                break
+        self.assertEqual(seen, expected)
+
+    def test_conversation_activity_does_not_move_pages(self):
+        for order in create_orders(self.user, 15):
+            Conversation.objects.create(order=order, customer=self.user)
+        first = self.client.get('/api/chat/conversations/', {'paginate': 1, 'page_size': 10}).json()
+        self.assertEqual(first['count'], 15)
+
+        # A new message on a second-page conversation touches its updated_at
+        unseen = Conversation.objects.exclude(id__in=[c['id'] for c in first['conversations']])
+        Conversation.objects.filter(id=unseen.first().id).update(updated_at=timezone.now())
+
+        second = self.client.get('/api/chat/conversations/', {
+            'paginate': 1, 'page_size': 10, 'cursor': first['next_cursor'],
+        }).json()
+        self.assertEqual(
+            sorted(c['id'] for c in second['conversations']),
+            sorted(unseen.values_list('id', flat=True))
+        )
+
+    def test_admin_order_count_is_the_total(self):
+        create_orders(self.user, 12)
+        staff = User.objects.create_user(username='staff', password='x', is_staff=True)
+        self.client.force_authenticate(staff)
+        data = self.client.get('/api/admin/orders/', {'paginate': 1, 'page_size': 5}).json()
+        self.assertEqual((len(data['orders']), data['count']), (5, 12))
+
+    def test_invalid_cursor_is_rejected(self):
+        response = self.client.get('/api/orders/', {'paginate': 1, 'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/api/chat/conversations/', {'paginate': 1, 'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class SizePricingCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        EmbroiderySizePricing.objects.create(size_cm=5, price_in_tokens=10)
+        EmbroiderySizePricing.objects.create(size_cm=40, price_in_tokens=30)
+
+    def tearDown(self):
+        # The test transaction is rolled back without firing signals
+        size_pricing_table.invalidate()
+
+    def test_prices_interpolate_and_clamp(self):
+        prices = EmbroiderySizePricing.get_prices_for_sizes([2, 5, 20, 40, 60])
+        self.assertEqual(prices, [10, 10, 19, 30, 30])
+
+    def test_quoting_is_query_free_after_warm_up(self):
+        EmbroiderySizePricing.get_price_for_size(10)
+        with self.assertNumQueries(0):
+            for size in range(5, 55):
+                EmbroiderySizePricing.get_price_for_size(size)
+
+    def test_saving_a_tier_refreshes_prices(self):
+        self.assertEqual(EmbroiderySizePricing.get_price_for_size(40), 30)
+        EmbroiderySizePricing.objects.filter(size_cm=40).get().delete()
+        EmbroiderySizePricing.objects.create(size_cm=40, price_in_tokens=50)
+        self.assertEqual(EmbroiderySizePricing.get_price_for_size(40), 50)
+
+
+class StitchEstimatorTests(TestCase):
+    def rgba(self, rgb):
+        return np.dstack([rgb, np.full(rgb.shape[:2], 255, dtype=np.uint8)])
+
+    def test_estimate_of_two_colour_fill(self):
+        estimate = StitchEstimator().estimate(self.rgba(shapes()), 10)
+        # 200 px on the long side at 10 cm: 0.5 mm per pixel
+        self.assertEqual(estimate['colors'], 2)
+        self.assertEqual(estimate['coverage'], 0.6)
+        self.assertEqual(estimate['area_mm2'], 4800.0)
+        self.assertEqual((estimate['width_mm'], estimate['height_mm']), (80.0, 100.0))
+        self.assertGreater(estimate['stitch_count'], 0)
+        self.assertGreater(StitchEstimator().estimate(self.rgba(shapes()), 20)['stitch_count'],
+                           3 * estimate['stitch_count'])
+
+    def test_blank_and_transparent_images_have_no_stitches(self):
+        blank = self.rgba(np.full((50, 50, 3), 255, dtype=np.uint8))
+        transparent = self.rgba(shapes())
+        transparent[..., 3] = 0
+        for rgba in (blank, transparent):
+            estimate = StitchEstimator().estimate(rgba, 10)
+            self.assertEqual((estimate['stitch_count'], estimate['colors'], estimate['coverage']), (0, 0, 0.0))
+
+    def test_decoded_file_matches_the_array(self):
+        image = BytesIO()
+        Image.fromarray(shapes()).save(image, format='PNG')
+        image.seek(0)
+        self.assertEqual(StitchEstimator().estimate(image, 10), StitchEstimator().estimate(self.rgba(shapes()), 10))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class DensityPricingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root, DENSITY_PRICING_ENABLED=True)
+        self.settings_override.enable()
+        EmbroiderySizePricing.objects.create(size_cm=5, price_in_tokens=10)
+        EmbroiderySizePricing.objects.create(size_cm=40, price_in_tokens=30)
+        self.user = User.objects.create_user(username='customer', password='x')
+        self.design = Design.objects.create(user=self.user, name='Shapes')
+        image = BytesIO()
+        Image.fromarray(shapes()).save(image, format='PNG')
+        self.design.normal_image.save('shapes.png', SimpleUploadedFile('shapes.png', image.getvalue()))
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+        size_pricing_table.invalidate()
+
+    def test_price_scales_with_fill_coverage(self):
+        # 60% coverage falls in the 1.25 tier
+        self.assertEqual(pricing.price_for_design(self.design, 40), 38)
+        bare = Design.objects.create(user=self.user, name='No image')
+        self.assertEqual(pricing.prices_for_designs([(self.design, 40), (bare, 40)]), [38, 30])
+
+    def test_given_estimate_skips_the_image(self):
+        with mock.patch.object(pricing, 'estimate_design_stitches') as estimate:
+            self.assertEqual(pricing.price_for_design(self.design, 40, {'coverage': 0.2}), 30)
+            self.assertEqual(pricing.price_for_design(self.design, 40, {'coverage': 0.9}), 45)
+        estimate.assert_not_called()
+
+    def test_size_only_when_disabled(self):
+        with override_settings(DENSITY_PRICING_ENABLED=False):
+            self.assertEqual(pricing.price_for_design(self.design, 40), 30)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class TokenCostSettingsCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        TokenCostSettings.objects.create(pk=1)
+
+    def tearDown(self):
+        TokenCostSettings.invalidate_solo()
+
+    def test_reading_costs_is_query_free_after_warm_up(self):
+        TokenCostSettings.get_costs()
+        with self.assertNumQueries(0):
+            for _ in range(10):
+                TokenCostSettings.get_costs()
+
+    def test_staff_update_is_visible_to_public_endpoint(self):
+        staff = User.objects.create_user(username='staff', password='x', is_staff=True)
+        client = APIClient()
+        self.assertEqual(client.get('/api/tokens/costs/').json()['costs']['ai_image_generation'], 2)
+
+        client.force_authenticate(staff)
+        client.post('/api/admin/token-costs/', {'ai_image_generation': 5}, format='json')
+
+        client.force_authenticate(None)
+        self.assertEqual(client.get('/api/tokens/costs/').json()['costs']['ai_image_generation'], 5)
+
+
+class OrderNumberAllocationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='customer', password='x')
+        self.year = timezone.now().year
+
+    def test_block_allocation_is_consecutive(self):
+        first = allocate_order_numbers(3)
+        second = allocate_order_numbers(2)
+        self.assertEqual(first + second, [f'ORD-{self.year}-{n:03d}' for n in range(1, 6)])
+
+    def test_counter_is_seeded_from_highest_issued_number(self):
+        design = Design.objects.create(user=self.user)
+        for number in (999, 1000):
+            Order.objects.create(user=self.user, design=design, order_number=f'ORD-{self.year}-{number}')
+        self.assertEqual(allocate_order_numbers(1), [f'ORD-{self.year}-1001'])
+
+    def test_save_assigns_a_number(self):
+        order = Order.objects.create(user=self.user, design=Design.objects.create(user=self.user))
+        self.assertEqual(order.order_number, f'ORD-{self.year}-001')
+
+
+class TokenLedgerTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='customer', password='x')
+        UserProfile.objects.create(user=self.user, tokens=10)
+
+    def test_debit_and_credit_record_balance_after(self):
+        ledger.debit(self.user, 4, "Order")
+        entry = ledger.credit(self.user, 7, "Top up")
+        self.assertEqual(entry.balance_after, 13)
+        self.assertEqual(
+            list(TokenTransaction.objects.order_by('id').values_list('amount', 'balance_after')),
+            [(-4, 6), (7, 13)],
+        )
+
+    def test_debit_never_overdraws(self):
+        with self.assertRaises(ledger.InsufficientTokens) as ctx:
+            ledger.debit(self.user, 11, "Too much")
+        self.assertEqual(ctx.exception.available, 10)
+        self.assertEqual(UserProfile.objects.get(user=self.user).tokens, 10)
+        self.assertFalse(TokenTransaction.objects.exists())
+
+    def test_loaded_profile_follows_the_ledger(self):
+        profile = self.user.profile
+        ledger.debit(self.user, 3, "Order")
+        self.assertEqual(profile.tokens, 7)
+
+    def test_payment_session_is_fulfilled_once(self):
+        first = ledger.fulfill_payment('cs_test_1', self.user, 50, "Purchased (session: cs_test_1)")
+        second = ledger.fulfill_payment('cs_test_1', self.user, 50, "Purchased (session: cs_test_1)")
+        self.assertIsNotNone(first)
+        self.assertIsNone(second)
+        self.assertEqual(UserProfile.objects.get(user=self.user).tokens, 60)
+        self.assertEqual(PaymentFulfillment.objects.filter(session_id='cs_test_1').count(), 1)
+
+    def test_history_returns_stored_balances(self):
+        ledger.debit(self.user, 2, "Order")
+        ledger.debit(self.user, 3, "Order")
+        client = APIClient()
+        client.force_authenticate(self.user)
+        with self.assertNumQueries(1):
+            data = client.get('/api/tokens/transactions/').json()
+        self.assertEqual([t['balance_after'] for t in data['transactions']], [5, 8])
+
+
+class StatsAggregationTests(TestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user(username='staff', password='x', is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+
+    def test_package_stats_group_purchases_by_package(self):
+        starter = TokenPackage.objects.create(name='Starter', tokens=10, price=5)
+        pro = TokenPackage.objects.create(name='Pro', tokens=100, price=40)
+        UserProfile.objects.create(user=self.staff, tokens=0)
+        for package in (starter, pro, pro):
+            ledger.credit(self.staff, package.tokens, f"Purchased {package.name}", package=package)
+
+        # Live totals, archived totals, packages
+        with self.assertNumQueries(3):
+            data = self.client.post('/api/token-packages/stats/').json()
+        purchases = {p['name']: (p['purchases'], p['revenue']) for p in data['packages']}
+        self.assertEqual(purchases, {'Starter': (1, 5.0), 'Pro': (2, 80.0)})
+        self.assertEqual(data['stats']['total_tokens_sold'], 210)
+
+
+class ConversationListTests(TestCase):
+    def setUp(self):
+        self.customer = User.objects.create_user(username='customer', password='x')
+        self.staff = User.objects.create_user(username='staff', password='x', is_staff=True)
+        self.client = APIClient()
+
+    def create_conversations(self, count, prefix):
+        for order in create_orders(self.customer, count, prefix):
+            conversation = Conversation.objects.create(order=order, customer=self.customer)
+            Message.objects.bulk_create([
+                Message(conversation=conversation, sender=self.customer, content='Hello'),
+                Message(conversation=conversation, sender=self.staff, content='x' * 150),
+                Message(conversation=conversation, sender=self.staff, content='Done'),
+            ])
+
+    def test_list_is_one_query_regardless_of_size(self):
+        self.client.force_authenticate(self.customer)
+        counts, created = [], 0
+        for size in (1, 10, 50):
+            self.create_conversations(size - created, prefix=f"C{size}")
+            created = size
+            with CaptureQueriesContext(connection) as ctx:
+                data = self.client.get('/api/chat/conversations/').json()
+            self.assertEqual(data['count'], size)
+            counts.append(len(ctx.captured_queries))
+        self.assertEqual(len(set(counts)), 1, f"Query count grew with conversations: {counts}")
+
+    def test_last_message_and_unread_count(self):
+        self.create_conversations(1, prefix='C')
+        self.client.force_authenticate(self.customer)
+        conversation = self.client.get('/api/chat/conversations/').json()['conversations'][0]
+        self.assertEqual(conversation['last_message']['content'], 'Done')
+        self.assertEqual(conversation['last_message']['sender_username'], 'staff')
+        self.assertEqual(conversation['unread_count'], 2)
+
+        self.client.force_authenticate(self.staff)
+        conversation = self.client.get('/api/chat/conversations/').json()['conversations'][0]
+        self.assertEqual(conversation['unread_count'], 1)
+
+    def test_opening_a_thread_marks_it_read_in_bulk(self):
+        self.create_conversations(1, prefix='C')
+        conversation = Conversation.objects.get()
+        Message.objects.bulk_create(
+            Message(conversation=conversation, sender=self.staff, content=f'Update {i}') for i in range(20)
+        )
+        self.client.force_authenticate(self.customer)
+        with CaptureQueriesContext(connection) as ctx:
+            data = self.client.get(f'/api/chat/conversations/{conversation.id}/').json()
+        updates = [q['sql'] for q in ctx.captured_queries if q['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 2, updates)
+        self.assertEqual(data['conversation']['unread_count'], 0)
+
+        self.assertFalse(conversation.messages.exclude(sender=self.customer).filter(is_read=False).exists())
+        conversation.refresh_from_db()
+        self.assertEqual(conversation.customer_last_read_message_id, conversation.messages.latest('id').id)
+        self.assertEqual(self.client.get('/api/chat/unread-count/').json()['unread_count'], 0)
+
+        # The staff side keeps its own watermark
+        self.assertEqual(conversation.unread_count_for(self.staff), 1)
+
+
+@override_settings(API_PAGE_SIZE=10)
+class MessageHistoryTests(TestCase):
+    def setUp(self):
+        self.customer = User.objects.create_user(username='customer', password='x')
+        self.staff = User.objects.create_user(username='staff', password='x', is_staff=True)
+        order = create_orders(self.customer, 1)[0]
+        self.conversation = Conversation.objects.create(order=order, customer=self.customer)
+        self.messages = Message.objects.bulk_create(
+            Message(conversation=self.conversation, sender=(self.customer, self.staff)[i % 2], content=f'Message {i}')
+            for i in range(25)
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+        self.url = f'/api/chat/conversations/{self.conversation.id}/'
+
+    def test_detail_returns_only_the_latest_page(self):
+        with CaptureQueriesContext(connection) as ctx:
+            data = self.client.get(self.url).json()['conversation']
+        self.assertEqual([m['content'] for m in data['messages']], [f'Message {i}' for i in range(15, 25)])
+        self.assertTrue(data['messages_page']['has_more'])
+
+        # Sender flags come from the join, not a query per message
+        Message.objects.bulk_create(
+            Message(conversation=self.conversation, sender=self.staff, content='More') for _ in range(10)
+        )
+        with CaptureQueriesContext(connection) as more:
+            self.client.get(self.url)
+        self.assertEqual(len(more.captured_queries), len(ctx.captured_queries))
+
+    def test_before_cursor_walks_back_through_history(self):
+        seen, before = [], None
+        while True:
+            params = {'page_size': 10, **({'before': before} if before else {})}
+            data = self.client.get(self.url + 'messages/', params).json()
+            seen.extend(m['content'] for m in data['messages'])
+            before = data['before']
+            if not data['has_more']:
+                break
+        self.assertEqual(seen, [f'Message {i}' for i in reversed(range(25))])
+
+    def test_after_cursor_returns_new_messages(self):
+        data = self.client.get(self.url + 'messages/', {'after': self.messages[22].id}).json()
+        self.assertEqual([m['content'] for m in data['messages']], ['Message 24', 'Message 23'])
+        self.assertFalse(data['has_more'])
+
+    def test_invalid_cursor_is_rejected(self):
+        response = self.client.get(self.url + 'messages/', {'before': 'abc'})
+        self.assertEqual(response.status_code, 400)
+
+
+class OrderOutputFileTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        self.customer = User.objects.create_user(username='customer', password='x')
+        self.staff = User.objects.create_user(username='staff', password='x', is_staff=True)
+        self.order = create_orders(self.customer, 1)[0]
+        self.client = APIClient()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def upload(self, **files):
+        self.client.force_authenticate(self.staff)
+        return self.client.post(
+            f'/api/admin/orders/{self.order.id}/upload-files/',
+            {fmt: SimpleUploadedFile(f'design.{fmt}', content) for fmt, content in files.items()},
+        )
+
+    def test_upload_stores_one_row_per_format(self):
+        data = self.upload(dst=b'first').json()['order']
+        self.upload(dst=b'second')
+        output = OrderOutputFile.objects.get(order=self.order)
+        self.assertEqual((output.format, output.size), ('dst', 6))
+        self.assertEqual(output.sha256, hashlib.sha256(b'second').hexdigest())
+
+        # Compatibility keys only for delivered formats
+        self.assertIn('output_dst', data)
+        self.assertNotIn('output_pes', data)
+        self.assertEqual([f['format'] for f in data['output_files']], ['dst'])
+
+    def test_replaced_file_is_deleted_only_on_commit(self):
+        self.upload(dst=b'first')
+        first = OrderOutputFile.objects.get(order=self.order).file.name
+
+        # A failed upload keeps the row and the file it points to
+        with mock.patch.object(views, 'save_upload_analysis', side_effect=RuntimeError('boom')):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.assertEqual(self.upload(dst=b'second').status_code, 500)
+        self.assertEqual(OrderOutputFile.objects.get(order=self.order).file.name, first)
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, first)))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.upload(dst=b'second')
+        self.assertNotEqual(OrderOutputFile.objects.get(order=self.order).file.name, first)
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, first)))
+
+    def test_completion_requires_every_requested_format(self):
+        self.upload(dst=b'dst')
+        url = f'/api/admin/orders/{self.order.id}/update-status/'
+        response = self.client.post(url, {'status': 'completed'}, format='json')
+        self.assertEqual(response.json()['missing_files'], ['PES'])
+
+        self.upload(pes=b'pes')
+        self.assertEqual(self.client.post(url, {'status': 'completed'}, format='json').status_code, 200)
+
+        self.client.force_authenticate(self.customer)
+        response = self.client.get(f'/api/orders/{self.order.id}/download/pes/')
+        self.assertEqual(b''.join(response.streaming_content), b'pes')
+        self.assertEqual(self.client.get(f'/api/orders/{self.order.id}/download/jef/').status_code, 404)
+
+
+    def test_files_are_parsed_and_rendered_before_the_order_is_locked(self):
+        locked = []
+        real_select_for_update = Order.objects.select_for_update
+
+        def select_for_update(*args, **kwargs):
+            locked.append(True)
+            return real_select_for_update(*args, **kwargs)
+
+        def render_previews(renderer, pattern):
+            self.assertEqual(locked, [], 'rendered while the order row was locked')
+            return b'png', b'webp'
+
+        with mock.patch.object(Order.objects, 'select_for_update', side_effect=select_for_update), \
+                mock.patch.object(StitchRenderer, 'render_previews', autospec=True, side_effect=render_previews):
+            self.assertEqual(self.upload(dst=pattern_to_bytes(sample_pattern(), 'dst')).status_code, 200)
+        self.assertEqual(locked, [True])
+        self.order.refresh_from_db()
+        with self.order.stitch_preview.open('rb') as fh:
+            self.assertEqual(fh.read(), b'png')
+
+    def test_upload_records_stitch_metrics(self):
+        Design.objects.filter(id=self.order.design_id).update(machine_brand='Brother PE800')
+        self.upload(dst=pattern_to_bytes(sample_pattern(), 'dst'), pes=b'not a pes file')
+
+        # The row create_orders made for dst is replaced; the unreadable pes gets none
+        metrics = OrderFileMetrics.objects.get(order=self.order)
+        self.assertEqual(metrics.format, 'dst')
+        self.assertEqual(
+            (metrics.stitch_count, metrics.color_changes, metrics.trims, metrics.jumps),
+            (17, 1, 1, 0)
+        )
+        self.assertEqual((metrics.width_mm, metrics.height_mm), (10.0, 5.0))
+        self.assertEqual((metrics.machine_brand, metrics.stitches_per_minute), ('Brother PE800', 850))
+        # 17 stitches at 850/min plus one trim (6 s) and one colour change (12 s)
+        self.assertEqual(metrics.estimated_seconds, 19)
+
+        self.order.refresh_from_db()
+        self.assertTrue(self.order.stitch_preview.name.endswith('_preview.png'))
+        self.assertTrue(self.order.stitch_preview_thumbnail.name.endswith('_thumb.webp'))
+
+
+    def test_files_added_in_django_admin_are_processed(self):
+        superuser = User.objects.create_superuser(username='root', password='x')
+        request = RequestFactory().post('/')
+        request.user = superuser
+        order_admin = django_admin.site._registry[Order]
+        inline = order_admin.get_inline_instances(request, self.order)[0]
+        FormSet = inline.get_formset(request, self.order)
+        prefix = FormSet.get_default_prefix()
+        data = {
+            f'{prefix}-TOTAL_FORMS': '1', f'{prefix}-INITIAL_FORMS': '0',
+            f'{prefix}-MIN_NUM_FORMS': '0', f'{prefix}-MAX_NUM_FORMS': '1000',
+            f'{prefix}-0-format': 'dst',
+        }
+        content = pattern_to_bytes(sample_pattern(), 'dst')
+        files = {f'{prefix}-0-file': SimpleUploadedFile('design.dst', content)}
+        formset = FormSet(data, files, instance=self.order, prefix=prefix)
+        self.assertTrue(formset.is_valid(), formset.errors)
+        order_admin.save_formset(request, None, formset, change=True)
+
+        output = OrderOutputFile.objects.get(order=self.order)
+        self.assertEqual((output.size, output.sha256), (len(content), hashlib.sha256(content).hexdigest()))
+        self.assertEqual(OrderFileMetrics.objects.get(order=self.order, format='dst').stitch_count, 17)
+        self.order.refresh_from_db()
+        self.assertTrue(self.order.stitch_preview.name.endswith('_preview.png'))
+
+
+class StitchStatsTests(TestCase):
+    def test_counts_bounding_box_and_run_time(self):
+        stats = compute_stitch_stats(sample_pattern(), 600)
+        self.assertEqual(stats, {
+            'stitch_count': 17, 'color_changes': 1, 'trims': 1, 'jumps': 0,
+            'min_x': 0.0, 'min_y': 0.0, 'max_x': 100.0, 'max_y': 50.0,
+            'width_mm': 10.0, 'height_mm': 5.0,
+            'estimated_seconds': 20,
+        })
+
+    def test_jumps_are_outside_the_bounding_box(self):
+        pattern = sample_pattern()
+        pattern.stitches.insert(0, [-500, -500, pyembroidery.JUMP])
+        stats = compute_stitch_stats(pattern, 0)
+        self.assertEqual((stats['jumps'], stats['min_x'], stats['min_y']), (1, 0.0, 0.0))
+        # No machine speed: only the fixed overheads
+        self.assertEqual(stats['estimated_seconds'], 18)
+
+
+class HotQueryIndexTests(TestCase):
+    def test_hot_queries_use_their_indexes(self):
+        out = StringIO()
+        call_command('explain_hot_queries', seed=500, check=True, stdout=out)
+        self.assertIn('Every hot query uses its index', out.getvalue())
+        self.assertFalse(Order.objects.exists())
+
+
+class RequestTransactionTests(TransactionTestCase):
+    """I/O-heavy views must not hold the ATOMIC_REQUESTS transaction open"""
+
+    def setUp(self):
+        self.atomic_requests = connection.settings_dict['ATOMIC_REQUESTS']
+        connection.settings_dict['ATOMIC_REQUESTS'] = True
+        self.user = User.objects.create_user(username='customer', password='x', email='c@example.com')
+        UserProfile.objects.create(user=self.user, tokens=100)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def tearDown(self):
+        connection.settings_dict['ATOMIC_REQUESTS'] = self.atomic_requests
+
+    def test_io_views_opt_out_of_the_request_transaction(self):
+        for view in (views.generate_ai_image, views.cart_checkout, views.create_order,
+                     views.create_checkout_session, views.stripe_webhook, views.verify_payment):
+            self.assertEqual(view._non_atomic_requests, {'default'}, view)
+
+    def test_checkout_emails_are_sent_after_commit(self):
+        design = Design.objects.create(user=self.user, name='Rose', status='ready')
+        Cart.objects.create(user=self.user, design=design)
+        states = []
+
+        def record(order):
+            states.append((connection.in_atomic_block, Order.objects.filter(pk=order.pk).exists()))
+
+        with mock.patch.object(views, 'send_order_submitted_email', side_effect=record):
+            response = self.client.post('/api/cart/checkout/', {'requested_formats': ['dst']}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(states, [(False, True)])
+        self.assertEqual(UserProfile.objects.get(user=self.user).tokens, 90)
+
+    def test_status_email_is_sent_after_commit(self):
+        order = create_orders(self.user, 1)[0]
+        staff = User.objects.create_user(username='staff', password='x', is_staff=True)
+        self.client.force_authenticate(staff)
+        states = []
+
+        def record(order):
+            states.append((connection.in_atomic_block, Order.objects.get(pk=order.pk).status))
+
+        with mock.patch.object(views, 'send_order_processing_email', side_effect=record):
+            response = self.client.post(f'/api/admin/orders/{order.id}/update-status/',
+                                        {'status': 'processing'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(states, [(False, 'processing')])
+
+
+class BulkCheckoutTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='customer', password='x', email='c@example.com')
+        UserProfile.objects.create(user=self.user, tokens=1000)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def checkout(self, count):
+        designs = Design.objects.bulk_create(
+            Design(user=self.user, name=f'Design {i}', status='ready') for i in range(count)
+        )
+        Cart.objects.bulk_create(Cart(user=self.user, design=design) for design in designs)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post('/api/cart/checkout/', {'requested_formats': ['dst']}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.json()['orders']), count)
+        return len(ctx.captured_queries)
+
+    def test_checkout_query_count_does_not_grow_with_cart(self):
+        # The first checkout also loads the price table and creates the year's counter.
+        # Emails go out one per order after the commit, so leave them out of the count
+        with mock.patch.object(views, 'send_order_submitted_email'):
+            self.checkout(2)
+            small, large = self.checkout(2), self.checkout(30)
+        self.assertEqual(small, large)
+        self.assertLessEqual(large, 20)
+
+    def test_checkout_writes_one_ledger_row_and_one_email_per_order(self):
+        from django.core import mail
+        self.checkout(3)
+        self.assertEqual(TokenTransaction.objects.filter(user=self.user).count(), 1)
+        self.assertEqual(UserProfile.objects.get(user=self.user).tokens, 970)
+        self.assertEqual(sorted(m.subject for m in mail.outbox),
+                         sorted(f"Order Submitted - {o.order_number}" for o in Order.objects.all()))
+        self.assertFalse(Order.objects.filter(email_sent=False).exists())
+        self.assertFalse(Design.objects.exclude(status='processing').exists())
+        self.assertFalse(Cart.objects.exists())
+
+
+class UsernameAllocationTests(TestCase):
+    def test_next_free_suffix_in_one_query(self):
+        User.objects.bulk_create(User(username=name) for name in ['rose', 'rose1', 'rose2', 'rose4', 'roseanne'])
+        with mock.patch.object(User.objects, 'filter', wraps=User.objects.filter) as user_filter:
+            with self.assertNumQueries(1):
+                self.assertEqual(views._generate_unique_username('rose@example.com'), 'rose3')
+        # Names that only share the prefix are not fetched
+        fetched = User.objects.filter(**user_filter.call_args.kwargs).values_list('username', flat=True)
+        self.assertEqual(set(fetched), {'rose', 'rose1', 'rose2', 'rose4'})
+        self.assertEqual(views._generate_unique_username('x@example.com', 'Lily'), 'lily')
+
+    def test_long_names_are_trimmed_before_the_suffix(self):
+        base = 'a' * 120
+        User.objects.create(username=base)
+        self.assertEqual(views._generate_unique_username('x@example.com', base), 'a' * 119 + '1')
+        User.objects.create(username='a' * 119 + '1')
+        self.assertEqual(views._generate_unique_username('x@example.com', base), 'a' * 119 + '2')
+
+    def test_conflict_on_insert_takes_the_next_name(self):
+        User.objects.create(username='rose')
+        real = views._generate_unique_username
+        calls = []
+
+        def stale_then_real(**kwargs):
+            # First attempt behaves as if the 'rose' row was not visible yet
+            calls.append(kwargs['taken'].copy())
+            return 'rose' if len(calls) == 1 else real(**kwargs)
+
+        with mock.patch.object(views, '_generate_unique_username', side_effect=stale_then_real):
+            user = views._create_user_with_unique_username(email='rose@example.com', password=None)
+        self.assertEqual(user.username, 'rose1')
+        self.assertEqual(calls, [set(), {'rose'}])
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Range partitioning is PostgreSQL-only')
+class PartitionTests(TestCase):
+    def test_new_partition_takes_over_rows_from_default(self):
+        user = User.objects.create_user(username='customer', password='x')
+        # Beyond the partitions created ahead, so the row lands in DEFAULT
+        month = add_months(month_start(timezone.now()), MONTHS_AHEAD + 1)
+        row = TokenTransaction.objects.create(user=user, type='purchase', amount=5, description='Late')
+        created_at = datetime.datetime(month.year, month.month, 2, tzinfo=datetime.timezone.utc)
+        TokenTransaction.objects.filter(pk=row.pk).update(created_at=created_at)
+
+        with connection.cursor() as cursor:
+            created = ensure_partitions(cursor, 'api_tokentransaction', months_ahead=MONTHS_AHEAD + 1)
+            self.assertIn(month, month_partitions(cursor, 'api_tokentransaction'))
+            cursor.execute(f'SELECT id FROM "{created[-1]}"')
+            self.assertEqual(cursor.fetchall(), [(row.pk,)])
+            cursor.execute('SELECT count(*) FROM "api_tokentransaction_pdefault" WHERE id = %s', [row.pk])
+            self.assertEqual(cursor.fetchone()[0], 0)
+        self.assertEqual(TokenTransaction.objects.get(pk=row.pk).description, 'Late')
+
+
+class HistoryArchiveTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        self.user = User.objects.create_user(username='customer', password='x')
+        self.other = User.objects.create_user(username='other', password='x')
+        UserProfile.objects.create(user=self.user, tokens=0)
+        UserProfile.objects.create(user=self.other, tokens=0)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+        # Two old months for the customer, one for another user, and this month
+        this_month = month_start(timezone.now())
+        self.old_months = [add_months(this_month, -14), add_months(this_month, -13)]
+        for user, month, amount in [(self.user, self.old_months[0], 1), (self.user, self.old_months[1], 2),
+                                    (self.other, self.old_months[1], 3), (self.user, this_month, 4)]:
+            entry = ledger.credit(user, amount, 'Top-up')
+            TokenTransaction.objects.filter(pk=entry.pk).update(
+                created_at=datetime.datetime(month.year, month.month, 10, tzinfo=datetime.timezone.utc)
+            )
+
+        order = create_orders(self.user, 1, prefix='A')[0]
+        self.conversation = Conversation.objects.create(order=order, customer=self.user)
+        old = Message.objects.create(conversation=self.conversation, sender=self.user, content='Old')
+        Message.objects.filter(pk=old.pk).update(created_at=datetime.datetime(
+            self.old_months[0].year, self.old_months[0].month, 2, tzinfo=datetime.timezone.utc
+        ))
+        Message.objects.create(conversation=self.conversation, sender=self.user, content='New')
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def test_old_months_leave_the_hot_tables(self):
+        call_command('archive_history', months=12, stdout=StringIO())
+
+        self.assertEqual(list(TokenTransaction.objects.values_list('amount', flat=True)), [4])
+        self.assertEqual(list(Message.objects.values_list('content', flat=True)), ['New'])
+        archived = ArchivedPartition.objects.filter(table='api.tokentransaction').order_by('month')
+        self.assertEqual([(a.month, a.row_count) for a in archived], [(self.old_months[0], 1), (self.old_months[1], 2)])
+
+        # Nothing left to archive on a second run
+        call_command('archive_history', months=12, stdout=StringIO())
+        self.assertEqual(ArchivedPartition.objects.count(), 3)
+
+    def test_sales_stats_still_count_archived_purchases(self):
+        package = TokenPackage.objects.create(name='Starter', tokens=10, price=5)
+        entry = ledger.credit(self.other, 10, 'Starter', package=package)
+        TokenTransaction.objects.filter(pk=entry.pk).update(created_at=datetime.datetime(
+            self.old_months[0].year, self.old_months[0].month, 20, tzinfo=datetime.timezone.utc
+        ))
+        staff = User.objects.create_user(username='staff', password='x', is_staff=True)
+        self.client.force_authenticate(staff)
+        before = self.client.post('/api/token-packages/stats/').json()
+
+        call_command('archive_history', months=12, stdout=StringIO())
+        # A rerun rewrites the month without counting it twice
+        archive_month(TokenTransaction, self.old_months[0])
+
+        after = self.client.post('/api/token-packages/stats/').json()
+        self.assertEqual(after, before)
+        self.assertEqual(after['stats']['total_tokens_sold'], 20)
+        self.assertEqual([p['purchases'] for p in after['packages']], [1])
+
+    def test_rows_written_during_the_export_are_kept(self):
+        month = self.old_months[0]
+        save = default_storage.save
+
+        def write_late_row(name, content):
+            # Lands in the month after its rows were read, before they are deleted
+            entry = ledger.credit(self.user, 7, 'Late top-up')
+            TokenTransaction.objects.filter(pk=entry.pk).update(
+                created_at=datetime.datetime(month.year, month.month, 28, tzinfo=datetime.timezone.utc)
+            )
+            return save(name, content)
+
+        with mock.patch('api.archive.default_storage.save', side_effect=write_late_row):
+            self.assertEqual(archive_month(TokenTransaction, month).row_count, 1)
+        self.assertEqual(list(TokenTransaction.objects.filter(amount=7).values_list('amount', flat=True)), [7])
+
+        # The next run adds it to the month's archive
+        self.assertEqual(archive_month(TokenTransaction, month).row_count, 2)
+        self.assertFalse(TokenTransaction.objects.filter(amount=7).exists())
+
+    def test_archived_history_pages_one_month_at_a_time(self):
+        call_command('archive_history', months=12, stdout=StringIO())
+
+        data = self.client.get('/api/tokens/transactions/archive/').json()
+        self.assertEqual([t['amount'] for t in data['transactions']], [2])
+        self.assertEqual(data['older_month'], f"{self.old_months[0]:%Y-%m}")
+
+        data = self.client.get('/api/tokens/transactions/archive/', {'month': data['older_month']}).json()
+        self.assertEqual([t['amount'] for t in data['transactions']], [1])
+        self.assertIsNone(data['older_month'])
+        self.assertEqual(self.client.get('/api/tokens/transactions/archive/', {'month': 'soon'}).status_code, 400)
+
+        url = f'/api/chat/conversations/{self.conversation.id}/messages/archive/'
+        data = self.client.get(url).json()
+        self.assertEqual([(m['content'], m['sender_username']) for m in data['messages']], [('Old', 'customer')])
+        self.client.force_authenticate(self.other)
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+
+@override_settings(DATABASE_REPLICAS=['replica1'], CACHES=LOCMEM_CACHES)
+class ReplicaRoutingTests(TransactionTestCase):
+    # TestCase would hold the whole test in a transaction on default
+    def setUp(self):
+        self.user = User.objects.create_user(username='customer', password='x')
+        self.request = RequestFactory().get('/api/orders/')
+        self.request.user = self.user
+        # Pins live in the cache, keyed by user id
+        cache.clear()
+
+    def route(self, action, request=None):
+        """The result of `action` run inside a @read_replica view"""
+        return read_replica(lambda request: action())(request or self.request)
+
+    def test_reads_use_a_replica_until_the_request_writes(self):
+        def read_write_read():
+            before = router.db_for_read(Order)
+            write = router.db_for_write(Order)
+            return before, write, router.db_for_read(Order)
+
+        self.assertEqual(self.route(read_write_read), ('replica1', 'default', 'default'))
+        self.assertTrue(is_pinned(self.user))
+        # Outside a replica view everything stays on the primary
+        self.assertEqual(router.db_for_read(Order), 'default')
+
+    def test_pinned_users_and_transactions_read_the_primary(self):
+        def read_in_transaction():
+            with transaction.atomic():
+                return router.db_for_read(Order)
+
+        self.assertEqual(self.route(read_in_transaction), 'default')
+        post = RequestFactory().post('/api/orders/')
+        post.user = self.user
+        self.assertEqual(self.route(lambda: router.db_for_read(Order), post), 'default')
+
+        pin_to_primary(self.user)
+        self.assertEqual(self.route(lambda: router.db_for_read(Order)), 'default')
+
+    def test_successful_writes_pin_the_user(self):
+        order = create_orders(self.user, 1)[0]
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.post('/api/chat/conversations/', {'order_id': order.id}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(is_pinned(self.user))
+
+    @contextlib.contextmanager
+    def reads(self):
+        """Record where reads are routed while serving them all from default (no replica here)"""
+        aliases = []
+        db_for_read = ReplicaRouter.db_for_read
+
+        def spy(router, model, **hints):
+            aliases.append(db_for_read(router, model, **hints))
+            return 'default'
+
+        with mock.patch.object(ReplicaRouter, 'db_for_read', spy):
+            yield aliases
+
+    def test_reads_that_write_pin_the_user(self):
+        order = create_orders(self.user, 1)[0]
+        staff = User.objects.create_user(username='staff', password='x', is_staff=True)
+        conversation = Conversation.objects.create(order=order, customer=self.user)
+        Message.objects.create(conversation=conversation, sender=staff, content='Files are ready')
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        # Listing only reads
+        with self.reads() as aliases:
+            self.assertEqual(client.get('/api/chat/conversations/').json()['conversations'][0]['unread_count'], 1)
+        self.assertIn('replica1', aliases)
+        self.assertFalse(is_pinned(self.user))
+
+        # Opening the thread marks it read, so the next list must come from the primary
+        with self.reads():
+            self.assertEqual(client.get(f'/api/chat/conversations/{conversation.id}/').status_code, 200)
+        self.assertTrue(is_pinned(self.user))
+        with self.reads() as aliases:
+            self.assertEqual(client.get('/api/chat/conversations/').json()['conversations'][0]['unread_count'], 0)
+        self.assertEqual(set(aliases), {'default'})
+
+    def test_payment_verification_pins_the_user(self):
+        UserProfile.objects.create(user=self.user, tokens=0)
+        session = mock.Mock(payment_status='paid', amount_total=500,
+                            metadata={'tokens': '50', 'user_id': str(self.user.id)})
+        client = APIClient()
+        client.force_authenticate(self.user)
+        with mock.patch.object(views.stripe.checkout.Session, 'retrieve', return_value=session):
+            response = client.get('/api/payment/verify/', {'session_id': 'cs_test'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(UserProfile.objects.get(user=self.user).tokens, 50)
+        self.assertTrue(is_pinned(self.user))
+
+    def test_write_in_a_read_view_switches_to_the_primary(self):
+        def write_then_read():
+            Design.objects.create(user=self.user, name='Rose')
+            return router.db_for_read(Order)
+
+        middleware = ReplicaPinMiddleware(lambda request: self.route(write_then_read, request))
+        self.assertEqual(middleware(self.request), 'default')
+        self.assertTrue(is_pinned(self.user))
+
+
+class BatchedUpdateTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(username='customer', password='x')
+        Design.objects.bulk_create(Design(user=user, name=f"Design {i}") for i in range(25))
+
+    def rename(self, design):
+        if design.name.endswith('0'):
+            return False
+        design.name = design.name.upper()
+        return True
+
+    def renamed(self):
+        return sum(name.isupper() for name in Design.objects.values_list('name', flat=True))
+
+    def test_updates_in_batches_with_bulk_updates(self):
+        with CaptureQueriesContext(connection) as queries:
+            changed = batched_update(Design, self.rename, ['name'], name='test', batch_size=10, log=lambda line: None)
+        self.assertEqual(changed, 22)
+        self.assertEqual(self.renamed(), 22)
+        updates = [q['sql'] for q in queries.captured_queries if q['sql'].startswith('UPDATE "api_design"')]
+        self.assertEqual(len(updates), 3)
+
+    def test_resumes_after_the_last_committed_batch(self):
+        seen = []
+
+        def fail_in_second_batch(design):
+            seen.append(design.pk)
+            if len(seen) == 15:
+                raise RuntimeError('interrupted')
+            return self.rename(design)
+
+        with self.assertRaises(RuntimeError):
+            batched_update(Design, fail_in_second_batch, ['name'], name='test', batch_size=10, log=lambda line: None)
+        # The first batch committed; the failed one rolled back
+        self.assertEqual(self.renamed(), 9)
+
+        log = []
+        seen.clear()
+        batched_update(Design, self.rename, ['name'], name='test', batch_size=10, log=log.append)
+        self.assertIn('resuming', log[0])
+        self.assertEqual(self.renamed(), 22)
+        self.assertIn('25 rows', log[-1])
+
+    def test_batch_is_read_in_its_own_transaction(self):
+        depths = []
+
+        def record(execute, sql, params, many, context):
+            depths.append((sql.split()[0], len(connection.atomic_blocks), sql))
+            return execute(sql, params, many, context)
+
+        outside = len(connection.atomic_blocks)
+        with connection.execute_wrapper(record):
+            batched_update(Design, self.rename, ['name'], name='test', batch_size=10, log=lambda line: None)
+        batch_reads = [(depth, sql) for verb, depth, sql in depths if verb == 'SELECT' and '"api_design"' in sql]
+        self.assertEqual({depth for depth, _ in batch_reads}, {outside + 1})
+        if connection.features.has_select_for_update:
+            self.assertTrue(all('FOR UPDATE' in sql for _, sql in batch_reads))
+
+
+class AdminSearchTests(TestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user(username='staff', password='x', is_staff=True)
+        self.customer = User.objects.create_user(username='rosalind', password='x')
+        self.orders = create_orders(self.customer, 3, prefix='S')
+        Design.objects.filter(pk=self.orders[0].design_id).update(name='Blue rose', prompt='A red dragon on a shield')
+        Design.objects.filter(pk=self.orders[1].design_id).update(name='Dragon patch')
+        conversation = Conversation.objects.create(order=self.orders[0], customer=self.customer)
+        Message.objects.create(conversation=conversation, sender=self.customer, content='Can the dragons be smaller?')
+        Message.objects.create(conversation=conversation, sender=self.staff, content='Sure, resized.')
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+
+    def search(self, q, **params):
+        return self.client.get('/api/admin/search/', {'q': q, **params}).json()
+
+    def test_ranked_full_text_matches(self):
+        data = self.search('dragon')
+        # The name match outranks the prompt match; prefixes match plurals
+        self.assertEqual([d['name'] for d in data['designs']], ['Dragon patch', 'Blue rose'])
+        self.assertEqual([m['content'] for m in data['messages']], ['Can the dragons be smaller?'])
+        self.assertEqual(len(data['orders']), 2)
+
+    def test_orders_by_number_and_username(self):
+        number = self.orders[2].order_number
+        data = self.search(number, types='orders')
+        self.assertEqual(data['orders'][0]['order_number'], number)
+        self.assertNotIn('designs', data)
+        self.assertEqual(len(self.search('rosalind', types='orders')['orders']), 3)
+
+    def test_index_follows_writes(self):
+        design = Design.objects.get(pk=self.orders[2].design_id)
+        design.name = 'Golden phoenix'
+        design.save()
+        self.assertEqual([d['id'] for d in self.search('phoenix')['designs']], [design.id])
+        design.delete()
+        self.assertEqual(self.search('phoenix')['designs'], [])
+
+    @skipUnless(connection.vendor == 'sqlite', 'SQLite FTS triggers')
+    def test_migrate_reinstalls_triggers_lost_to_a_table_rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TRIGGER api_design_fts_update')
+        Design.objects.filter(pk=self.orders[2].design_id).update(name='Golden phoenix')
+        self.assertEqual(self.search('phoenix')['designs'], [])
+
+        emit_post_migrate_signal(0, False, 'default')
+        self.assertEqual([d['id'] for d in self.search('phoenix')['designs']], [self.orders[2].design_id])
+        # Nothing to repair the second time
+        self.assertFalse(search_index.repair(connection))
+
+    def test_order_lookups_use_each_tables_index(self):
+        sql, params = matching_order_ids('rose').query.sql_with_params()
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                # The test tables are tiny; show the plan the indexes allow at scale
+                cursor.execute('SET LOCAL enable_seqscan = off')
+                cursor.execute('EXPLAIN ' + sql, params)
+                plan = '\n'.join(row[0] for row in cursor.fetchall())
+                for index in TRIGRAM_INDEXES:
+                    self.assertIn(index, plan)
+            elif connection.vendor == 'sqlite':
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+                plan = '\n'.join(row[-1] for row in cursor.fetchall())
+                # Matching users and designs reach orders through the foreign key indexes
+                self.assertRegex(plan, r'SEARCH api_order USING .*INDEX .*\(user_id=\?\)')
+                self.assertRegex(plan, r'SEARCH api_order USING .*INDEX .*\(design_id=\?\)')
+        # 'Blue rose' by design name, the rest by username
+        self.assertEqual({row['id'] for row in matching_order_ids('ros')}, {order.id for order in self.orders})
+        self.assertEqual([row['id'] for row in matching_order_ids('rose')], [self.orders[0].id])
+
+    def test_staff_only(self):
+        self.assertEqual(self.client.get('/api/admin/search/').status_code, 400)
+        self.client.force_authenticate(self.customer)
+        self.assertEqual(self.client.get('/api/admin/search/', {'q': 'dragon'}).status_code, 403)
+
+
+class DigitizerTests(TestCase):
+    def test_palette_keeps_the_image_colours_and_border_background(self):
+        palette, background = EmbroideryDigitizer(num_colors=8).build_palette(shapes())
+        self.assertEqual({tuple(c) for c in palette}, {(255, 255, 255), (200, 0, 0), (0, 0, 200)})
+        self.assertEqual(tuple(palette[background]), (255, 255, 255))
+
+    def test_single_pixel_and_blank_images(self):
+        digitizer = EmbroideryDigitizer()
+        for rgb in [np.zeros((1, 1, 3), dtype=np.uint8), np.full((4, 6, 3), 200, dtype=np.uint8)]:
+            palette, background = digitizer.build_palette(rgb)
+            self.assertEqual((len(palette), background), (1, 0))
+            # Nothing but background: an empty but valid pattern
+            self.assertEqual(len(digitizer.digitize(Image.fromarray(rgb)).stitches), 1)
+
+    def test_write_to_a_bare_filename(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(directory)
+        EmbroideryDigitizer().digitize_to_file(Image.fromarray(shapes()), 'design.dst')
+        self.assertTrue(os.path.getsize(os.path.join(directory, 'design.dst')) > 0)
+
+    def test_parallel_tiles_match_the_serial_path(self):
+        rgb = shapes()
+        digitizer = EmbroideryDigitizer(tile_size=64, workers=2)
+        palette, background = digitizer.build_palette(rgb)
+        serial = digitizer.segment(rgb, palette, background, parallel=False)
+        parallel = digitizer.segment(rgb, palette, background, parallel=True)
+        self.assertEqual(serial.keys(), parallel.keys())
+        for color_index in serial:
+            np.testing.assert_array_equal(serial[color_index], parallel[color_index])
+
+    def test_parallel_geometry_matches_the_serial_path(self):
+        digitizer = EmbroideryDigitizer(tile_size=64, workers=2)
+        serial = digitizer.vectorize(Image.fromarray(shapes()), parallel=False)
+        parallel = digitizer.vectorize(Image.fromarray(shapes()), parallel=True)
+        self.assertEqual(serial.keys(), parallel.keys())
+        for key in serial:
+            np.testing.assert_array_equal(serial[key], parallel[key])
+
+
+class StitchRendererTests(TestCase):
+    def test_jumps_are_not_drawn(self):
+        # Two vertical bars joined only by a jump along the bottom
+        pattern = pyembroidery.EmbPattern()
+        pattern.add_stitch_absolute(pyembroidery.STITCH, 0, 0)
+        pattern.add_stitch_absolute(pyembroidery.STITCH, 0, 200)
+        pattern.add_stitch_absolute(pyembroidery.JUMP, 200, 200)
+        pattern.add_stitch_absolute(pyembroidery.STITCH, 200, 0)
+        image = StitchRenderer(max_size=128, padding=8).render(pattern)
+
+        background = np.all(image == 255, axis=2)
+        self.assertTrue(background[:, image.shape[1] // 2].all())
+        self.assertFalse(background[:, 8].all())
+        self.assertFalse(background[:, -9].all())
+
+
+class AutoDigitizeTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        self.user = User.objects.create_user(username='customer', password='x')
+        self.design = Design.objects.create(user=self.user, name='Shapes', requested_format='dst')
+        image = BytesIO()
+        Image.fromarray(shapes()).save(image, format='PNG')
+        self.design.normal_image.save('shapes.png', SimpleUploadedFile('shapes.png', image.getvalue()))
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def digitize(self, **data):
+        return self.client.post(f'/api/designs/{self.design.id}/digitize/', data, format='json')
+
+    def test_size_change_restitches_the_cached_geometry(self):
+        first = self.digitize().json()
+        self.assertFalse(first['reused_geometry'])
+        geometry_file = DesignGeometry.objects.get(design=self.design).geometry_file.name
+
+        # Saving the size re-stitches the cached geometry without tracing
+        with mock.patch.object(EmbroideryDigitizer, 'vectorize') as vectorize:
+            response = self.client.patch(f'/api/designs/{self.design.id}/update/', {'embroidery_size_cm': 20}, format='json')
+        self.assertEqual(response.status_code, 200)
+        vectorize.assert_not_called()
+        record = DesignGeometry.objects.get(design=self.design)
+        self.assertEqual(record.stitch_size_cm, 20)
+        self.assertTrue(record.stitch_file.name.endswith('_20cm.dst'))
+        self.assertEqual(record.geometry_file.name, geometry_file)
+
+        second = self.digitize().json()
+        self.assertTrue(second['reused_geometry'])
+        self.assertEqual(second['embroidery_size_cm'], 20)
+        self.assertEqual(DesignGeometry.objects.get(design=self.design).geometry_file.name, geometry_file)
+
+    @override_settings(DIGITIZER_WORKERS=2, DIGITIZER_TILE_SIZE=64, DIGITIZER_PARALLEL_MIN_PIXELS=0)
+    def test_large_images_are_traced_in_the_process_pool(self):
+        with mock.patch('api.utils.digitizer.ProcessPoolExecutor', side_effect=ProcessPoolExecutor) as pool:
+            response = self.digitize()
+        self.assertEqual(response.status_code, 200)
+        pool.assert_called_once_with(max_workers=2)
+
+    def test_format_change_restitches_and_untraced_designs_are_left_alone(self):
+        response = self.client.patch(f'/api/designs/{self.design.id}/update/', {'requested_format': 'pes'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(DesignGeometry.objects.filter(design=self.design).exists())
+
+        self.digitize()
+        self.client.patch(f'/api/designs/{self.design.id}/update/', {'requested_format': 'dst'}, format='json')
+        self.assertTrue(DesignGeometry.objects.get(design=self.design).stitch_file.name.endswith('.dst'))
+
+    def test_new_image_is_traced_again(self):
+        self.digitize()
+        self.design.normal_image.save('other.png', self.design.normal_image.file)
+        self.assertFalse(self.digitize().json()['reused_geometry'])
+
+    def test_invalid_sizes_are_rejected(self):
+        for size in ['abc', 3, 41, '12.5']:
+            self.assertEqual(self.digitize(embroidery_size_cm=size).status_code, 400)
+            response = self.client.patch(f'/api/designs/{self.design.id}/update/', {'embroidery_size_cm': size}, format='json')
+            self.assertEqual(response.status_code, 400)
+        self.design.refresh_from_db()
+        self.assertEqual(self.design.embroidery_size_cm, 10)
+        self.assertFalse(DesignGeometry.objects.filter(design=self.design).exists())
@@ -22,6 +22,7 @@ urlpatterns = [
     path("tokens/balance/", views.token_balance, name="token_balance"),
     path("tokens/packages/", views.token_packages, name="token_packages"),
     path("tokens/transactions/", views.token_transactions, name="token_transactions"),
+    path("tokens/transactions/archive/", views.token_transactions_archive, name="token_transactions_archive"),
     path("tokens/costs/", views.get_token_costs, name="get_token_costs"),
     
     # Token Package Management (Staff Only)
@@ -40,6 +41,7 @@ urlpatterns = [
     path("designs/<int:design_id>/update/", views.update_design, name="update_design"),
     path("designs/<int:design_id>/delete/", views.delete_design, name="delete_design"),
     path("designs/<int:design_id>/generate-preview/", views.generate_preview, name="generate_preview"),
+    path("designs/<int:design_id>/digitize/", views.auto_digitize_design, name="auto_digitize_design"),
     
     # Cart Management (NEW)
     path("cart/", views.view_cart, name="view_cart"),
@@ -65,6 +67,7 @@ urlpatterns = [
     
     # Admin - Order Management
     path("admin/orders/", views.admin_list_orders, name="admin_list_orders"),
+    path("admin/search/", views.admin_search, name="admin_search"),
     path("admin/orders/<int:order_id>/", views.admin_get_order, name="admin_get_order"),
     path("admin/orders/<int:order_id>/upload-files/", views.admin_upload_files, name="admin_upload_files"),
     path("admin/orders/<int:order_id>/update-status/", views.admin_update_status, name="admin_update_status"),
@@ -89,6 +92,8 @@ urlpatterns = [
     # Chat System
     path("chat/conversations/", views.conversation_list, name="conversation_list"),
     path("chat/conversations/<int:conversation_id>/", views.conversation_detail, name="conversation_detail"),
+    path("chat/conversations/<int:conversation_id>/messages/", views.conversation_messages, name="conversation_messages"),
+    path("chat/conversations/<int:conversation_id>/messages/archive/", views.conversation_messages_archive, name="conversation_messages_archive"),
     path("chat/unread-count/", views.unread_messages_count, name="unread_messages_count"),
     
     # Health
@@ -0,0 +1,501 @@
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+import pyembroidery
+from PIL import Image
+from skimage.measure import approximate_polygon
+
+
+def _attach_image(shm_name, shape):
+    """Attach to a shared-memory RGB buffer without copying it"""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    return shm, np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+
+
+def _assign_labels(pixels, palette, chunk=1 << 20):
+    """Map every RGB pixel to the index of its nearest palette colour"""
+    flat = pixels.reshape(-1, 3)
+    pal = palette.astype(np.int32)
+    pal_norm = (pal * pal).sum(axis=1)[None, :]
+    labels = np.empty(len(flat), dtype=np.uint8)
+    for start in range(0, len(flat), chunk):
+        block = flat[start:start + chunk].astype(np.int32)
+        # |p - c|^2 = |p|^2 - 2 p.c + |c|^2, the |p|^2 term does not change the argmin
+        labels[start:start + chunk] = (pal_norm - 2 * block @ pal.T).argmin(axis=1)
+    return labels.reshape(pixels.shape[:2])
+
+
+def writable_formats():
+    """Extensions pyembroidery can write"""
+    return {f['extension'] for f in pyembroidery.supported_formats() if f.get('writer')}
+
+
+def pattern_to_bytes(pattern, extension):
+    """Encode an EmbPattern in the given format without touching the filesystem"""
+    for file_type in pyembroidery.supported_formats():
+        if file_type['extension'] == extension and file_type.get('writer'):
+            buffer = io.BytesIO()
+            pyembroidery.EmbPattern.write_embroidery(file_type['writer'], pattern, buffer)
+            return buffer.getvalue()
+    raise ValueError(f"Cannot write embroidery format: {extension}")
+
+
+def _extract_runs(mask, rows, row_ids, x_offset):
+    """
+    Horizontal fill runs of a boolean mask for the given rows.
+
+    Returns an int32 array of (row_id, y, x0, x1) with x1 exclusive.
+    """
+    if len(rows) == 0:
+        return np.empty((0, 4), dtype=np.int32)
+    sampled = mask[rows].astype(np.int8)
+    padded = np.pad(sampled, ((0, 0), (1, 1)))
+    edges = np.diff(padded, axis=1)
+    start_r, start_x = np.nonzero(edges == 1)
+    _, end_x = np.nonzero(edges == -1)
+    return np.column_stack([
+        row_ids[start_r],
+        rows[start_r],
+        start_x + x_offset,
+        end_x + x_offset,
+    ]).astype(np.int32)
+
+
+# Label of pixels that no colour fills (background, or removed as noise)
+NO_COLOR = 255
+
+
+def label_tile(image, palette, background, window, core, kernel_px):
+    """
+    Colour index of every pixel of one tile's `core`, NO_COLOR where nothing
+    is stitched.
+
+    `window` is the (y0, y1, x0, x1) area that is read, including the
+    overlap margin, `core` is the area this tile owns in the final result.
+    Small specks are removed with a morphological opening per colour, run on
+    the whole window so results on the seam match what a single pass over
+    the full image would produce.
+    """
+    wy0, wy1, wx0, wx1 = window
+    cy0, cy1, cx0, cx1 = core
+    labels = _assign_labels(image[wy0:wy1, wx0:wx1], palette)
+    kernel = np.ones((kernel_px, kernel_px), np.uint8) if kernel_px > 1 else None
+
+    core_labels = np.full((cy1 - cy0, cx1 - cx0), NO_COLOR, dtype=np.uint8)
+    for color_index in range(len(palette)):
+        if color_index == background:
+            continue
+        mask = (labels == color_index).astype(np.uint8)
+        if not mask.any():
+            continue
+        if kernel is not None:
+            mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
+        # Opened masks of different colours never overlap
+        core_labels[mask[cy0 - wy0:cy1 - wy0, cx0 - wx0:cx1 - wx0].astype(bool)] = color_index
+    return core_labels
+
+
+def digitize_tile(image, palette, background, window, core, rows, row_ids, kernel_px):
+    """Segment one tile and return its fill runs per colour"""
+    cy0, _, cx0, _ = core
+    core_labels = label_tile(image, palette, background, window, core, kernel_px)
+    runs = {}
+    for color_index in np.unique(core_labels):
+        if color_index == NO_COLOR:
+            continue
+        color_runs = _extract_runs(core_labels == color_index, rows - cy0, row_ids, cx0)
+        if len(color_runs):
+            color_runs[:, 1] += cy0
+            runs[int(color_index)] = color_runs
+    return runs
+
+
+def _run_shared_tile(function, shm_name, shape, *args):
+    """Process-pool entry point: run a tile function on the shared-memory image"""
+    shm, image = _attach_image(shm_name, shape)
+    try:
+        return function(image, *args)
+    finally:
+        del image
+        shm.close()
+
+
+class EmbroideryDigitizer:
+    """
+    Raster-to-stitch conversion: colour quantization, per-colour fill runs and
+    tatami-style row stitching into a single pyembroidery EmbPattern.
+
+    Large images are split into overlapping tiles that are segmented in a
+    process pool. The source image is placed in shared memory once so the
+    workers never pickle pixel data, only tile coordinates.
+    """
+
+    def __init__(self, size_cm=10, num_colors=8, row_spacing_mm=0.4, max_stitch_mm=3.5,
+                 max_jump_mm=2.0, tile_size=512, tile_overlap=8, workers=None,
+                 parallel_min_pixels=1024 * 1024):
+        self.size_cm = size_cm
+        self.num_colors = num_colors
+        self.row_spacing_mm = row_spacing_mm
+        self.max_stitch_mm = max_stitch_mm
+        self.max_jump_mm = max_jump_mm
+        self.tile_size = tile_size
+        self.tile_overlap = tile_overlap
+        self.workers = workers or os.cpu_count() or 1
+        self.parallel_min_pixels = parallel_min_pixels
+
+    # ------------------------------------------------------------------
+    # Image preparation
+    # ------------------------------------------------------------------
+
+    def load_image(self, source):
+        """Load a path, file object or PIL image as a contiguous RGB array"""
+        img = source if isinstance(source, Image.Image) else Image.open(source)
+        return np.ascontiguousarray(np.asarray(img.convert('RGB'), dtype=np.uint8))
+
+    def build_palette(self, rgb, sample_size=20000):
+        """
+        Pick thread colours with k-means on a pixel sample.
+
+        Returns (palette, background) where background is the index of the
+        colour that dominates the image border and is left unstitched.
+        """
+        flat = rgb.reshape(-1, 3)
+        step = max(1, len(flat) // sample_size)
+        sample = flat[::step].astype(np.float32)
+        unique = np.unique(sample, axis=0)
+        k = max(2, min(self.num_colors, len(unique)))
+
+        if len(unique) <= k:
+            # Few enough colours to use as they are (k-means also fails below k samples)
+            palette = unique.astype(np.uint8)
+        else:
+            cv2.setRNGSeed(0)
+            criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 20, 1.0)
+            _, _, centers = cv2.kmeans(sample, k, None, criteria, 1, cv2.KMEANS_PP_CENTERS)
+            palette = np.clip(np.round(centers), 0, 255).astype(np.uint8)
+
+        border = np.concatenate([rgb[0], rgb[-1], rgb[:, 0], rgb[:, -1]])
+        border_labels = _assign_labels(border[None, :, :], palette).ravel()
+        background = int(np.bincount(border_labels, minlength=len(palette)).argmax())
+        return palette, background
+
+    def mm_per_pixel(self, shape):
+        """Physical size of one source pixel, the longest side maps to size_cm"""
+        return (self.size_cm * 10.0) / max(shape[0], shape[1])
+
+    def scan_rows(self, height, mm_per_px):
+        """Global fill rows so every tile samples the same scan lines"""
+        row_step = max(self.row_spacing_mm / mm_per_px, 1e-6)
+        rows = np.unique(np.round(np.arange(row_step / 2, height, row_step)).astype(np.int32))
+        rows = rows[rows < height]
+        return rows, np.arange(len(rows), dtype=np.int32)
+
+    def plan_tiles(self, shape, margin=None):
+        """Split the image into (window, core) pairs with an overlap margin"""
+        height, width = shape[:2]
+        margin = self.tile_overlap if margin is None else margin
+        tiles = []
+        for cy0 in range(0, height, self.tile_size):
+            cy1 = min(cy0 + self.tile_size, height)
+            for cx0 in range(0, width, self.tile_size):
+                cx1 = min(cx0 + self.tile_size, width)
+                window = (
+                    max(0, cy0 - margin), min(height, cy1 + margin),
+                    max(0, cx0 - margin), min(width, cx1 + margin),
+                )
+                tiles.append((window, (cy0, cy1, cx0, cx1)))
+        return tiles
+
+    # ------------------------------------------------------------------
+    # Segmentation
+    # ------------------------------------------------------------------
+
+    def use_pool(self, shape, parallel=None):
+        """Whether an image of `shape` is split into tiles for the process pool"""
+        if parallel is None:
+            return self.workers > 1 and shape[0] * shape[1] >= self.parallel_min_pixels
+        return parallel
+
+    def map_tiles(self, rgb, function, tile_args, parallel):
+        """
+        [function(rgb, *args) for args in tile_args], in a process pool reading
+        rgb from shared memory when `parallel` and there is more than one tile
+        """
+        if not parallel or len(tile_args) == 1:
+            return [function(rgb, *args) for args in tile_args]
+
+        shm = shared_memory.SharedMemory(create=True, size=rgb.nbytes)
+        try:
+            shared = np.ndarray(rgb.shape, dtype=np.uint8, buffer=shm.buf)
+            shared[:] = rgb
+            with ProcessPoolExecutor(max_workers=min(self.workers, len(tile_args))) as pool:
+                futures = [
+                    pool.submit(_run_shared_tile, function, shm.name, rgb.shape, *args)
+                    for args in tile_args
+                ]
+                results = [future.result() for future in futures]
+            del shared
+        finally:
+            shm.close()
+            shm.unlink()
+        return results
+
+    def whole_image_tile(self, shape):
+        area = (0, shape[0], 0, shape[1])
+        return [(area, area)]
+
+    def segment(self, rgb, palette, background, parallel=None):
+        """Fill runs per colour for the whole image, tiled when it is large"""
+        mm_per_px = self.mm_per_pixel(rgb.shape)
+        rows, row_ids = self.scan_rows(rgb.shape[0], mm_per_px)
+        kernel_px = max(1, min(self.tile_overlap + 1, int(round(0.5 / mm_per_px))))
+
+        parallel = self.use_pool(rgb.shape, parallel)
+        tiles = self.plan_tiles(rgb.shape) if parallel else self.whole_image_tile(rgb.shape)
+
+        tile_args = []
+        for window, core in tiles:
+            selected = (rows >= core[0]) & (rows < core[1])
+            tile_args.append((palette, background, window, core, rows[selected], row_ids[selected], kernel_px))
+        return self.merge_runs(self.map_tiles(rgb, digitize_tile, tile_args, parallel))
+
+    def label_image(self, rgb, palette, background, kernel_px, parallel=None):
+        """Colour index per pixel after noise removal (see label_tile), tiled when large"""
+        parallel = self.use_pool(rgb.shape, parallel)
+        # Opening reaches kernel_px pixels, so the windows overlap by at least that
+        tiles = (self.plan_tiles(rgb.shape, margin=max(self.tile_overlap, kernel_px)) if parallel
+                 else self.whole_image_tile(rgb.shape))
+        tile_args = [(palette, background, window, core, kernel_px) for window, core in tiles]
+        labels = np.empty(rgb.shape[:2], dtype=np.uint8)
+        for (_, (cy0, cy1, cx0, cx1)), core_labels in zip(tiles, self.map_tiles(rgb, label_tile, tile_args, parallel)):
+            labels[cy0:cy1, cx0:cx1] = core_labels
+        return labels
+
+    def merge_runs(self, tile_results):
+        """
+        Combine per-tile runs into one run list per colour.
+
+        Runs cut by a vertical tile seam end exactly where the neighbour's run
+        starts on the same row; those pairs are joined back into one run so the
+        seam does not produce an extra stitch or jump.
+        """
+        merged = {}
+        colors = sorted({c for result in tile_results for c in result})
+        for color_index in colors:
+            runs = np.concatenate([r[color_index] for r in tile_results if color_index in r])
+            runs = runs[np.lexsort((runs[:, 2], runs[:, 0]))]
+            if len(runs) > 1:
+                continues = (runs[1:, 0] == runs[:-1, 0]) & (runs[1:, 2] == runs[:-1, 3])
+                group_starts = np.concatenate([[0], np.nonzero(~continues)[0] + 1])
+                group_ends = np.concatenate([group_starts[1:], [len(runs)]]) - 1
+                joined = runs[group_starts].copy()
+                joined[:, 3] = runs[group_ends, 3]
+                runs = joined
+            merged[color_index] = runs
+        return merged
+
+    # ------------------------------------------------------------------
+    # Stitch generation
+    # ------------------------------------------------------------------
+
+    def runs_to_block(self, runs, mm_per_px):
+        """
+        Turn fill runs into a stitch block of [x, y, command] rows.
+
+        Runs are (row_id, y, x0, x1) in source units, mm_per_px converts them
+        to millimetres (1.0 when the runs are already in mm).
+
+        Rows alternate direction (boustrophedon), long runs are split at
+        max_stitch_mm and gaps longer than max_jump_mm become trim + jump.
+        Coordinates are in pyembroidery units (0.1 mm).
+        """
+        if len(runs) == 0:
+            return np.empty((0, 3))
+        unit = mm_per_px * 10.0
+        reverse = (runs[:, 0] % 2) == 1
+        order = np.lexsort((np.where(reverse, -runs[:, 2], runs[:, 2]), runs[:, 0]))
+        runs = runs[order]
+        reverse = reverse[order]
+
+        y = runs[:, 1].astype(np.float64) * unit
+        left = runs[:, 2] * unit
+        right = runs[:, 3] * unit
+        start = np.where(reverse, right, left)
+        end = np.where(reverse, left, right)
+
+        max_stitch = self.max_stitch_mm * 10.0
+        segments = np.maximum(1, np.ceil(np.abs(end - start) / max_stitch)).astype(np.int64)
+        counts = segments + 1
+        offsets = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        run_of_point = np.repeat(np.arange(len(runs)), counts)
+        step = np.arange(counts.sum()) - offsets[run_of_point]
+        t = step / segments[run_of_point]
+
+        points = np.empty((len(run_of_point), 3))
+        points[:, 0] = start[run_of_point] + (end - start)[run_of_point] * t
+        points[:, 1] = y[run_of_point]
+        points[:, 2] = pyembroidery.STITCH
+
+        gap = np.hypot(start[1:] - end[:-1], y[1:] - y[:-1])
+        far = np.nonzero(gap > self.max_jump_mm * 10.0)[0] + 1
+        if len(far):
+            first_points = offsets[far]
+            trims = points[first_points - 1].copy()
+            trims[:, 2] = pyembroidery.TRIM
+            jumps = points[first_points].copy()
+            jumps[:, 2] = pyembroidery.JUMP
+            inserts = np.empty((2 * len(far), 3))
+            inserts[0::2] = trims
+            inserts[1::2] = jumps
+            points = np.insert(points, np.repeat(first_points, 2), inserts, axis=0)
+        return points
+
+    def build_pattern(self, runs_by_color, palette, mm_per_px):
+        """Assemble one EmbPattern with a colour block per palette entry"""
+        pattern = pyembroidery.EmbPattern()
+        for color_index, runs in runs_by_color.items():
+            block = self.runs_to_block(runs, mm_per_px)
+            if len(block) == 0:
+                continue
+            r, g, b = (int(v) for v in palette[color_index])
+            stitches = [list(row) for row in zip(
+                block[:, 0].tolist(), block[:, 1].tolist(), block[:, 2].astype(int).tolist()
+            )]
+            pattern.add_block(stitches, f"#{r:02x}{g:02x}{b:02x}")
+        if pattern.stitches:
+            # Fails on an empty pattern (an image that is all background)
+            pattern.move_center_to_origin()
+        pattern.end()
+        return pattern
+
+    # ------------------------------------------------------------------
+    # Vector path (cached geometry)
+    # ------------------------------------------------------------------
+
+    def vectorize(self, source, parallel=None, tolerance_px=0.75):
+        """
+        Segment an image once and keep the colour regions as polygons.
+
+        The returned geometry is resolution independent: it can be re-stitched
+        at any size with stitch_geometry() without touching the pixels again.
+        Rings are stored flat per colour, holes included, and filled with the
+        even-odd rule.
+        """
+        rgb = self.load_image(source)
+        palette, background = self.build_palette(rgb)
+        mm_per_px = self.mm_per_pixel(rgb.shape)
+        kernel_px = max(1, int(round(0.5 / mm_per_px)))
+        # Labelling is the per-pixel work and runs tiled in the process pool;
+        # contours are traced once over the merged labels so no ring is cut at a seam
+        labels = self.label_image(rgb, palette, background, kernel_px, parallel=parallel)
+
+        rings, ring_colors = [], []
+        for color_index in np.unique(labels):
+            if color_index == NO_COLOR:
+                continue
+            mask = (labels == color_index).astype(np.uint8)
+            contours, _ = cv2.findContours(mask, cv2.RETR_CCOMP, cv2.CHAIN_APPROX_NONE)
+            for contour in contours:
+                if len(contour) < 3:
+                    continue
+                # Pixel centres sit at +0.5, outline the pixel edges instead
+                ring = approximate_polygon(contour[:, 0, :].astype(np.float64) + 0.5, tolerance_px)
+                if len(ring) >= 3:
+                    rings.append(ring.astype(np.float32))
+                    ring_colors.append(int(color_index))
+
+        lengths = np.array([len(r) for r in rings], dtype=np.int64)
+        return {
+            'width': rgb.shape[1],
+            'height': rgb.shape[0],
+            'palette': palette,
+            'ring_colors': np.array(ring_colors, dtype=np.int32),
+            'ring_offsets': np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64),
+            'points': np.concatenate(rings) if rings else np.empty((0, 2), np.float32),
+        }
+
+    def fill_rings(self, rings, row_spacing, height):
+        """
+        Even-odd scanline fill of closed rings.
+
+        Every edge is expanded only over the scan rows it crosses, so the cost
+        is linear in the number of crossings rather than edges x rows.
+        Returns float runs of (row_id, y, x0, x1) in the rings' units.
+        """
+        edges = [np.column_stack([ring, np.roll(ring, -1, axis=0)]) for ring in rings]
+        if not edges:
+            return np.empty((0, 4))
+        edges = np.concatenate(edges).astype(np.float64)
+        x0, y0, x1, y1 = edges.T
+        y_min = np.minimum(y0, y1)
+        y_max = np.maximum(y0, y1)
+        first = row_spacing / 2
+
+        row_lo = np.ceil((y_min - first) / row_spacing).astype(np.int64)
+        row_hi = np.ceil((y_max - first) / row_spacing).astype(np.int64)
+        row_lo = np.maximum(row_lo, 0)
+        counts = np.maximum(row_hi - row_lo, 0)
+        if counts.sum() == 0:
+            return np.empty((0, 4))
+
+        edge_of = np.repeat(np.arange(len(edges)), counts)
+        row_ids = row_lo[edge_of] + (np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts))
+        y = first + row_ids * row_spacing
+        t = (y - y0[edge_of]) / (y1[edge_of] - y0[edge_of])
+        x = x0[edge_of] + t * (x1[edge_of] - x0[edge_of])
+
+        keep = y < height
+        row_ids, y, x = row_ids[keep], y[keep], x[keep]
+        order = np.lexsort((x, row_ids))
+        row_ids, y, x = row_ids[order], y[order], x[order]
+        # Crossings pair up per row under the even-odd rule
+        return np.column_stack([row_ids[0::2], y[0::2], x[0::2], x[1::2]])
+
+    def stitch_geometry(self, geometry):
+        """Regenerate stitches for cached geometry at the current size_cm"""
+        scale = self.mm_per_pixel((geometry['height'], geometry['width']))
+        offsets = geometry['ring_offsets']
+        points = geometry['points'].astype(np.float64) * scale
+        colors = geometry['ring_colors']
+
+        runs_by_color = {}
+        for color_index in np.unique(colors):
+            rings = [points[offsets[i]:offsets[i + 1]] for i in np.nonzero(colors == color_index)[0]]
+            runs = self.fill_rings(rings, self.row_spacing_mm, geometry['height'] * scale)
+            if len(runs):
+                runs_by_color[int(color_index)] = runs
+        return self.build_pattern(runs_by_color, geometry['palette'], 1.0)
+
+    @staticmethod
+    def save_geometry(geometry, fileobj):
+        """Serialize geometry as a compressed .npz archive"""
+        np.savez_compressed(fileobj, **{k: np.asarray(v) for k, v in geometry.items()})
+
+    @staticmethod
+    def load_geometry(fileobj):
+        """Load geometry written by save_geometry()"""
+        with np.load(fileobj) as data:
+            geometry = {key: data[key] for key in data.files}
+        geometry['width'] = int(geometry['width'])
+        geometry['height'] = int(geometry['height'])
+        return geometry
+
+    def digitize(self, source, parallel=None):
+        """Convert an image into an EmbPattern sized to size_cm"""
+        rgb = self.load_image(source)
+        palette, background = self.build_palette(rgb)
+        runs = self.segment(rgb, palette, background, parallel=parallel)
+        return self.build_pattern(runs, palette, self.mm_per_pixel(rgb.shape))
+
+    def digitize_to_file(self, source, output_path, parallel=None):
+        """Digitize and write in the format implied by the output extension"""
+        pattern = self.digitize(source, parallel=parallel)
+        directory = os.path.dirname(output_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        pyembroidery.write(pattern, output_path)
+        return pattern
@@ -0,0 +1,51 @@
+import numpy as np
+import pyembroidery
+
+from .stitch_renderer import stitch_array
+
+# Fixed machine overheads on top of sewing time
+TRIM_SECONDS = 6
+COLOR_CHANGE_SECONDS = 12
+
+
+def compute_stitch_stats(pattern, spm):
+    """
+    Stitch statistics for an EmbPattern (or an (N, 3) stitch array).
+
+    Commands are counted with one bincount over the command column, the
+    bounding box covers needle penetrations only. Coordinates are in
+    pyembroidery units (0.1 mm). Estimated run time is sewing at `spm`
+    stitches per minute plus fixed trim and colour change overheads.
+    """
+    stitches = stitch_array(pattern)
+    commands = stitches[:, 2].astype(np.int64)
+    counts = np.bincount(commands, minlength=pyembroidery.COLOR_BREAK + 1)
+
+    stitch_count = int(counts[pyembroidery.STITCH])
+    trims = int(counts[pyembroidery.TRIM])
+    jumps = int(counts[pyembroidery.JUMP])
+    color_changes = int(counts[pyembroidery.COLOR_CHANGE] + counts[pyembroidery.NEEDLE_SET])
+
+    sewn = stitches[commands == pyembroidery.STITCH, :2]
+    if len(sewn):
+        min_x, min_y = sewn.min(axis=0)
+        max_x, max_y = sewn.max(axis=0)
+    else:
+        min_x = min_y = max_x = max_y = 0.0
+
+    seconds = stitch_count * 60.0 / spm if spm else 0.0
+    seconds += trims * TRIM_SECONDS + color_changes * COLOR_CHANGE_SECONDS
+
+    return {
+        'stitch_count': stitch_count,
+        'color_changes': color_changes,
+        'trims': trims,
+        'jumps': jumps,
+        'min_x': float(min_x),
+        'min_y': float(min_y),
+        'max_x': float(max_x),
+        'max_y': float(max_y),
+        'width_mm': round(float(max_x - min_x) / 10.0, 1),
+        'height_mm': round(float(max_y - min_y) / 10.0, 1),
+        'estimated_seconds': int(round(seconds)),
+    }
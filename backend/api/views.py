@@ -5,6 +5,7 @@ from rest_framework.response import Response
 from rest_framework_simplejwt.tokens import RefreshToken
 from django.contrib.auth import authenticate
 from django.contrib.auth.models import User
+from django.db import IntegrityError, router, transaction
 from django.http import FileResponse
 from django.conf import settings
 from django.utils import timezone
@@ -15,6 +16,7 @@ import stripe
 import logging
 from google.auth.transport import requests as google_requests
 from google.oauth2 import id_token as google_id_token
+from studio.routers import read_replica
 
 logger = logging.getLogger(__name__)
 
@@ -33,6 +35,9 @@ from .models import (
     OrderResource,
     Conversation,
     Message,
+    DesignGeometry,
+    ArchivedPurchaseTotal,
+    OUTPUT_FORMATS,
 )
 from .serializers import (
     UserSerializer,
@@ -52,13 +57,36 @@ from .serializers import (
     OrderResourceSerializer,
 )
 from .utils.openai_service import OpenAIService
+from .digitizing import digitize_design, parse_size_cm, restitch_cached
+from .pagination import InvalidCursor, paginate, paginate_by_id
+from .archive import archive_page
+from . import search
+from .pricing import estimate_design_stitches, price_for_design, prices_for_designs
+from .order_files import analyse_output_uploads, save_output_files, save_upload_analysis
+from .checkout import submit_orders
+from . import ledger
 
 # Pattern storage removed - using database now
 
+
+def insufficient_tokens_response(error, **extra):
+    """402 response for a ledger debit that found too few tokens"""
+    return Response(
+        {
+            **extra,
+            "error": "Insufficient tokens",
+            "required": error.required,
+            "available": error.available,
+        },
+        status=status.HTTP_402_PAYMENT_REQUIRED,
+    )
+
+
 # ============================================================================
 # AUTHENTICATION
 # ============================================================================
 
+@transaction.non_atomic_requests
 @api_view(["POST"])
 @permission_classes([AllowAny])
 def register(request):
@@ -83,21 +111,57 @@ def register(request):
     )
 
 
-def _generate_unique_username(email, full_name=""):
+def _generate_unique_username(email, full_name="", taken=()):
+    """
+    First free username of the form base, base1, base2, ...
+
+    Every existing name that could collide is fetched in one prefix query
+    (served by the username index) and the suffix is picked in memory.
+    `taken` adds names known to be unavailable, e.g. after losing a race.
+    """
     base_source = (full_name or "").strip() or email.split("@")[0]
     base_username = re.sub(r"[^a-zA-Z0-9._-]", "", base_source.lower())
     base_username = base_username[:120] or "user"
 
-    username = base_username
-    counter = 1
-    while User.objects.filter(username=username).exists():
+    def candidate(counter):
+        if not counter:
+            return base_username
         suffix = f"{counter}"
-        username = f"{base_username[:max(1, 120 - len(suffix))]}{suffix}"
+        return f"{base_username[:max(1, 120 - len(suffix))]}{suffix}"
+
+    # Suffixes up to 10 digits only ever trim the base down to this prefix.
+    # The prefix narrows the index scan; the regex keeps only names of the
+    # candidate shape (a kept part of the base, then digits), not every
+    # username that merely starts the same way.
+    kept_bases = "|".join(
+        re.escape(base_username[:end]) for end in range(min(110, len(base_username)), len(base_username) + 1)
+    )
+    existing = set(User.objects.filter(
+        username__startswith=base_username[:110],
+        username__regex=rf"^(?:{kept_bases})\d*$",
+    ).values_list("username", flat=True))
+    existing.update(taken)
+
+    counter = 0
+    while candidate(counter) in existing:
         counter += 1
+    return candidate(counter)
+
 
-    return username
+def _create_user_with_unique_username(email, full_name="", attempts=5, **fields):
+    """Create a user under a generated username, retrying if a concurrent sign-up takes it first"""
+    taken = set()
+    for _ in range(attempts):
+        username = _generate_unique_username(email=email, full_name=full_name, taken=taken)
+        try:
+            with transaction.atomic():
+                return User.objects.create_user(username=username, email=email, **fields)
+        except IntegrityError:
+            taken.add(username)
+    raise IntegrityError(f"Could not allocate a unique username for {email}")
 
 
+@transaction.non_atomic_requests
 @api_view(["POST"])
 @permission_classes([AllowAny])
 def google_auth(request):
@@ -151,46 +215,46 @@ def google_auth(request):
     family_name = token_info.get("family_name", "")
     full_name = token_info.get("name", "")
 
-    user = User.objects.filter(email=email).first()
-    is_new_user = False
-
-    if not user:
-        username = _generate_unique_username(email=email, full_name=full_name)
-        user = User.objects.create_user(
-            username=username,
-            email=email,
-            password=None,
-            first_name=given_name,
-            last_name=family_name,
-        )
-        user.set_unusable_password()
-        user.save(update_fields=["password"])
-        is_new_user = True
-    else:
-        updated_fields = []
-        if not user.first_name and given_name:
-            user.first_name = given_name
-            updated_fields.append("first_name")
-        if not user.last_name and family_name:
-            user.last_name = family_name
-            updated_fields.append("last_name")
-        if updated_fields:
-            user.save(update_fields=updated_fields)
-
-    profile, _ = UserProfile.objects.get_or_create(
-        user=user,
-        defaults={"email_verified": True, "tokens": 50},
-    )
+    # The Google call is done; create or update the account in one short transaction
+    with transaction.atomic():
+        user = User.objects.filter(email=email).first()
+        is_new_user = False
+
+        if not user:
+            user = _create_user_with_unique_username(
+                email=email,
+                full_name=full_name,
+                password=None,
+                first_name=given_name,
+                last_name=family_name,
+            )
+            user.set_unusable_password()
+            user.save(update_fields=["password"])
+            is_new_user = True
+        else:
+            updated_fields = []
+            if not user.first_name and given_name:
+                user.first_name = given_name
+                updated_fields.append("first_name")
+            if not user.last_name and family_name:
+                user.last_name = family_name
+                updated_fields.append("last_name")
+            if updated_fields:
+                user.save(update_fields=updated_fields)
+
+        profile, _ = UserProfile.objects.get_or_create(
+            user=user,
+            defaults={"email_verified": True, "tokens": 50},
+        )
 
-    profile_updated = []
-    if not profile.email_verified:
-        profile.email_verified = True
-        profile_updated.append("email_verified")
-    if is_new_user and profile.tokens < 50:
-        profile.tokens = 50
-        profile_updated.append("tokens")
-    if profile_updated:
-        profile.save(update_fields=profile_updated)
+        profile_updated = []
+        if not profile.email_verified:
+            profile.email_verified = True
+            profile_updated.append("email_verified")
+        if profile_updated:
+            profile.save(update_fields=profile_updated)
+        if is_new_user and profile.tokens < 50:
+            ledger.credit(user, 50 - profile.tokens, "Welcome bonus for Google sign-up", transaction_type="welcome_bonus")
 
     refresh = RefreshToken.for_user(user)
     return Response(
@@ -209,6 +273,7 @@ def google_auth(request):
 # DESIGN MANAGEMENT
 # ============================================================================
 
+@transaction.non_atomic_requests
 @api_view(["POST"])
 @permission_classes([IsAuthenticated])
 def create_design(request):
@@ -277,13 +342,6 @@ def create_design(request):
             elif result['embroidery_preview'].get('image_url'):
                 openai_service.download_image(result['embroidery_preview']['image_url'], embroidery_path)
             
-            # Update design
-            design.normal_image = f"designs/normal/{normal_filename}"
-            design.embroidery_preview = f"designs/embroidery/{embroidery_filename}"
-            design.tokens_used = tokens_required
-            design.status = 'ready'
-            design.save()
-            
             # Add text overlay to normal image if text content provided
             if text_content.strip():
                 try:
@@ -315,16 +373,18 @@ def create_design(request):
                     traceback.print_exc()
                     # Continue without text overlay
             
-            # Deduct tokens
-            profile.deduct_tokens(tokens_required)
-            
-            # Create transaction
-            TokenTransaction.objects.create(
-                user=request.user,
-                type="usage",
-                amount=tokens_required,
-                description=f"Generated design: {name}"
-            )
+            # Deduct tokens and mark the design ready together
+            try:
+                with transaction.atomic():
+                    ledger.debit(request.user, tokens_required, f"Generated design: {name}")
+                    design.normal_image = f"designs/normal/{normal_filename}"
+                    design.embroidery_preview = f"designs/embroidery/{embroidery_filename}"
+                    design.tokens_used = tokens_required
+                    design.status = 'ready'
+                    design.save()
+            except ledger.InsufficientTokens as e:
+                design.delete()  # Clean up
+                return insufficient_tokens_response(e)
             
             return Response({
                 "success": True,
@@ -428,6 +488,12 @@ def generate_ai_image(request):
         elif result.get('image_url'):
             openai_service.download_image(result['image_url'], embroidery_path)
         
+        # Deduct tokens
+        try:
+            ledger.debit(request.user, tokens_required, f"Generated AI image for: {design.name}")
+        except ledger.InsufficientTokens as e:
+            return insufficient_tokens_response(e)
+        
         # Update design with only embroidery preview and machine settings
         design.embroidery_preview = f"designs/embroidery/{embroidery_filename}"
         design.prompt = prompt
@@ -437,17 +503,6 @@ def generate_ai_image(request):
         design.tokens_used += tokens_required
         design.save()
         
-        # Deduct tokens
-        profile.deduct_tokens(tokens_required)
-        
-        # Create transaction
-        TokenTransaction.objects.create(
-            user=request.user,
-            type="usage",
-            amount=tokens_required,
-            description=f"Generated AI image for: {design.name}"
-        )
-        
         return Response({
             "success": True,
             "message": "AI image generated successfully",
@@ -464,6 +519,7 @@ def generate_ai_image(request):
         )
 
 
+@transaction.non_atomic_requests
 @api_view(["POST"])
 @permission_classes([IsAuthenticated])
 def generate_embroidery_preview_new(request):
@@ -556,15 +612,19 @@ def generate_embroidery_preview_new(request):
         )
 
 
+@transaction.non_atomic_requests
 @api_view(["GET"])
 @permission_classes([IsAuthenticated])
+@read_replica
 def list_designs(request):
     """List all user's designs"""
-    designs = Design.objects.filter(user=request.user).order_by('-created_at')
+    designs = Design.objects.filter(user=request.user).for_serializer().order_by('-created_at')
+    designs, pagination = paginate(request, designs)
     serializer = DesignSerializer(designs, many=True, context={'request': request})
     return Response({
         "success": True,
-        "designs": serializer.data
+        "designs": serializer.data,
+        **pagination
     })
 
 
@@ -595,7 +655,13 @@ def update_design(request, design_id):
         
         # Embroidery Size (for pricing)
         if 'embroidery_size_cm' in request.data:
-            design.embroidery_size_cm = int(request.data['embroidery_size_cm'])
+            try:
+                design.embroidery_size_cm = parse_size_cm(request.data['embroidery_size_cm'])
+            except ValueError as e:
+                return Response(
+                    {"error": str(e)},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
         
         # Machine Settings
         if 'machine_brand' in request.data:
@@ -609,6 +675,9 @@ def update_design(request, design_id):
         
         design.save()
         
+        # Keep the auto-digitized stitch file at the saved size and format
+        restitch_cached(design)
+        
         return Response({
             "success": True,
             "message": "Design updated",
@@ -640,6 +709,7 @@ def delete_design(request, design_id):
         )
 
 
+@transaction.non_atomic_requests
 @api_view(["POST"])
 @permission_classes([IsAuthenticated])
 def generate_preview(request, design_id):
@@ -706,6 +776,40 @@ def generate_preview(request, design_id):
         )
 
 
+@transaction.non_atomic_requests
+@api_view(["POST"])
+@permission_classes([IsAuthenticated])
+def auto_digitize_design(request, design_id):
+    """
+    Convert a design image to a stitch file at its embroidery size.
+    The traced geometry is cached, so later size changes only re-stitch it.
+    """
+    try:
+        design = Design.objects.get(id=design_id, user=request.user)
+    except Design.DoesNotExist:
+        return Response(
+            {"error": "Design not found"}, 
+            status=status.HTTP_404_NOT_FOUND
+        )
+    
+    try:
+        size_cm = parse_size_cm(request.data.get("embroidery_size_cm") or design.embroidery_size_cm)
+        geometry, reused = digitize_design(design, size_cm=size_cm)
+    except ValueError as e:
+        return Response(
+            {"error": str(e)},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    return Response({
+        "success": True,
+        "stitch_file": request.build_absolute_uri(geometry.stitch_file.url),
+        "stitch_count": geometry.stitch_count,
+        "embroidery_size_cm": geometry.stitch_size_cm,
+        "reused_geometry": reused,
+    })
+
+
 # ============================================================================
 # CART MANAGEMENT
 # ============================================================================
@@ -805,6 +909,7 @@ def clear_cart(request):
     })
 
 
+@transaction.non_atomic_requests
 @api_view(["POST"])
 @permission_classes([IsAuthenticated])
 def cart_checkout(request):
@@ -885,15 +990,13 @@ def cart_checkout(request):
                 )
         
         # Calculate total tokens required based on size pricing
-        from .models import EmbroiderySizePricing
-        
         profile = request.user.profile
         total_tokens_required = 0
         order_costs = []
         
-        for item in designs_to_order:
-            # Get price for this size
-            size_price = EmbroiderySizePricing.get_price_for_size(item['size_cm'])
+        # Price every item at once (size tiers, and density when enabled)
+        prices = prices_for_designs([(item['design'], item['size_cm']) for item in designs_to_order])
+        for item, size_price in zip(designs_to_order, prices):
             total_tokens_required += size_price
             order_costs.append({
                 'design': item['design'],
@@ -912,43 +1015,20 @@ def cart_checkout(request):
                 status=status.HTTP_402_PAYMENT_REQUIRED,
             )
         
-        # Create orders with size-based costs
-        created_orders = []
-        for item in order_costs:
-            order = Order.objects.create(
-                user=request.user,
-                design=item['design'],
-                status='submitted',
-                tokens_used=item['tokens_cost'],
-                embroidery_size_cm=item['size_cm'],
-                requested_formats=requested_formats
-            )
-            created_orders.append(order)
-            
-            # Update design status
-            item['design'].status = 'processing'
-            item['design'].save()
-        
-        # Deduct tokens
-        profile.deduct_tokens(total_tokens_required)
-        
-        # Create transaction
-        TokenTransaction.objects.create(
-            user=request.user,
-            type="usage",
-            amount=-total_tokens_required,
-            description=f"Submitted {len(created_orders)} order(s) for digitization"
-        )
-        
-        # Clear cart
-        Cart.objects.filter(user=request.user).delete()
+        # Charge, create the orders and update designs in one short transaction
+        # with bulk writes; the email goes out after it has committed
+        try:
+            created_orders = submit_orders(request.user, order_costs, requested_formats, clear_cart=True)
+        except ledger.InsufficientTokens as e:
+            return insufficient_tokens_response(e, success=False)
         
         # Send email notification (async in production)
         for order in created_orders:
             try:
                 send_order_submitted_email(order)
-            except:
+            except Exception:
                 pass  # Don't fail order creation if email fails
+        created_orders = Order.objects.for_serializer().filter(pk__in=[o.pk for o in created_orders])
         
         response_data = {
             "success": True,
@@ -980,6 +1060,7 @@ def cart_checkout(request):
 # ORDER MANAGEMENT
 # ============================================================================
 
+@transaction.non_atomic_requests
 @api_view(["POST"])
 @permission_classes([IsAuthenticated])
 def create_order(request):
@@ -1026,7 +1107,7 @@ def create_order(request):
                 )
         elif from_cart:
             # Order from cart
-            cart_items = Cart.objects.filter(user=request.user)
+            cart_items = Cart.objects.filter(user=request.user).select_related('design')
             if not cart_items.exists():
                 return Response(
                     {"error": "Cart is empty"}, 
@@ -1043,15 +1124,13 @@ def create_order(request):
             )
         
         # Calculate total tokens required based on size pricing
-        from .models import EmbroiderySizePricing
-        
         profile = request.user.profile
         total_tokens_required = 0
         order_costs = []
         
-        for item in items_to_order:
-            # Get price for this size
-            size_price = EmbroiderySizePricing.get_price_for_size(item['size_cm'])
+        # Price every item at once (size tiers, and density when enabled)
+        prices = prices_for_designs([(item['design'], item['size_cm']) for item in items_to_order])
+        for item, size_price in zip(items_to_order, prices):
             total_tokens_required += size_price
             order_costs.append({
                 'design': item['design'],
@@ -1069,44 +1148,20 @@ def create_order(request):
                 status=status.HTTP_402_PAYMENT_REQUIRED,
             )
         
-        # Create orders with size-based costs
-        created_orders = []
-        for item in order_costs:
-            order = Order.objects.create(
-                user=request.user,
-                design=item['design'],
-                status='submitted',
-                tokens_used=item['tokens_cost'],
-                embroidery_size_cm=item['size_cm'],
-                requested_formats=requested_formats
-            )
-            created_orders.append(order)
-            
-            # Update design status
-            item['design'].status = 'processing'
-            item['design'].save()
-        
-        # Deduct tokens
-        profile.deduct_tokens(total_tokens_required)
-        
-        # Create transaction
-        TokenTransaction.objects.create(
-            user=request.user,
-            type="usage",
-            amount=total_tokens_required,
-            description=f"Submitted {len(created_orders)} order(s) for digitization"
-        )
-        
-        # Clear cart if ordering from cart
-        if from_cart:
-            Cart.objects.filter(user=request.user).delete()
+        # Charge, create the orders and update designs in one short transaction
+        # with bulk writes; the email goes out after it has committed
+        try:
+            created_orders = submit_orders(request.user, order_costs, requested_formats, clear_cart=from_cart)
+        except ledger.InsufficientTokens as e:
+            return insufficient_tokens_response(e)
         
         # Send email notification (async in production)
         for order in created_orders:
             try:
                 send_order_submitted_email(order)
-            except:
+            except Exception:
                 pass  # Don't fail order creation if email fails
+        created_orders = Order.objects.for_serializer().filter(pk__in=[o.pk for o in created_orders])
         
         return Response({
             "success": True,
@@ -1124,21 +1179,25 @@ def create_order(request):
         )
 
 
+@transaction.non_atomic_requests
 @api_view(["GET"])
 @permission_classes([IsAuthenticated])
+@read_replica
 def list_orders(request):
     """List all user's orders"""
     status_filter = request.query_params.get("status")
     
-    orders = Order.objects.filter(user=request.user).order_by('-created_at')
+    orders = Order.objects.filter(user=request.user).for_serializer().order_by('-created_at')
     
     if status_filter:
         orders = orders.filter(status=status_filter)
     
+    orders, pagination = paginate(request, orders)
     serializer = OrderSerializer(orders, many=True, context={'request': request})
     return Response({
         "success": True,
-        "orders": serializer.data
+        "orders": serializer.data,
+        **pagination
     })
 
 
@@ -1147,7 +1206,7 @@ def list_orders(request):
 def get_order(request, order_id):
     """Get single order details"""
     try:
-        order = Order.objects.get(id=order_id, user=request.user)
+        order = Order.objects.for_serializer().get(id=order_id, user=request.user)
         return Response({
             "success": True,
             "order": OrderSerializer(order, context={'request': request}).data
@@ -1159,6 +1218,7 @@ def get_order(request, order_id):
         )
 
 
+@transaction.non_atomic_requests
 @api_view(["POST"])
 @permission_classes([IsAuthenticated])
 def retry_order(request, order_id):
@@ -1207,37 +1267,9 @@ def download_order_file(request, order_id, format_type):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Get the file field for requested format
-        format_field_map = {
-            # Industrial
-            'dst': order.output_dst,
-            'dsb': order.output_dsb,
-            'dsz': order.output_dsz,
-            'exp': order.output_exp,
-            'tbf': order.output_tbf,
-            'fdr': order.output_fdr,
-            'stx': order.output_stx,
-            # Domestic
-            'pes': order.output_pes,
-            'pec': order.output_pec,
-            'jef': order.output_jef,
-            'sew': order.output_sew,
-            'hus': order.output_hus,
-            'vip': order.output_vip,
-            'vp3': order.output_vp3,
-            'xxx': order.output_xxx,
-            # Commercial
-            'cmd': order.output_cmd,
-            'tap': order.output_tap,
-            'tim': order.output_tim,
-            'emt': order.output_emt,
-            '10o': order.output_10o,
-            'ds9': order.output_ds9,
-        }
-        
-        file_field = format_field_map.get(format_type.lower())
+        output = order.output_files.filter(format=format_type.lower()).first()
         
-        if not file_field:
+        if not output:
             return Response(
                 {"error": f"Format {format_type} not available"}, 
                 status=status.HTTP_404_NOT_FOUND
@@ -1246,7 +1278,7 @@ def download_order_file(request, order_id, format_type):
         filename = f"{order.order_number}_{order.design.name}.{format_type.lower()}"
         
         return FileResponse(
-            file_field.open('rb'),
+            output.file.open('rb'),
             as_attachment=True,
             filename=filename
         )
@@ -1348,20 +1380,14 @@ def verify_email(request):
         user = token.user
         profile = user.profile
         profile.email_verified = True
-        profile.tokens = 50  # Welcome bonus
-        profile.save()
+        profile.save(update_fields=["email_verified", "updated_at"])
 
         # Mark token as used
         token.is_used = True
         token.save()
 
-        # Create transaction record
-        TokenTransaction.objects.create(
-            user=user,
-            type="welcome_bonus",
-            amount=50,
-            description="Welcome bonus for email verification",
-        )
+        # Welcome bonus
+        ledger.credit(user, 50, "Welcome bonus for email verification", transaction_type="welcome_bonus")
 
         # Generate JWT tokens for automatic login
         refresh = RefreshToken.for_user(user)
@@ -1385,6 +1411,7 @@ def verify_email(request):
         )
 
 
+@transaction.non_atomic_requests
 @api_view(["POST"])
 @permission_classes([AllowAny])
 def resend_verification(request):
@@ -1406,13 +1433,12 @@ def resend_verification(request):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        # Invalidate old tokens
-        EmailVerificationToken.objects.filter(user=user, is_used=False).update(
-            is_used=True
-        )
-
-        # Create and send new token
-        verification_token = EmailVerificationToken.objects.create(user=user)
+        # Replace old tokens, then send the new one outside the transaction
+        with transaction.atomic():
+            EmailVerificationToken.objects.filter(user=user, is_used=False).update(
+                is_used=True
+            )
+            verification_token = EmailVerificationToken.objects.create(user=user)
         verification_token.send_verification_email()
 
         return Response(
@@ -1485,6 +1511,7 @@ def login(request):
     )
 
 
+@transaction.non_atomic_requests
 @api_view(["POST"])
 @permission_classes([AllowAny])
 def forgot_password(request):
@@ -1502,11 +1529,10 @@ def forgot_password(request):
     try:
         user = User.objects.get(email=email)
 
-        # Invalidate old tokens
-        PasswordResetToken.objects.filter(user=user, is_used=False).update(is_used=True)
-
-        # Create and send new token
-        reset_token = PasswordResetToken.objects.create(user=user)
+        # Replace old tokens, then send the new one outside the transaction
+        with transaction.atomic():
+            PasswordResetToken.objects.filter(user=user, is_used=False).update(is_used=True)
+            reset_token = PasswordResetToken.objects.create(user=user)
         reset_token.send_reset_email()
 
         return Response(
@@ -1673,23 +1699,43 @@ def token_balance(request):
     )
 
 
+@transaction.non_atomic_requests
 @api_view(["GET"])
 @permission_classes([IsAuthenticated])
+@read_replica
 def token_transactions(request):
     """Get user's token transaction history"""
+    # Served by the (user, -created_at) index; balance_after is stored by the ledger
     transactions = TokenTransaction.objects.filter(user=request.user).order_by("-created_at")
+    transactions, pagination = paginate(request, transactions)
     
-    # Get balance_after for each transaction
-    transactions_data = []
-    for transaction in transactions:
-        transaction_dict = TokenTransactionSerializer(transaction).data
-        # Calculate balance after this transaction (this is simplified - in production you'd store this)
-        transaction_dict['balance_after'] = request.user.profile.tokens
-        transactions_data.append(transaction_dict)
+    return Response({
+        "success": True,
+        "transactions": TokenTransactionSerializer(transactions, many=True).data,
+        **pagination
+    })
+
+
+@transaction.non_atomic_requests
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+@read_replica
+def token_transactions_archive(request):
+    """
+    Archived token history (see archive_history), one month per page, newest
+    first. ?month=YYYY-MM pages back; follow `older_month` until it is null.
+    """
+    try:
+        transactions, page = archive_page(
+            TokenTransaction, request.query_params.get('month'), user_id=request.user.id
+        )
+    except ValueError:
+        return Response({"error": "month must be YYYY-MM"}, status=status.HTTP_400_BAD_REQUEST)
     
     return Response({
         "success": True,
-        "transactions": transactions_data
+        "transactions": TokenTransactionSerializer(transactions, many=True).data,
+        **page
     })
 
 
@@ -1850,29 +1896,40 @@ def token_package_stats(request):
             status=status.HTTP_403_FORBIDDEN
         )
     
-    from django.db.models import Sum, Count
+    from django.db.models import Sum, Count, Q
     
     stats = TokenTransaction.objects.filter(type="purchase").aggregate(
         total_tokens_sold=Sum('amount'),
         total_purchases=Count('id'),
-        total_revenue=Sum('user__profile__tokens')
+        total_revenue=Sum('package__price')
     )
     
-    packages_data = []
-    for package in TokenPackage.objects.all():
-        purchases = TokenTransaction.objects.filter(
-            type="purchase",
-            description__contains=package.name
-        ).count()
-        
-        packages_data.append({
-            "id": package.id,
-            "name": package.name,
-            "tokens": package.tokens,
-            "price": str(package.price),
-            "purchases": purchases,
-            "revenue": float(package.price) * purchases if purchases > 0 else 0
-        })
+    # Purchases in months moved out by archive_history, per package
+    archived = ArchivedPurchaseTotal.objects.values('package').annotate(
+        purchase_count=Sum('purchases'),
+        tokens_sold=Sum('tokens')
+    )
+    archived_purchases = {row['package']: row['purchase_count'] for row in archived}
+    stats['total_tokens_sold'] = (stats['total_tokens_sold'] or 0) + sum(row['tokens_sold'] for row in archived)
+    stats['total_purchases'] += sum(archived_purchases.values())
+    stats['total_revenue'] = stats['total_revenue'] or 0
+    
+    # One GROUP BY over the transaction -> package foreign key
+    packages = TokenPackage.objects.annotate(
+        purchases=Count('transactions', filter=Q(transactions__type="purchase"))
+    )
+    for package in packages:
+        archived_count = archived_purchases.get(package.id, 0)
+        package.purchases += archived_count
+        stats['total_revenue'] += package.price * archived_count
+    packages_data = [{
+        "id": package.id,
+        "name": package.name,
+        "tokens": package.tokens,
+        "price": str(package.price),
+        "purchases": package.purchases,
+        "revenue": float(package.price) * package.purchases if package.purchases > 0 else 0
+    } for package in packages]
     
     return Response({
         "success": True,
@@ -1912,11 +1969,16 @@ def validate_cart_before_checkout(request):
                 "reason": f"Design status is {item.design.status}"
             })
         else:
+            size_cm = item.design.embroidery_size_cm
+            estimate = estimate_design_stitches(item.design, size_cm)
             validation_results.append({
                 "item_id": item.id,
                 "design_id": item.design.id,
                 "valid": True,
-                "design_name": item.design.name
+                "design_name": item.design.name,
+                "size_cm": size_cm,
+                "stitch_estimate": estimate,
+                "tokens_cost": price_for_design(item.design, size_cm, estimate)
             })
     
     # Remove invalid items
@@ -1939,15 +2001,7 @@ def validate_cart_before_checkout(request):
 
         # In production, integrate with payment gateway here
         # For now, just add tokens
-        profile.tokens += package.tokens
-        profile.save()
-
-        TokenTransaction.objects.create(
-            user=request.user,
-            type="purchase",
-            amount=package.tokens,
-            description=f"Purchased {package.name}",
-        )
+        ledger.credit(request.user, package.tokens, f"Purchased {package.name}", package=package)
 
         return Response(
             {
@@ -1962,6 +2016,7 @@ def validate_cart_before_checkout(request):
         )
 
 
+@transaction.non_atomic_requests
 @api_view(["POST"])
 @permission_classes([IsAuthenticated])
 def generate_ai_image(request):
@@ -2022,27 +2077,21 @@ def generate_ai_image(request):
         embroidery_save_success = openai_service.download_image(embroidery_result["image_url"], embroidery_path)
 
     if normal_save_success and embroidery_save_success:
-        # Deduct tokens
-        profile.deduct_tokens(tokens_required)
-
-        # Create Design object with BOTH images
-        design = Design.objects.create(
-            user=request.user,
-            name=f"AI Generated: {prompt[:50]}",
-            normal_image=f"generated/{normal_filename}",
-            embroidery_preview=f"generated/{embroidery_filename}",
-            prompt=prompt,
-            status='ready',  # Set to 'ready' since we have both images
-            tokens_used=tokens_required
-        )
-
-        # Create token transaction
-        TokenTransaction.objects.create(
-            user=request.user,
-            type="usage",
-            amount=tokens_required,
-            description=f"Generated AI image with embroidery preview",
-        )
+        # Deduct tokens and create the Design object with BOTH images together
+        try:
+            with transaction.atomic():
+                ledger.debit(request.user, tokens_required, "Generated AI image with embroidery preview")
+                design = Design.objects.create(
+                    user=request.user,
+                    name=f"AI Generated: {prompt[:50]}",
+                    normal_image=f"generated/{normal_filename}",
+                    embroidery_preview=f"generated/{embroidery_filename}",
+                    prompt=prompt,
+                    status='ready',  # Set to 'ready' since we have both images
+                    tokens_used=tokens_required
+                )
+        except ledger.InsufficientTokens as e:
+            return insufficient_tokens_response(e)
 
         return Response(
             {
@@ -2129,6 +2178,7 @@ stripe.api_key = os.getenv("STRIPE_SECRET_KEY")
 # Add these new endpoints to your views.py
 
 
+@transaction.non_atomic_requests
 @api_view(["POST"])
 @permission_classes([IsAuthenticated])
 def create_checkout_session(request):
@@ -2189,6 +2239,7 @@ def create_checkout_session(request):
         return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+@transaction.non_atomic_requests
 @api_view(["POST"])
 @permission_classes([AllowAny])
 def stripe_webhook(request):
@@ -2224,29 +2275,16 @@ def stripe_webhook(request):
             user = User.objects.get(id=user_id)
             package = TokenPackage.objects.get(id=package_id)
             
-            # Check if tokens have already been added for this session (prevent duplicates)
-            existing_transaction = TokenTransaction.objects.filter(
-                user=user,
-                description__contains=session_id
-            ).exists()
-            
-            if existing_transaction:
+            # Add tokens unless this session was already fulfilled (prevent duplicates)
+            fulfilled = ledger.fulfill_payment(
+                session_id, user, tokens,
+                f"Purchased {package.name} via Stripe (session: {session_id})",
+                package=package,
+            )
+            if fulfilled is None:
                 print(f"ℹ️ Webhook: Payment already processed for session: {session_id}")
                 return Response({"success": True})
 
-            # Add tokens to user
-            profile = user.profile
-            profile.tokens += tokens
-            profile.save()
-
-            # Create transaction record with session_id to prevent duplicates
-            TokenTransaction.objects.create(
-                user=user,
-                type="purchase",
-                amount=tokens,
-                description=f"Purchased {package.name} via Stripe (session: {session_id})",
-            )
-
             # Send token purchase email notification
             try:
                 amount_paid = session.get("amount_total", 0) / 100  # Convert from cents
@@ -2267,6 +2305,7 @@ def stripe_webhook(request):
     return Response({"success": True})
 
 
+@transaction.non_atomic_requests
 @api_view(["GET"])
 @permission_classes([IsAuthenticated])
 def verify_payment(request):
@@ -2296,43 +2335,31 @@ def verify_payment(request):
                     status=status.HTTP_403_FORBIDDEN
                 )
             
-            # Check if tokens have already been added for this session
-            # (by checking if a transaction with this session_id already exists)
-            existing_transaction = TokenTransaction.objects.filter(
-                user=request.user,
-                description__contains=session_id
-            ).exists()
-            
             profile = request.user.profile
             
-            if not existing_transaction and tokens_to_add > 0:
-                # Tokens not added yet (webhook might have failed) - add them now
-                profile.tokens += tokens_to_add
-                profile.save()
-                
-                # Create transaction record with session_id to prevent duplicates
+            fulfilled = None
+            if tokens_to_add > 0:
+                # Add tokens unless the webhook already did (it might have failed)
                 try:
                     package = TokenPackage.objects.get(id=package_id) if package_id else None
                     description = f"Purchased {package.name if package else 'tokens'} via Stripe (session: {session_id})"
                 except TokenPackage.DoesNotExist:
+                    package = None
                     description = f"Purchased {tokens_to_add} tokens via Stripe (session: {session_id})"
                 
-                TokenTransaction.objects.create(
-                    user=request.user,
-                    type="purchase",
-                    amount=tokens_to_add,
-                    description=description,
+                fulfilled = ledger.fulfill_payment(
+                    session_id, request.user, tokens_to_add, description, package=package
                 )
-                
+            
+            if fulfilled:
                 print(f"✅ Payment verified & tokens added: User {request.user.username} received {tokens_to_add} tokens (session: {session_id})")
                 
                 # Send token purchase email
                 try:
-                    if package_id:
-                        package = TokenPackage.objects.get(id=package_id)
+                    if package:
                         send_token_purchase_email(request.user, package, amount_paid)
-                except TokenPackage.DoesNotExist:
-                    print(f"⚠️ Package {package_id} not found for email notification")
+                    else:
+                        print(f"⚠️ Package {package_id} not found for email notification")
                 except Exception as e:
                     print(f"⚠️ Failed to send token purchase email: {str(e)}")
             else:
@@ -2368,8 +2395,10 @@ def is_admin(user):
     return user.is_staff or user.is_superuser
 
 
+@transaction.non_atomic_requests
 @api_view(["GET"])
 @permission_classes([IsAuthenticated])
+@read_replica
 def admin_list_orders(request):
     """Admin: List all orders with filters"""
     if not is_admin(request.user):
@@ -2380,19 +2409,85 @@ def admin_list_orders(request):
     
     status_filter = request.query_params.get("status")
     
-    orders = Order.objects.all().select_related('user', 'design')
+    orders = Order.objects.for_serializer()
     
     if status_filter:
         orders = orders.filter(status=status_filter)
     
-    serializer = OrderSerializer(orders, many=True, context={'request': request})
+    page, pagination = paginate(request, orders)
+    orders_data = OrderSerializer(page, many=True, context={'request': request}).data
     return Response({
         "success": True,
-        "orders": serializer.data,
-        "count": orders.count()
+        "orders": orders_data,
+        # Total matching orders, not just this page
+        "count": orders.count() if pagination else len(orders_data),
+        **pagination
     })
 
 
+@transaction.non_atomic_requests
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+@read_replica
+def admin_search(request):
+    """
+    Admin: Ranked search over orders, designs and chat messages.
+    ?q=<terms>, optional ?types=orders,designs,messages and ?limit= (max 50).
+    """
+    if not is_admin(request.user):
+        return Response(
+            {"error": "Admin access required"}, 
+            status=status.HTTP_403_FORBIDDEN
+        )
+    
+    term = request.query_params.get("q", "").strip()
+    if not term:
+        return Response(
+            {"error": "q is required"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    types = set(request.query_params.get("types", "orders,designs,messages").split(","))
+    try:
+        limit = max(1, min(int(request.query_params.get("limit", 20)), 50))
+    except ValueError:
+        limit = 20
+    
+    # The database @read_replica picked for this request
+    using = router.db_for_read(Order)
+    results = {"success": True, "query": term}
+    if "orders" in types:
+        results["orders"] = [{
+            "id": order.id,
+            "order_number": order.order_number,
+            "username": order.user.username,
+            "design_name": order.design.name,
+            "status": order.status,
+            "created_at": order.created_at,
+            "rank": order.rank,
+        } for order in search.search_orders(term, limit, using)]
+    if "designs" in types:
+        results["designs"] = [{
+            "id": design.id,
+            "name": design.name,
+            "prompt": design.prompt,
+            "username": design.user.username,
+            "status": design.status,
+            "created_at": design.created_at,
+            "rank": design.rank,
+        } for design in search.search_designs(term, limit, using)]
+    if "messages" in types:
+        results["messages"] = [{
+            "id": message.id,
+            "conversation_id": message.conversation_id,
+            "order_number": message.conversation.order.order_number,
+            "sender_username": message.sender.username,
+            "content": message.content,
+            "created_at": message.created_at,
+            "rank": message.rank,
+        } for message in search.search_messages(term, limit, using)]
+    return Response(results)
+
+
 @api_view(["GET"])
 @permission_classes([IsAuthenticated])
 def admin_get_order(request, order_id):
@@ -2404,7 +2499,7 @@ def admin_get_order(request, order_id):
         )
     
     try:
-        order = Order.objects.select_related('user', 'design').get(id=order_id)
+        order = Order.objects.for_serializer().get(id=order_id)
         return Response({
             "success": True,
             "order": OrderSerializer(order, context={'request': request}).data
@@ -2416,6 +2511,7 @@ def admin_get_order(request, order_id):
         )
 
 
+@transaction.non_atomic_requests
 @api_view(["POST"])
 @permission_classes([IsAuthenticated])
 def admin_upload_files(request, order_id):
@@ -2427,30 +2523,32 @@ def admin_upload_files(request, order_id):
         )
     
     try:
-        order = Order.objects.get(id=order_id)
-        
-        # All supported format codes
-        all_formats = [
-            # Industrial
-            'dst', 'dsb', 'dsz', 'exp', 'tbf', 'fdr', 'stx',
-            # Domestic  
-            'pes', 'pec', 'jef', 'sew', 'hus', 'vip', 'vp3', 'xxx',
-            # Commercial
-            'cmd', 'tap', 'tim', 'emt', '10o', 'ds9'
-        ]
-        
-        # Update order with any uploaded files
-        for format_code in all_formats:
-            file = request.FILES.get(format_code)
-            if file:
-                setattr(order, f'output_{format_code}', file)
+        # Store any uploaded files, one OrderOutputFile per format
+        uploads = {
+            format_code: request.FILES[format_code]
+            for format_code in OUTPUT_FORMATS
+            if request.FILES.get(format_code)
+        }
         
-        # Optional admin notes
-        admin_notes = request.data.get("admin_notes")
-        if admin_notes:
-            order.admin_notes = admin_notes
+        # Parse each new file once and render the stitch preview from it,
+        # before the order row is locked
+        order = Order.objects.select_related('design').get(id=order_id)
+        analysis = analyse_output_uploads(order, uploads) if uploads else None
         
-        order.save()
+        # Replaced files are deleted from storage only once this commits
+        with transaction.atomic():
+            order = Order.objects.select_for_update().get(id=order_id)
+            
+            if uploads:
+                save_output_files(order, uploads, analysis['sha256'])
+                save_upload_analysis(order, analysis)
+            
+            # Optional admin notes
+            admin_notes = request.data.get("admin_notes")
+            if admin_notes:
+                order.admin_notes = admin_notes
+            
+            order.save()
         
         return Response({
             "success": True,
@@ -2555,6 +2653,7 @@ def download_resource(request, resource_id):
         return Response({"error": "Resource not found"}, status=status.HTTP_404_NOT_FOUND)
 
 
+@transaction.non_atomic_requests
 @api_view(["POST"])
 @permission_classes([IsAuthenticated])
 def admin_update_status(request, order_id):
@@ -2577,22 +2676,14 @@ def admin_update_status(request, order_id):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Handle status-specific logic and emails
-        if new_status == 'processing':
-            # Send processing email
-            try:
-                send_order_processing_email(order)
-            except Exception as e:
-                logger.warning(f"Email notification failed for order {order.id}, but order status will still be updated: {str(e)}")
-        
-        elif new_status == 'completed':
+        if new_status == 'completed':
             # Ensure all REQUESTED files are uploaded
             missing_files = []
             requested_formats = order.requested_formats or []
+            uploaded_formats = set(order.output_files.values_list('format', flat=True))
             
             for format_code in requested_formats:
-                file_field = f'output_{format_code}'
-                if not getattr(order, file_field, None):
+                if format_code not in uploaded_formats:
                     missing_files.append(format_code.upper())
             
             if missing_files:
@@ -2605,21 +2696,6 @@ def admin_update_status(request, order_id):
                 )
             
             order.completed_at = timezone.now()
-            order.design.status = 'completed'
-            order.design.save()
-            
-            # Send completion email
-            try:
-                send_order_completed_email(order)
-            except Exception as e:
-                logger.warning(f"Email notification failed for order {order.id}, but order status will still be updated: {str(e)}")
-        
-        elif new_status == 'failed':
-            # Send failure email with admin notes
-            try:
-                send_order_failed_email(order, admin_notes)
-            except Exception as e:
-                logger.warning(f"Email notification failed for order {order.id}, but order status will still be updated: {str(e)}")
         
         order.status = new_status
         
@@ -2630,9 +2706,24 @@ def admin_update_status(request, order_id):
         if admin_notes:
             order.admin_notes = admin_notes
         
-        order.save()
+        with transaction.atomic():
+            if new_status == 'completed':
+                order.design.status = 'completed'
+                order.design.save()
+            order.save()
         logger.info(f"✅ Order {order.order_number} status updated to '{new_status}'")
         
+        # Email only once the new status is committed
+        try:
+            if new_status == 'processing':
+                send_order_processing_email(order)
+            elif new_status == 'completed':
+                send_order_completed_email(order)
+            elif new_status == 'failed':
+                send_order_failed_email(order, admin_notes)
+        except Exception as e:
+            logger.warning(f"Email notification failed for order {order.id}, but order status was updated: {str(e)}")
+        
         return Response({
             "success": True,
             "message": f"Order status updated to {new_status}",
@@ -2981,8 +3072,10 @@ def add_feature_to_design(request):
         }, status=status.HTTP_402_PAYMENT_REQUIRED)
     
     # Deduct tokens and create usage record
-    request.user.profile.tokens -= feature.tokens_required
-    request.user.profile.save()
+    try:
+        ledger.debit(request.user, feature.tokens_required, f"Used feature: {feature.name}")
+    except ledger.InsufficientTokens as e:
+        return insufficient_tokens_response(e, success=False)
     
     # Record the usage
     usage = DesignFeatureUsage.objects.create(
@@ -2995,15 +3088,6 @@ def add_feature_to_design(request):
     design.tokens_used = (design.tokens_used or 0) + feature.tokens_required
     design.save()
     
-    # Record token transaction
-    TokenTransaction.objects.create(
-        user=request.user,
-        transaction_type='feature_usage',
-        tokens_used=feature.tokens_required,
-        design=design,
-        description=f"Used feature: {feature.name}"
-    )
-    
     serializer = DesignFeatureUsageSerializer(usage)
     return Response({
         "success": True,
@@ -3065,22 +3149,15 @@ def remove_feature_from_design(request):
     
     # Refund tokens
     tokens_to_refund = usage.tokens_spent
-    request.user.profile.tokens += tokens_to_refund
-    request.user.profile.save()
+    ledger.credit(
+        request.user, tokens_to_refund, f"Refunded feature: {usage.feature.name}",
+        transaction_type="refund"
+    )
     
     # Update design tokens_used
     design.tokens_used = max(0, (design.tokens_used or 0) - tokens_to_refund)
     design.save()
     
-    # Record refund transaction
-    TokenTransaction.objects.create(
-        user=request.user,
-        transaction_type='feature_refund',
-        tokens_used=-tokens_to_refund,  # Negative for refund
-        design=design,
-        description=f"Refunded feature: {usage.feature.name}"
-    )
-    
     usage.delete()
     
     return Response({
@@ -3090,8 +3167,10 @@ def remove_feature_from_design(request):
     })
 
 
+@transaction.non_atomic_requests
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@read_replica
 def feature_usage_stats(request):
     """Get customer's feature usage statistics"""
     if not request.user.is_staff:
@@ -3101,24 +3180,28 @@ def feature_usage_stats(request):
         # Staff can see all stats
         usages = DesignFeatureUsage.objects.all()
     
-    # Group by feature
-    feature_stats = {}
-    for usage in usages:
-        feature_name = usage.feature.name
-        if feature_name not in feature_stats:
-            feature_stats[feature_name] = {
-                'feature_id': usage.feature.id,
-                'total_usages': 0,
-                'total_tokens_spent': 0
-            }
-        feature_stats[feature_name]['total_usages'] += 1
-        feature_stats[feature_name]['total_tokens_spent'] += usage.tokens_spent
+    # Group by feature in the database
+    from django.db.models import Sum, Count
+    
+    grouped = usages.values('feature_id', 'feature__name').annotate(
+        total_usages=Count('id'),
+        total_tokens_spent=Sum('tokens_spent')
+    ).order_by('feature__name')
+    
+    feature_stats = {
+        row['feature__name']: {
+            'feature_id': row['feature_id'],
+            'total_usages': row['total_usages'],
+            'total_tokens_spent': row['total_tokens_spent'] or 0
+        }
+        for row in grouped
+    }
     
     return Response({
         "success": True,
         "feature_stats": feature_stats,
-        "total_usages": usages.count(),
-        "total_tokens_spent": sum(u.tokens_spent for u in usages)
+        "total_usages": sum(s['total_usages'] for s in feature_stats.values()),
+        "total_tokens_spent": sum(s['total_tokens_spent'] for s in feature_stats.values())
     })
 
 # ============================================================================
@@ -3270,8 +3353,10 @@ def manage_embroidery_size_pricing_detail(request, tier_id):
 # CHAT SYSTEM
 # ============================================================================
 
+@transaction.non_atomic_requests
 @api_view(["GET", "POST"])
 @permission_classes([IsAuthenticated])
+@read_replica
 def conversation_list(request):
     """
     GET: List all conversations for current user (customer or admin)
@@ -3286,12 +3371,17 @@ def conversation_list(request):
             else:
                 # Customers see only their conversations
                 conversations = Conversation.objects.filter(customer=request.user)
+            conversations = conversations.for_list(request.user)
             
-            serializer = ConversationListSerializer(conversations, many=True, context={'request': request})
+            # Pages follow created_at: updated_at moves with every message,
+            # which would shift conversations across page boundaries
+            page, pagination = paginate(request, conversations)
+            serializer = ConversationListSerializer(page, many=True, context={'request': request})
             return Response({
                 "success": True,
                 "conversations": serializer.data,
-                "count": conversations.count()
+                "count": conversations.count() if pagination else len(serializer.data),
+                **pagination
             })
         
         elif request.method == "POST":
@@ -3335,6 +3425,8 @@ def conversation_list(request):
                 "conversation": serializer.data
             }, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
     
+    except InvalidCursor as e:
+        return Response(e.detail, status=e.status_code)
     except Exception as e:
         import traceback
         traceback.print_exc()
@@ -3353,7 +3445,7 @@ def conversation_detail(request, conversation_id):
     """
     try:
         try:
-            conversation = Conversation.objects.get(id=conversation_id)
+            conversation = Conversation.objects.select_related('customer', 'admin', 'order').get(id=conversation_id)
         except Conversation.DoesNotExist:
             return Response(
                 {"error": "Conversation not found"},
@@ -3368,10 +3460,8 @@ def conversation_detail(request, conversation_id):
             )
         
         if request.method == "GET":
-            # Mark all messages as read for current user
-            unread_messages = conversation.messages.filter(is_read=False).exclude(sender=request.user)
-            for message in unread_messages:
-                message.mark_as_read()
+            # Mark all messages as read for current user (bulk UPDATE + watermark)
+            conversation.mark_read(request.user)
             
             serializer = ConversationSerializer(conversation, context={'request': request})
             return Response({
@@ -3452,22 +3542,111 @@ def conversation_detail(request, conversation_id):
         )
 
 
+@transaction.non_atomic_requests
 @api_view(["GET"])
 @permission_classes([IsAuthenticated])
+@read_replica
+def conversation_messages(request, conversation_id):
+    """
+    GET: One page of a conversation's messages, newest first.
+    ?before=<message id> pages back through history, ?after=<message id>
+    returns messages newer than the ones the client already has.
+    """
+    try:
+        try:
+            conversation = Conversation.objects.get(id=conversation_id)
+        except Conversation.DoesNotExist:
+            return Response(
+                {"error": "Conversation not found"},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        
+        if request.user != conversation.customer and not request.user.is_staff:
+            return Response(
+                {"error": "Not authorized"},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        messages, page = paginate_by_id(request, conversation.messages.select_related('sender'))
+        serializer = MessageSerializer(messages, many=True, context={'request': request})
+        return Response({
+            "success": True,
+            "messages": serializer.data,
+            **page
+        })
+    
+    except InvalidCursor as e:
+        return Response(e.detail, status=e.status_code)
+    except Exception as e:
+        return Response(
+            {"error": str(e)},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def conversation_messages_archive(request, conversation_id):
+    """
+    GET: A conversation's archived messages (see archive_history), one month
+    per page, newest first. ?month=YYYY-MM pages back; follow `older_month`
+    until it is null.
+    """
+    try:
+        conversation = Conversation.objects.get(id=conversation_id)
+    except Conversation.DoesNotExist:
+        return Response(
+            {"error": "Conversation not found"},
+            status=status.HTTP_404_NOT_FOUND
+        )
+    
+    if request.user != conversation.customer and not request.user.is_staff:
+        return Response(
+            {"error": "Not authorized"},
+            status=status.HTTP_403_FORBIDDEN
+        )
+    
+    try:
+        messages, page = archive_page(
+            Message, request.query_params.get('month'), conversation_id=conversation.id
+        )
+    except ValueError:
+        return Response({"error": "month must be YYYY-MM"}, status=status.HTTP_400_BAD_REQUEST)
+    
+    # Senders in one query rather than one per archived message
+    senders = User.objects.in_bulk({message.sender_id for message in messages})
+    for message in messages:
+        message.sender = senders.get(message.sender_id)
+    messages = [message for message in messages if message.sender is not None]
+    
+    serializer = MessageSerializer(messages, many=True, context={'request': request})
+    return Response({
+        "success": True,
+        "messages": serializer.data,
+        **page
+    })
+
+
+@transaction.non_atomic_requests
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+@read_replica
 def unread_messages_count(request):
     """Get count of unread messages for current user"""
+    from django.db.models import F
+    
     try:
         if request.user.is_staff:
             # Admin sees all unread messages in their conversations
             unread = Message.objects.filter(
                 conversation__admin=request.user,
-                is_read=False
+                id__gt=F('conversation__staff_last_read_message_id')
             ).exclude(sender=request.user).count()
         else:
             # Customer sees unread messages in their conversations
             unread = Message.objects.filter(
                 conversation__customer=request.user,
-                is_read=False
+                id__gt=F('conversation__customer_last_read_message_id')
             ).exclude(sender=request.user).count()
         
         return Response({
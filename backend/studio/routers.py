@@ -0,0 +1,132 @@
+"""
+Read-replica routing.
+
+Replicas are listed in settings.DATABASE_REPLICAS (see DB_REPLICA_HOSTS).
+Only views decorated with @read_replica read from them, and only for
+GET/HEAD/OPTIONS; every other query, and every write, goes to `default`.
+
+Read-your-writes: a replica may lag the primary, so a user who has just
+written is pinned to `default` for REPLICA_PIN_SECONDS. ReplicaPinMiddleware
+tracks each request, and any write routed to `default` pins its user,
+whatever the HTTP method (a GET that marks messages read writes too). A
+write inside a replica view also switches the rest of that request to
+`default`. Reads inside a transaction on `default` stay there.
+"""
+import contextvars
+import functools
+import random
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_replica_state = contextvars.ContextVar('replica_state', default=None)
+
+
+def _pin_key(user_id):
+    return f"replica:pin:{user_id}"
+
+
+def pin_to_primary(user):
+    """Send `user`'s reads to `default` until the replicas have caught up"""
+    if settings.DATABASE_REPLICAS and user is not None and user.is_authenticated:
+        cache.set(_pin_key(user.pk), True, settings.REPLICA_PIN_SECONDS)
+
+
+def is_pinned(user):
+    return user is not None and user.is_authenticated and bool(cache.get(_pin_key(user.pk)))
+
+
+class _RequestState:
+    def __init__(self, request):
+        self.request = request
+        # Replica serving this request's reads, while inside a replica view
+        self.alias = None
+        self.wrote = False
+
+    @property
+    def user(self):
+        # DRF sets request.user on the underlying request once it authenticates
+        return getattr(self.request, 'user', None)
+
+
+def read_replica(view):
+    """
+    Serve a read-only view's queries from a replica unless the user is
+    pinned to the primary. Goes below @api_view/@permission_classes (it
+    needs the authenticated DRF request); the view must also be marked
+    @transaction.non_atomic_requests, or ATOMIC_REQUESTS keeps it on
+    `default`.
+    """
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        replicas = settings.DATABASE_REPLICAS
+        if not replicas or request.method not in SAFE_METHODS or is_pinned(request.user):
+            return view(request, *args, **kwargs)
+        state = _replica_state.get()
+        token = None
+        if state is None:
+            # Called without ReplicaPinMiddleware (e.g. directly in tests)
+            state = _RequestState(request)
+            token = _replica_state.set(state)
+        if state.wrote:
+            return view(request, *args, **kwargs)
+        state.alias = random.choice(replicas)
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            state.alias = None
+            if token is not None:
+                _replica_state.reset(token)
+    return wrapper
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _replica_state.get()
+        if state is None or state.alias is None or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return state.alias
+
+    def db_for_write(self, model, **hints):
+        state = _replica_state.get()
+        if state is not None and not state.wrote:
+            # Whatever this request, and the user's next ones, read must see the write
+            state.wrote = True
+            state.alias = None
+            pin_to_primary(state.user)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema from the primary
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
+
+
+class ReplicaPinMiddleware:
+    """Pin the user to the primary after any request that wrote to it"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        state = _RequestState(request)
+        token = _replica_state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _replica_state.reset(token)
+        if state.wrote:
+            # A write before authentication finished could not pin; the user is known now
+            pin_to_primary(state.user)
+        return response
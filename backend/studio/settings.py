@@ -43,6 +43,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'studio.routers.ReplicaPinMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -93,6 +94,30 @@ else:
         }
     }
 
+# Optional read replicas, used only by @read_replica views (studio/routers.py).
+# PostgreSQL: DB_REPLICA_HOSTS=replica1.internal,replica2.internal (streaming
+# replicas of DB_HOST, same credentials). SQLite, to exercise the routing
+# locally: DB_SQLITE_REPLICA=path/to/copy.sqlite3.
+DATABASE_REPLICAS = []
+if DB_ENGINE == 'django.db.backends.postgresql':
+    replica_settings = [{'HOST': host} for host in parse_csv_env('DB_REPLICA_HOSTS')]
+else:
+    replica_settings = [{'NAME': os.getenv('DB_SQLITE_REPLICA')}] if os.getenv('DB_SQLITE_REPLICA') else []
+for index, overrides in enumerate(replica_settings, start=1):
+    alias = f'replica{index}'
+    DATABASES[alias] = {
+        **DATABASES['default'],
+        **overrides,
+        'ATOMIC_REQUESTS': False,
+        # Tests read the test database through the replica aliases
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['studio.routers.ReplicaRouter']
+# Seconds a user's reads stay on the primary after a write (covers replica lag)
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', '10'))
+
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
     {'NAME': 'django.contrib.auth.password_validation.MinimumLengthValidator'},
@@ -159,6 +184,20 @@ REST_FRAMEWORK = {
     ],
 }
 
+# Shared cache. Workers use it to invalidate their in-process copies of
+# pricing and configuration (see api/caching.py), so it must be visible to
+# every gunicorn worker: file-based by default, any Django backend via env.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', '/tmp/studio_cache'),
+    }
+}
+
+# Keyset pagination for list endpoints (?paginate=1)
+API_PAGE_SIZE = int(os.getenv('API_PAGE_SIZE', 50))
+API_MAX_PAGE_SIZE = int(os.getenv('API_MAX_PAGE_SIZE', 200))
+
 # Request/Response Timeouts
 REQUEST_TIMEOUT = 180  # 3 minutes for heavy operations
 CELERY_TASK_TIME_LIMIT = 300  # 5 minutes
@@ -176,6 +215,47 @@ DATA_UPLOAD_MAX_MEMORY_SIZE = 10485760  # 10MB
 ALLOWED_IMAGE_FORMATS = ['jpg', 'jpeg', 'png', 'webp']
 MAX_IMAGE_SIZE = 5242880  # 5MB
 
+# Raster-to-stitch digitizer
+DIGITIZER_WORKERS = int(os.getenv('DIGITIZER_WORKERS', os.cpu_count() or 1))
+DIGITIZER_TILE_SIZE = int(os.getenv('DIGITIZER_TILE_SIZE', 512))
+DIGITIZER_NUM_COLORS = int(os.getenv('DIGITIZER_NUM_COLORS', 8))
+# Images with fewer pixels are digitized in-process, larger ones tile by tile in the pool
+DIGITIZER_PARALLEL_MIN_PIXELS = int(os.getenv('DIGITIZER_PARALLEL_MIN_PIXELS', 1024 * 1024))
+
+# Machine speed (stitches per minute) by brand, used for sew-time estimates.
+# Keys are matched case-insensitively against Design.machine_brand.
+# Override with MACHINE_BRAND_SPM="brother:900,janome:800".
+MACHINE_BRAND_SPM = {
+    'brother': 850,
+    'babylock': 850,
+    'janome': 860,
+    'bernina': 1000,
+    'husqvarna': 850,
+    'pfaff': 850,
+    'singer': 700,
+    'tajima': 1000,
+    'melco': 1200,
+    'barudan': 1000,
+    'happy': 1000,
+}
+MACHINE_BRAND_SPM.update({
+    brand.strip().lower(): int(spm)
+    for brand, _, spm in (
+        item.partition(':') for item in os.getenv('MACHINE_BRAND_SPM', '').split(',') if ':' in item
+    )
+})
+MACHINE_DEFAULT_SPM = int(os.getenv('MACHINE_DEFAULT_SPM', 800))
+
+# Density-aware pricing: the size price is multiplied by the factor of the
+# first tier whose fill coverage (0-1, from the pre-order stitch estimate)
+# the design does not exceed. Off by default, prices are size-only.
+DENSITY_PRICING_ENABLED = os.getenv('DENSITY_PRICING_ENABLED', 'False') == 'True'
+DENSITY_PRICE_TIERS = [
+    (0.35, 1.0),   # outlines, line art
+    (0.65, 1.25),  # mixed fill
+    (1.0, 1.5),    # solid fill
+]
+
 # Security Settings for Production
 SECURE_SSL_REDIRECT = os.getenv('SECURE_SSL_REDIRECT', 'False') == 'True'
 SESSION_COOKIE_SECURE = os.getenv('SESSION_COOKIE_SECURE', 'False') == 'True'
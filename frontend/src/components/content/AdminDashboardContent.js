@@ -892,6 +892,18 @@ function AdminDashboardContent({ onChatClick }) {
                       </div>
                     )
                   )}
+                  {selectedOrder.stitch_preview_thumbnail && (
+                    <div>
+                      <p style={{ fontSize: "12px", color: "#6b7280", marginBottom: "8px" }}>{t("adminDashboard.stitchPreview")}</p>
+                      <a href={selectedOrder.stitch_preview || selectedOrder.stitch_preview_thumbnail} target="_blank" rel="noopener noreferrer">
+                        <img
+                          src={selectedOrder.stitch_preview_thumbnail}
+                          alt={t("adminDashboard.stitchPreview")}
+                          style={{ width: "150px", height: "150px", borderRadius: "8px", objectFit: "contain", background: "#ffffff", border: "2px solid #e5e7eb" }}
+                        />
+                      </a>
+                    </div>
+                  )}
                 </div>
                 <div style={{ display: "grid", gridTemplateColumns: "1fr 1fr", gap: "12px" }}>
                   <div>
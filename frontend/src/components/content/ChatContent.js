@@ -130,6 +130,37 @@ function ChatContent({ userRole }) {
     }
   };
 
+  const loadEarlierMessages = async () => {
+    const page = selectedConversation?.messages_page;
+    if (!page?.has_more) return;
+    try {
+      setLoading(true);
+      const response = await fetch(
+        `${API_BASE_URL}/chat/conversations/${selectedConversation.id}/messages/?before=${page.before}`,
+        {
+          headers: {
+            Authorization: `Bearer ${localStorage.getItem("access_token")}`,
+          },
+        }
+      );
+
+      const data = await response.json();
+      if (data.success) {
+        // The endpoint returns newest first; the thread is shown oldest first
+        setSelectedConversation((current) => ({
+          ...current,
+          messages: [...data.messages.reverse(), ...current.messages],
+          messages_page: { ...current.messages_page, before: data.before, has_more: data.has_more },
+        }));
+      }
+    } catch (error) {
+      console.error("Failed to load earlier messages:", error);
+      setMessage(t("chatContent.failedLoadConversation"));
+    } finally {
+      setLoading(false);
+    }
+  };
+
   const handleFileSelect = (e) => {
     const file = e.target.files[0];
     if (!file) return;
@@ -196,8 +227,12 @@ function ChatContent({ userRole }) {
         setNewMessage("");
         clearSelectedFile();
         setMessage("");
-        // Reload the conversation to see the new message
-        await loadConversationDetail(selectedConversation.id);
+        // Append the sent message; reloading would drop earlier pages already loaded
+        setSelectedConversation((current) => ({
+          ...current,
+          messages: [...current.messages, data.data],
+          messages_page: { ...current.messages_page, after: data.data.id },
+        }));
       } else {
         setMessage(`❌ ${data.error || t("chatContent.failedSend")}`);
       }
@@ -338,6 +373,15 @@ function ChatContent({ userRole }) {
 
             {/* Messages */}
             <div className="messages-area">
+              {selectedConversation.messages_page?.has_more && (
+                <button
+                  onClick={loadEarlierMessages}
+                  className="load-earlier-btn"
+                  disabled={loading}
+                >
+                  {t("chatContent.loadEarlier")}
+                </button>
+              )}
               {selectedConversation.messages.length === 0 ? (
                 <div className="empty-messages">
                   <MessageCircle size={48} color="#D1D5DB" />
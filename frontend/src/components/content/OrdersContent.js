@@ -326,6 +326,27 @@ function OrdersContent({ onChatClick }) {
           </div>
         )}
 
+        {/* Stitch Preview (rendered from the uploaded embroidery file) */}
+        {order.stitch_preview_thumbnail && (
+          <a href={order.stitch_preview || order.stitch_preview_thumbnail} target="_blank" rel="noopener noreferrer">
+            <p style={{ fontSize: "11px", color: "#6b7280", margin: "0 0 4px 0" }}>{t("orders.stitchPreview")}</p>
+            <img
+              src={order.stitch_preview_thumbnail}
+              alt={t("orders.stitchPreview")}
+              loading="lazy"
+              style={{
+                width: "100%",
+                height: "120px",
+                borderRadius: "8px",
+                objectFit: "contain",
+                background: "#ffffff",
+                border: "2px solid #e5e7eb",
+                marginBottom: "10px",
+              }}
+            />
+          </a>
+        )}
+
         {/* Downloads */}
         {order.status === "completed" && (
           <div className="order-files">
@@ -725,7 +725,7 @@ function SettingsContent({ isAdmin = false }) {
                         {transaction.description || t("common.na")}
                       </td>
                       <td style={{ padding: "8px 6px", fontSize: "11px", fontWeight: "600", color: "#111827", textAlign: "right" }}>
-                        {transaction.balance_after || t("common.na")}
+                        {transaction.balance_after ?? t("common.na")}
                       </td>
                     </tr>
                   ))}
@@ -130,6 +130,7 @@ const resources = {
         machine: "Machine",
         format: "Format",
         notSpecified: "Not specified",
+        stitchPreview: "Stitch Preview",
         downloadFormats: "Download Formats",
         tokensUsed: "Tokens Used",
         chat: "Chat",
@@ -338,6 +339,7 @@ const resources = {
         unassigned: "Unassigned",
         noAdminAssigned: "No admin assigned",
         noMessages: "No messages yet. Start the conversation!",
+        loadEarlier: "Load earlier messages",
         attachment: "attachment",
         file: "File",
         removeAttachment: "Remove attachment",
@@ -454,6 +456,7 @@ const resources = {
         email: "Email",
         designInfo: "Design Information",
         designPreview: "Design Preview",
+        stitchPreview: "Stitch Preview",
         image: "Image",
         designImage: "Design Image",
         designName: "Design Name",
@@ -778,6 +781,7 @@ const resources = {
         machine: "Machine",
         format: "Format",
         notSpecified: "Non spécifié",
+        stitchPreview: "Aperçu des points",
         downloadFormats: "Formats téléchargeables",
         tokensUsed: "Jetons utilisés",
         chat: "Chat",
@@ -986,6 +990,7 @@ const resources = {
         unassigned: "Non attribué",
         noAdminAssigned: "Aucun admin attribué",
         noMessages: "Aucun message pour le moment. Lancez la conversation !",
+        loadEarlier: "Charger les messages précédents",
         attachment: "pièce jointe",
         file: "Fichier",
         removeAttachment: "Retirer la pièce jointe",
@@ -1102,6 +1107,7 @@ const resources = {
         email: "Email",
         designInfo: "Informations du design",
         designPreview: "Aperçu du design",
+        stitchPreview: "Aperçu des points",
         image: "Image",
         designImage: "Image du design",
         designName: "Nom du design",